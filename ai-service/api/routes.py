@@ -195,13 +195,15 @@ import time
 from datetime import datetime, timedelta
 from threading import Lock
 
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, Response, stream_with_context
 from . import api_bp
 
 from config import Config
 from models.face_recognition_model import FaceRecognitionModel
+from models.encoding_transfer import MIME_TYPE as TRANSFER_MIME_TYPE
 from utils.image_processing import ImageProcessor
 from utils.face_detector import FaceDetector
+from utils.batch_recognition import PACKED_MIME_TYPE, unpack_images
 
 # Optional mongodb
 try:
@@ -245,6 +247,77 @@ def success_response(data=None, message="Success", status=200):
 def error_response(message="Error", status=400, data=None):
     return jsonify({'success': False, 'message': message, 'data': data}), status
 
+# Body là ảnh nén nguyên bản (không base64, không multipart); tham số đi qua query string
+RAW_IMAGE_MIMETYPES = ('application/octet-stream', 'image/jpeg', 'image/png')
+
+def _is_raw_upload():
+    return request.mimetype in RAW_IMAGE_MIMETYPES
+
+def _request_params():
+    """Tham số của request: JSON, form (multipart) hoặc query string (upload nhị phân)"""
+    if request.is_json:
+        return request.json
+    if _is_raw_upload():
+        return request.args
+    return request.form
+
+class PayloadTooLarge(Exception):
+    """Body vượt giới hạn kích thước (trả 413)"""
+
+def _read_body(limit=None):
+    """
+    Đọc body thẳng từ request stream vào một buffer cấp phát một lần (không qua bản sao trung gian)
+    Raises: PayloadTooLarge nếu body lớn hơn limit byte (mặc định Config.MAX_IMAGE_SIZE), kiểm tra
+            Content-Length trước khi cấp phát và không đọc quá limit khi không có Content-Length
+    """
+    limit = Config.MAX_IMAGE_SIZE if limit is None else limit
+    length = request.content_length
+    stream = request.stream
+    if length is not None and length > limit:
+        raise PayloadTooLarge(f"Request body too large (max {limit} bytes)")
+    if not length or not hasattr(stream, 'readinto'):
+        data = stream.read(limit + 1)
+        if len(data) > limit:
+            raise PayloadTooLarge(f"Request body too large (max {limit} bytes)")
+        return data
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        n = stream.readinto(view[received:])
+        if not n:
+            break
+        received += n
+    return view[:received]
+
+def _request_frame():
+    """
+    Frame (chưa decode) từ body nhị phân (application/octet-stream, image/jpeg, image/png),
+    file 'image' (multipart) hoặc JSON {'image': base64}; None nếu không có ảnh
+    """
+    if _is_raw_upload():
+        data = _read_body()
+        return face_model.pipeline.frame(data=data) if len(data) else None
+    if 'image' in request.files:
+        return face_model.pipeline.frame(data=request.files['image'].read())
+    if request.is_json and 'image' in request.json:
+        return face_model.pipeline.frame(base64_data=request.json['image'])
+    return None
+
+def _timings(frame):
+    """Thời gian từng stage của pipeline (ms)"""
+    return {stage: round(ms, 2) for stage, ms in frame.timings.items()}
+
+def _invalid_frame(frame):
+    """Lỗi cho frame không dùng được: ảnh lỗi (400) hoặc bị cổng chất lượng loại (422 + mã lý do)"""
+    if frame is not None and frame.reject_reason is not None:
+        return error_response(face_model.pipeline.reject_message(frame), 422, {
+            'reject_reason': frame.reject_reason,
+            'quality': frame.quality,
+            'timings_ms': _timings(frame)
+        })
+    return error_response("No valid image provided", 400)
+
 def _save_attendance_records_to_file(records):
     with _storage_lock:
         try:
@@ -340,12 +413,14 @@ def attendance_mark():
     Payload:
       - classroom_id (optional)
       - timestamp (optional, ISO string)
-      - image: multipart file 'image' or JSON {'image': base64}
+      - image: raw body (application/octet-stream, image/jpeg, image/png; params in query string),
+               multipart file 'image' or JSON {'image': base64}
     Response: list of recognized students with confidence and stored records
     """
     try:
-        classroom_id = request.form.get('classroom_id') or (request.json.get('classroom_id') if request.is_json else None)
-        timestamp = request.form.get('timestamp') or (request.json.get('timestamp') if request.is_json else None)
+        params = _request_params()
+        classroom_id = params.get('classroom_id')
+        timestamp = params.get('timestamp')
         if timestamp:
             try:
                 ts = datetime.fromisoformat(timestamp)
@@ -354,20 +429,17 @@ def attendance_mark():
         else:
             ts = datetime.utcnow()
 
-        image = None
         # accept file or base64
-        if 'image' in request.files:
-            f = request.files['image']
-            image = image_processor.load_image_from_bytes(f.read())
-        elif request.is_json and 'image' in request.json:
-            image = image_processor.load_image_from_base64(request.json['image'])
-
-        if image is None:
-            return error_response("No valid image provided", 400)
-
-        # preprocess and recognize multiple faces
-        processed = image_processor.preprocess_for_recognition(image)
-        results, msg = face_model.recognize_multiple_faces(processed)
+        frame = _request_frame()
+        if frame is None or not face_model.pipeline.prepare(frame):
+            return _invalid_frame(frame)
+
+        # recognize multiple faces on the preprocessed frame (each stage runs once)
+        results, msg = face_model.recognize_multiple_faces(
+            frame,
+            unique_assignment=Config.FACE_UNIQUE_ASSIGNMENT,
+            classroom_id=classroom_id
+        )
         stored = []
         for r in results:
             student_id = r.get('student_id')
@@ -388,11 +460,164 @@ def attendance_mark():
             ok = _store_attendance(record)
             if ok:
                 stored.append(record)
-        return success_response({'recognized': results, 'stored': stored}, f"Attendance processed. {len(stored)} records stored")
+        return success_response({'recognized': results, 'stored': stored, 'timings_ms': _timings(frame),
+                                 'cache_hit': frame.cache_hit, 'enhancement': frame.enhancement},
+                                f"Attendance processed. {len(stored)} records stored")
+    except PayloadTooLarge as e:
+        return error_response(str(e), 413)
     except Exception as e:
         print(f"Error in attendance_mark: {e}")
         return error_response(f"Internal server error: {str(e)}", 500)
 
+@api_bp.route('/classroom/<classroom_id>/roster', methods=['GET', 'PUT', 'DELETE'])
+def classroom_roster(classroom_id):
+    """
+    Quản lý roster của lớp (sub-gallery dùng khi nhận diện theo classroom_id).
+    PUT payload: JSON {'student_ids': [...]}
+    Lớp không có roster sẽ được so khớp với toàn bộ gallery.
+    """
+    try:
+        if request.method == 'GET':
+            roster = face_model.get_classroom_roster(classroom_id)
+            if roster is None:
+                return error_response(f"Classroom {classroom_id} has no roster", 404)
+            return success_response({'classroom_id': classroom_id, 'student_ids': roster}, "Roster retrieved")
+
+        if request.method == 'DELETE':
+            ok, message = face_model.delete_classroom_roster(classroom_id)
+            if not ok:
+                return error_response(message, 404)
+            return success_response({'classroom_id': classroom_id}, message)
+
+        student_ids = request.json.get('student_ids') if request.is_json else None
+        if not isinstance(student_ids, list):
+            return error_response("student_ids (list) is required", 400)
+        ok, message = face_model.set_classroom_roster(classroom_id, [str(s) for s in student_ids])
+        if not ok:
+            return error_response(message, 500)
+        return success_response({
+            'classroom_id': classroom_id,
+            'total': len(face_model.get_classroom_roster(classroom_id))
+        }, message)
+    except Exception as e:
+        print(f"Error in classroom_roster: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
+@api_bp.route('/face/recognize', methods=['POST'])
+def face_recognize():
+    """
+    Nhận diện một khuôn mặt, trả về top-k ứng viên + margin giữa hạng 1 và hạng 2
+    để phía gọi quyết định chấp nhận/từ chối trong một lần gọi (không cần retry).
+    Payload:
+      - image: raw body (application/octet-stream, image/jpeg, image/png; params in query string),
+               multipart file 'image' or JSON {'image': base64}
+      - top_k (optional), classroom_id (optional), min_margin (optional)
+    """
+    try:
+        params = _request_params()
+        top_k = int(params.get('top_k') or Config.FACE_TOP_K)
+        classroom_id = params.get('classroom_id')
+        min_margin = params.get('min_margin')
+        min_margin = float(min_margin) if min_margin is not None else None
+
+        frame = _request_frame()
+        if frame is None or not face_model.pipeline.prepare(frame):
+            return _invalid_frame(frame)
+
+        result, message = face_model.recognize_face_top_k(
+            frame, k=top_k, classroom_id=classroom_id, min_margin=min_margin
+        )
+        if result is None:
+            return error_response(message, 404, {'recognized': False, 'timings_ms': _timings(frame)})
+        result['timings_ms'] = _timings(frame)
+        result['cache_hit'] = frame.cache_hit
+        result['enhancement'] = frame.enhancement
+        return success_response(result, message)
+    except PayloadTooLarge as e:
+        return error_response(str(e), 413)
+    except Exception as e:
+        print(f"Error in face_recognize: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
+@api_bp.route('/face/bulk-upsert', methods=['POST'])
+def face_bulk_upsert():
+    """
+    Đồng bộ encodings của nhiều sinh viên trong một request.
+    Payload: JSON {'students': [{'student_id': ..., 'encodings': [[128 floats], ...],
+                                 'name': ..., 'class': ...}, ...],  (name, class tùy chọn)
+             'sync': true | false}  (false: trả về ngay, ghi xuống đĩa ở nền)
+    """
+    try:
+        students = request.json.get('students') if request.is_json else None
+        if not isinstance(students, list):
+            return error_response("students (list) is required", 400)
+        items = []
+        infos = {}
+        for s in students:
+            if not s.get('student_id') or not s.get('encodings'):
+                return error_response("Each student needs student_id and encodings", 400)
+            items.append((str(s['student_id']), s['encodings']))
+            if s.get('name') or s.get('class'):
+                infos[str(s['student_id'])] = {'name': s.get('name'), 'class': s.get('class')}
+        sync = request.json.get('sync')
+        ok, message, created, updated = face_model.bulk_upsert_encodings(items, infos, sync=sync)
+        if not ok:
+            return error_response(message, 400)
+        return success_response({'created': created, 'updated': updated}, message)
+    except Exception as e:
+        print(f"Error in face_bulk_upsert: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
+@api_bp.route('/face/bulk-delete', methods=['POST'])
+def face_bulk_delete():
+    """
+    Xóa encodings của nhiều sinh viên.
+    Payload: JSON {'student_ids': [...], 'sync': true | false}
+    """
+    try:
+        student_ids = request.json.get('student_ids') if request.is_json else None
+        if not isinstance(student_ids, list):
+            return error_response("student_ids (list) is required", 400)
+        sync = request.json.get('sync')
+        ok, message, removed = face_model.bulk_delete_faces([str(s) for s in student_ids], sync=sync)
+        if not ok:
+            return error_response(message, 500)
+        return success_response({'removed': removed}, message)
+    except Exception as e:
+        print(f"Error in face_bulk_delete: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
+@api_bp.route('/face/export', methods=['GET'])
+def face_export():
+    """
+    Export toàn bộ encodings + thông tin sinh viên (định dạng cột nhị phân, stream theo khối).
+    Query: chunk (số sinh viên mỗi khối, tùy chọn)
+    """
+    try:
+        chunk_size = request.args.get('chunk', type=int)
+        chunks = face_model.export_encodings(chunk_size)
+        return Response(stream_with_context(chunks), mimetype=TRANSFER_MIME_TYPE,
+                        headers={'Content-Disposition': 'attachment; filename=gallery.fgal'})
+    except Exception as e:
+        print(f"Error in face_export: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
+@api_bp.route('/face/import', methods=['POST'])
+def face_import():
+    """
+    Nhập encodings từ file export (body application/octet-stream, đọc theo khối).
+    Query: replace=true để xóa sinh viên không có trong file
+    """
+    try:
+        replace = request.args.get('replace', 'false').lower() == 'true'
+        ok, message, created, updated, removed = face_model.import_encodings(request.stream, replace)
+        if not ok:
+            return error_response(message, 400)
+        return success_response({'created': created, 'updated': updated, 'removed': removed}, message)
+    except Exception as e:
+        print(f"Error in face_import: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
 @api_bp.route('/attendance/stats', methods=['GET'])
 def attendance_stats():
     """
@@ -438,30 +663,93 @@ def attendance_stats():
         print(f"Error in attendance_stats: {e}")
         return error_response(f"Internal server error: {str(e)}", 500)
 
+@api_bp.route('/face/recognize/batch', methods=['POST'])
+def face_recognize_batch():
+    """
+    Nhận diện nhiều ảnh trong một request: decode song song, detect + encode trên process worker,
+    các ảnh xong cùng đợt được match chung một lần với gallery.
+    Payload:
+      - images: body nhị phân application/x-image-batch ([uint32 big-endian độ dài][bytes ảnh] lặp lại,
+                params in query string), multipart files 'images' or JSON {'images': [base64, ...]}
+      - classroom_id (optional), unique (optional, mặc định FACE_UNIQUE_ASSIGNMENT)
+    Response: NDJSON, mỗi dòng là kết quả một ảnh (theo thứ tự xử lý xong, có 'index'),
+              dòng cuối {'done': true, ...}
+    """
+    try:
+        start = time.perf_counter()
+        if request.mimetype == PACKED_MIME_TYPE:
+            params = request.args
+            # Mỗi ảnh tối đa MAX_IMAGE_SIZE + 4 byte độ dài
+            limit = (Config.MAX_IMAGE_SIZE + 4) * Config.BATCH_MAX_IMAGES
+            try:
+                frames = [face_model.pipeline.frame(data=data) for data in unpack_images(_read_body(limit))]
+            except PayloadTooLarge as e:
+                return error_response(str(e), 413)
+            except ValueError as e:
+                return error_response(str(e), 400)
+        elif request.is_json:
+            params = request.json
+            frames = [face_model.pipeline.frame(base64_data=data) for data in params.get('images') or []]
+        else:
+            params = request.form
+            frames = [face_model.pipeline.frame(data=f.read()) for f in request.files.getlist('images')]
+        if not frames:
+            return error_response("No images provided", 400)
+        if len(frames) > Config.BATCH_MAX_IMAGES:
+            return error_response(f"Too many images (max {Config.BATCH_MAX_IMAGES})", 413)
+
+        classroom_id = params.get('classroom_id')
+        unique = params.get('unique')
+        unique = Config.FACE_UNIQUE_ASSIGNMENT if unique is None else str(unique).lower() in ('true', '1')
+
+        def lines():
+            recognized = 0
+            for index, results, message, frame in face_model.recognize_batch(
+                frames, unique_assignment=unique, classroom_id=classroom_id
+            ):
+                recognized += sum(1 for r in results if r['student_id'] is not None)
+                line = {
+                    'index': index,
+                    'success': message == "Success",
+                    'message': message,
+                    'recognized': results,
+                    'timings_ms': _timings(frame),
+                    'cache_hit': frame.cache_hit
+                }
+                if frame.reject_reason is not None:
+                    line['reject_reason'] = frame.reject_reason
+                yield json.dumps(line) + '\n'
+            yield json.dumps({'done': True, 'images': len(frames), 'recognized': recognized,
+                              'total_ms': round((time.perf_counter() - start) * 1000, 2)}) + '\n'
+
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+    except Exception as e:
+        print(f"Error in face_recognize_batch: {e}")
+        return error_response(f"Internal server error: {str(e)}", 500)
+
 @api_bp.route('/fraud/detect', methods=['POST'])
 def fraud_detect():
     """
-    Heuristic fraud detection for single image:
+    Heuristic fraud detection for single image (raw body, multipart 'image' or JSON base64):
       - checks multiple faces
       - blur score and brightness (via FaceDetector.is_face_clear)
       - if blur too low -> suspicious (possible printed photo)
     Returns indicators for UI/alerting.
     """
     try:
-        image = None
-        if 'image' in request.files:
-            f = request.files['image']
-            image = image_processor.load_image_from_bytes(f.read())
-        elif request.is_json and 'image' in request.json:
-            image = image_processor.load_image_from_base64(request.json['image'])
-        else:
+        frame = _request_frame()
+        if frame is None:
             return error_response("No image provided", 400)
 
-        if image is None:
-            return error_response("Invalid image", 400)
+        if face_model.pipeline.preprocess(frame) is None:
+            if frame.reject_reason is None:
+                return error_response("Invalid image", 400)
+            # Frame bị cổng chất lượng loại: báo lý do thay vì chạy detect
+            indicators = {'faces_detected': 0, 'result': 'low_quality',
+                          'reject_reason': frame.reject_reason, 'quality': frame.quality}
+            return success_response(indicators, face_model.pipeline.reject_message(frame))
 
-        processed = image_processor.preprocess_for_recognition(image)
-        face_locations = face_detector.detect_faces(processed)
+        face_locations = face_model.pipeline.detect(frame)
         indicators = {
             'faces_detected': len(face_locations),
             'multiple_faces': len(face_locations) > 1
@@ -472,7 +760,7 @@ def fraud_detect():
 
         # check first face
         fl = face_locations[0]
-        is_clear, metrics = face_detector.is_face_clear(processed, fl)
+        is_clear, metrics = face_detector.is_face_clear(frame.image, fl)
         indicators.update(metrics)
 
         # apply heuristic rules
@@ -489,6 +777,8 @@ def fraud_detect():
         indicators['suspicious_reasons'] = suspicious_reasons
 
         return success_response(indicators, "Fraud check completed")
+    except PayloadTooLarge as e:
+        return error_response(str(e), 413)
     except Exception as e:
         print(f"Error in fraud_detect: {e}")
         return error_response(f"Internal server error: {str(e)}", 500)
@@ -521,6 +811,9 @@ def stream_recognize():
         fps = cap.get(_cv2.CAP_PROP_FPS) or 0
         processed_frames = 0
         recognized_summary = {}  # student_id -> {count, confidences}
+        stage_totals = {}  # stage -> tổng ms trên các frame đã quét
+        skipped = {}  # mã lý do -> số frame bị cổng chất lượng loại
+        enhancements = {}  # nhánh enhance -> số frame
 
         idx = 0
         while True:
@@ -532,8 +825,22 @@ def stream_recognize():
                 continue
             # frame is BGR; convert to RGB
             frame_rgb = _cv2.cvtColor(frame, _cv2.COLOR_BGR2RGB)
-            processed = image_processor.preprocess_for_recognition(frame_rgb)
-            results, msg = face_model.recognize_multiple_faces(processed)
+            pipeline_frame = face_model.pipeline.frame(frame_rgb)
+            if face_model.pipeline.gate(pipeline_frame):
+                results, msg = face_model.recognize_multiple_faces(
+                    pipeline_frame,
+                    unique_assignment=Config.FACE_UNIQUE_ASSIGNMENT,
+                    classroom_id=classroom_id
+                )
+            else:
+                # Frame tối / cháy sáng / mờ: bỏ qua, đếm theo lý do
+                results = []
+                reason = pipeline_frame.reject_reason or 'invalid'
+                skipped[reason] = skipped.get(reason, 0) + 1
+            for stage, ms in pipeline_frame.timings.items():
+                stage_totals[stage] = stage_totals.get(stage, 0) + ms
+            if pipeline_frame.enhancement is not None:
+                enhancements[pipeline_frame.enhancement] = enhancements.get(pipeline_frame.enhancement, 0) + 1
             for r in results:
                 sid = r.get('student_id')
                 conf = r.get('confidence', 0)
@@ -557,7 +864,9 @@ def stream_recognize():
                 'count': info['count'],
                 'avg_confidence': sum(info['confidences']) / len(info['confidences'])
             })
-        meta = {'frames_scanned': processed_frames, 'video_frames': frame_count, 'fps': fps}
+        meta = {'frames_scanned': processed_frames, 'video_frames': frame_count, 'fps': fps,
+                'frames_skipped': skipped, 'enhancement': enhancements,
+                'timings_ms': {stage: round(ms, 2) for stage, ms in stage_totals.items()}}
         return success_response({'summary': resp, 'meta': meta}, "Video processed")
     except Exception as e:
         print(f"Error in stream_recognize: {e}")
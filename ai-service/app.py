@@ -666,49 +666,17 @@
 #     print(f"🔌 Port: {Config.FLASK_PORT}")
 #     print("="*60)
 #     app.run(host=Config.FLASK_HOST, port=Config.FLASK_PORT, debug=Config.FLASK_DEBUG)
-import os
 import cv2
-import pickle
 import numpy as np
 import face_recognition
 from flask import Flask, jsonify, Response, render_template
 from flask_cors import CORS
 from config import Config
-from api import api_bp
+from utils.image_processing import ImageProcessor
 import requests
 import platform
 from threading import Lock
 
-# ====== Load encodings sinh viên ======
-encodings_path = os.path.join(Config.BASE_DIR, 'data', 'encodings')
-known_face_encodings = []
-known_face_data = []  # dict with id + name + class
-
-for file in os.listdir(encodings_path):
-    if file.endswith('.pkl'):
-        student_id = os.path.splitext(file)[0]
-        with open(os.path.join(encodings_path, file), 'rb') as f:
-            data = pickle.load(f)
-
-        if isinstance(data, dict) and "encodings" in data:
-            enc_list = data["encodings"]
-        elif isinstance(data, list):
-            enc_list = data
-        else:
-            enc_list = [data]
-
-        for enc in enc_list:
-            if isinstance(enc, np.ndarray):
-                known_face_encodings.append(enc)
-                # Lưu thông tin student: idsv, name, class
-                known_face_data.append({
-                    'student_id': student_id,
-                    'name': student_id,      # có thể thay bằng tên thật nếu lưu
-                    'class': 'Class_01'      # ví dụ, sửa theo dữ liệu thật
-                })
-
-print(f"✅ Loaded {len(known_face_encodings)} encodings from {len(set(d['student_id'] for d in known_face_data))} students.")
-
 # Dữ liệu realtime của các sinh viên đang nhìn camera
 current_faces = []
 faces_lock = Lock()
@@ -729,6 +697,18 @@ def mark_attendance(student):
 
 
 def create_app():
+    # Import API (khởi tạo model, store, thread hot reload) trong hàm chứ không ở mức module:
+    # process worker của batch recognition (spawn) chạy lại app.py dưới tên __mp_main__,
+    # import app.py phải không có side effect
+    from api import api_bp
+    from api.routes import face_model
+
+    # ====== Encodings sinh viên ======
+    # Dùng chung store của API (snapshot mmap + log, kèm name/class) - đã bật hot reload:
+    # encoding mới từ generate_encodings.py hoặc API được nạp mà không cần restart camera stream
+    encoding_store = face_model.store
+    print(f"✅ Loaded {len(encoding_store.gallery)} encodings from {encoding_store.gallery.num_students} students.")
+
     app = Flask(__name__)
     app.config.from_object(Config)
     Config.init_app()
@@ -767,19 +747,27 @@ def create_app():
             rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
         try:
-            face_locations = face_recognition.face_locations(rgb_frame)
+            # Detect trên bản thu nhỏ nếu DETECTION_SCALE < 1, encode trên frame đầy đủ
+            face_locations = face_model.face_detector.detect_faces(rgb_frame)
             face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
         except Exception as e:
             print(f"⚠️ Face recognition failed: {e}")
             return []
 
         recognized = []
-        for encoding, (top, right, bottom, left) in zip(face_encodings, face_locations):
-            matches = face_recognition.compare_faces(known_face_encodings, encoding, tolerance=0.45)
+        # Snapshot (gallery, info) nhất quán cho cả frame, không cần lock
+        gallery, info = encoding_store.snapshot()
+        matches = gallery.best_matches(face_encodings, tolerance=0.45)
+        for (student_id, distance, confidence), (top, right, bottom, left) in zip(matches, face_locations):
             student = None
-            if True in matches:
-                match_index = matches.index(True)
-                student = known_face_data[match_index]
+            if student_id is not None:
+                # Tra bảng thông tin theo sinh viên (name, class thật), không tạo dict trung gian
+                name, class_name = info.lookup(student_id)
+                student = {
+                    'student_id': student_id,
+                    'name': name or student_id,
+                    'class': class_name
+                }
                 mark_attendance(student)
             recognized.append({
                 'student': student,
@@ -805,7 +793,11 @@ def create_app():
                     continue
 
                 frame = cv2.resize(frame, (640,480))
-                recognized = safe_recognize_face(frame)
+                # Frame tối / cháy sáng / mờ: bỏ qua nhận diện, chỉ hiện lý do
+                reason = None
+                if Config.QUALITY_GATE_ENABLED:
+                    reason, _ = ImageProcessor.assess_quality(frame, bgr=True)
+                recognized = safe_recognize_face(frame) if reason is None else []
 
                 # Update current_faces realtime
                 with faces_lock:
@@ -826,9 +818,13 @@ def create_app():
                     color = (0,255,0) if student is not None else (0,0,255)
                     cv2.rectangle(frame, (loc['left'], loc['top']), (loc['right'], loc['bottom']), color, 2)
                     if student:
-                        cv2.putText(frame, f"{student['name']} ({student['class']})",
+                        label = f"{student['name']} ({student['class']})" if student['class'] else student['name']
+                        cv2.putText(frame, label,
                                     (loc['left'], loc['top']-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
 
+                if reason is not None:
+                    cv2.putText(frame, reason, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
+
                 ret, buffer = cv2.imencode('.jpg', frame)
                 if not ret:
                     continue
@@ -199,11 +199,13 @@
 
 import os
 import cv2
-import pickle
 import face_recognition
-import numpy as np
 import csv
 from datetime import datetime
+from config import Config
+from models.encoding_store import EncodingStore
+from utils.image_processing import ImageProcessor
+from utils.face_detector import FaceDetector
 
 # ====== Cấu hình thư mục ======
 ENCODINGS_DIR = r"D:\monthu2\student-attendance-systeam\data\encodings"
@@ -228,22 +230,18 @@ if os.path.exists(ATTENDANCE_FILE):
                 logged_today.add(row[2])
 
 # ====== Load encodings ======
-known_encodings = []
-known_names = []
+# Store chung (snapshot mmap + log, kèm name/class); lần đầu tự chuyển các file .pkl cũ trong ENCODINGS_DIR
 print("🔍 Loading encodings...")
-for file in os.listdir(ENCODINGS_DIR):
-    if file.endswith(".pkl"):
-        data = pickle.load(open(os.path.join(ENCODINGS_DIR, file), "rb"))
-        for enc in data["encodings"]:
-            known_encodings.append(enc)
-            known_names.append(data["info"]["name"])  # fix: dùng info["name"]
-print(f"✅ Loaded {len(known_encodings)} encodings from {len(set(known_names))} students")
-print("Students:", set(known_names))
-
-if len(known_encodings) == 0:
+store = EncodingStore(legacy_dir=ENCODINGS_DIR)
+store.start_reload()
+print("Students:", [store.get_info(student_id)['name'] for student_id in store.gallery.ids])
+
+if len(store.gallery) == 0:
     print("⚠️ Chưa có encodings. Vui lòng tạo encoding trước khi chạy webcam.")
     exit()
 
+detector = FaceDetector()
+
 # ====== Mở webcam ======
 cap = cv2.VideoCapture(0)
 if not cap.isOpened():
@@ -256,22 +254,32 @@ while True:
     if not ret:
         break
 
+    # ====== Cổng chất lượng: frame tối / cháy sáng / mờ thì bỏ qua nhận diện ======
+    reason = None
+    if Config.QUALITY_GATE_ENABLED:
+        reason, _ = ImageProcessor.assess_quality(frame, bgr=True)
+    if reason is not None:
+        cv2.putText(frame, reason, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        cv2.imshow("🎯 AI Face Attendance — Q = Quit", frame)
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            break
+        continue
+
     rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
     # ====== Nhận diện khuôn mặt ======
-    locations = face_recognition.face_locations(rgb_frame, model="hog")
+    # Detect trên bản thu nhỏ nếu DETECTION_SCALE < 1 (box đổi về frame gốc), encode trên frame đầy đủ
+    locations = detector.detect_faces(rgb_frame)
     encodings = face_recognition.face_encodings(rgb_frame, locations)
 
-    for (top, right, bottom, left), face_enc in zip(locations, encodings):
-        matches = face_recognition.compare_faces(known_encodings, face_enc, tolerance=0.55)  # tăng tolerance
-        name = "Unknown"
+    # Sinh viên có template gần nhất (min theo từng sinh viên) trong ngưỡng
+    gallery, info = store.snapshot()
+    matches = gallery.best_matches(encodings, tolerance=0.55)  # tăng tolerance
 
-        if True in matches:
-            matchedIdxs = np.where(matches)[0]
-            name_counts = {}
-            for i in matchedIdxs:
-                name_counts[known_names[i]] = name_counts.get(known_names[i], 0) + 1
-            name = max(name_counts, key=name_counts.get)
+    for (top, right, bottom, left), (student_id, distance, confidence) in zip(locations, matches):
+        name = "Unknown"
+        if student_id is not None:
+            name = info.lookup(student_id)[0] or student_id
 
         # Vẽ khung mặt và tên
         color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
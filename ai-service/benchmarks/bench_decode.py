@@ -0,0 +1,61 @@
+"""
+Benchmark decode ảnh upload: decode đầy đủ rồi resize vs decode JPEG thu nhỏ (IMREAD_REDUCED_*)
+
+Với ảnh JPEG kích thước WxH (mặc định 4000x3000, ~12 MP như ảnh điện thoại), đo thời gian
+decode + resize về ImageProcessor.WORKING_SIZE và kích thước mảng decode (bộ nhớ đỉnh).
+
+Chạy: python benchmarks/bench_decode.py [--width 4000] [--height 3000] [--repeat 20]
+"""
+import os
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_processing import ImageProcessor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    # Ảnh tổng hợp có chi tiết (gradient + nhiễu) để JPEG không quá dễ nén
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, args.width, dtype=np.float32)
+    y = np.linspace(0, 255, args.height, dtype=np.float32)[:, None]
+    base = (x + y) / 2
+    image = np.stack([base, 255 - base, np.roll(base, 100, axis=1)], axis=2)
+    image = np.clip(image + rng.normal(0, 20, image.shape), 0, 255).astype(np.uint8)
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    data = buffer.tobytes()
+    max_width, max_height = ImageProcessor.WORKING_SIZE
+
+    def run(reduced):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            if reduced:
+                decoded = ImageProcessor.load_image_from_bytes(data, max_width, max_height)
+            else:
+                decoded = ImageProcessor.load_image_from_bytes(data)
+            resized = ImageProcessor.resize_image(decoded)
+        return (time.perf_counter() - start) / args.repeat * 1000, decoded, resized
+
+    full_ms, full, full_resized = run(False)
+    reduced_ms, reduced, reduced_resized = run(True)
+    diff = np.abs(full_resized.astype(np.int16) - reduced_resized.astype(np.int16)).mean()
+
+    print(f"{args.width}x{args.height} JPEG ({len(data) / 1e6:.1f} MB) -> {full_resized.shape[1]}x{full_resized.shape[0]}")
+    print(f"{'':<10} {'decode+resize ms':>17} {'decoded':>12} {'decoded MB':>11}")
+    print(f"{'full':<10} {full_ms:>17.1f} {f'{full.shape[1]}x{full.shape[0]}':>12} {full.nbytes / 1e6:>11.1f}")
+    print(f"{'reduced':<10} {reduced_ms:>17.1f} {f'{reduced.shape[1]}x{reduced.shape[0]}':>12} {reduced.nbytes / 1e6:>11.1f}")
+    print(f"mean abs pixel difference after resize: {diff:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark enhance thích ứng (ImageProcessor.adaptive_enhance) so với luôn chạy CLAHE và không enhance
+
+Với mỗi ảnh mẫu (tên file <student_id>_<tên>.jpg) tạo các biến thể ánh sáng: gốc, tối, cháy sáng,
+tương phản thấp. Mỗi chế độ ENHANCE_MODE đo:
+- thời gian enhance và thời gian end-to-end một frame (resize + enhance + detect + encode)
+- nhánh adaptive đã chọn cho từng biến thể
+- tỷ lệ nhận đúng: encoding của biến thể so với gallery dựng từ ảnh trong --gallery (ngưỡng
+  FACE_RECOGNITION_TOLERANCE)
+
+Chạy: python benchmarks/bench_enhance.py [--images data/images_raw] [--gallery data/images_fixed] [--repeat 5]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils.image_processing import ImageProcessor
+from utils.face_detector import FaceDetector
+
+MODES = ('clahe', 'adaptive', 'none')
+
+
+def variants(image):
+    """Biến thể ánh sáng của một ảnh RGB"""
+    as_float = image.astype(np.float32)
+    return {
+        'original': image,
+        'dark': np.clip(as_float * 0.35, 0, 255).astype(np.uint8),
+        'bright': np.clip(as_float * 0.6 + 110, 0, 255).astype(np.uint8),
+        'low_contrast': np.clip((as_float - 128) * 0.3 + 128, 0, 255).astype(np.uint8),
+    }
+
+
+def load_images(directory):
+    """{student_id: ảnh RGB} từ file <student_id>_<tên>.jpg"""
+    images = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().rsplit('.', 1)[-1] not in Config.ALLOWED_EXTENSIONS:
+            continue
+        image = ImageProcessor.load_image_from_file(os.path.join(directory, name))
+        if image is not None:
+            images[name.split('_', 1)[0]] = image
+    return images
+
+
+def analyze(detector, image):
+    """resize + enhance + detect + encode. Returns: (encodings, nhánh enhance, enhance ms, tổng ms)"""
+    start = time.perf_counter()
+    processed = ImageProcessor.resize_image(image)
+    enhance_start = time.perf_counter()
+    processed, branch = ImageProcessor.adaptive_enhance(processed)
+    enhance_ms = (time.perf_counter() - enhance_start) * 1000
+    locations = detector.detect_faces(processed)
+    encodings = detector.get_face_encodings(processed, locations) if locations else []
+    return encodings, branch, enhance_ms, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default='data/images_raw')
+    parser.add_argument('--gallery', default='data/images_fixed')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    detector = FaceDetector()
+    queries = load_images(args.images)
+    if not queries:
+        print(f"❌ No images in {args.images}")
+        return
+
+    # Gallery dựng một lần bằng tiền xử lý mặc định (CLAHE) như lúc đăng ký
+    Config.ENHANCE_MODE = 'clahe'
+    gallery_ids, gallery_encodings = [], []
+    for student_id, image in load_images(args.gallery).items():
+        encodings, _, _, _ = analyze(detector, image)
+        if encodings:
+            gallery_ids.append(student_id)
+            gallery_encodings.append(encodings[0])
+    gallery_encodings = np.asarray(gallery_encodings)
+    print(f"Gallery: {len(gallery_ids)} students from {args.gallery}, queries: {len(queries)} images x 4 variants\n")
+
+    print(f"{'mode':<10} {'variant':<13} {'branch':<8} {'enhance ms':>11} {'frame ms':>9} {'matched':>9}")
+    for mode in MODES:
+        Config.ENHANCE_MODE = mode
+        totals = [0.0, 0.0, 0, 0]  # enhance ms, frame ms, matched, total
+        for variant in ('original', 'dark', 'bright', 'low_contrast'):
+            enhance_ms = frame_ms = 0.0
+            matched = 0
+            branches = set()
+            for student_id, image in queries.items():
+                image = variants(image)[variant]
+                for _ in range(args.repeat):
+                    encodings, branch, e_ms, f_ms = analyze(detector, image)
+                    enhance_ms += e_ms
+                    frame_ms += f_ms
+                branches.add(branch)
+                if encodings and len(gallery_encodings):
+                    distances = np.linalg.norm(gallery_encodings - encodings[0], axis=1)
+                    best = int(np.argmin(distances))
+                    matched += distances[best] <= Config.FACE_RECOGNITION_TOLERANCE and gallery_ids[best] == student_id
+            runs = len(queries) * args.repeat
+            totals[0] += enhance_ms
+            totals[1] += frame_ms
+            totals[2] += matched
+            totals[3] += len(queries)
+            print(f"{mode:<10} {variant:<13} {'/'.join(sorted(branches)):<8} {enhance_ms / runs:>11.2f} "
+                  f"{frame_ms / runs:>9.1f} {f'{matched}/{len(queries)}':>9}")
+        runs = totals[3] * args.repeat
+        print(f"{mode:<10} {'all':<13} {'':<8} {totals[0] / runs:>11.2f} {totals[1] / runs:>9.1f} "
+              f"{f'{totals[2]}/{totals[3]}':>9}\n")
+
+
+if __name__ == '__main__':
+    main()
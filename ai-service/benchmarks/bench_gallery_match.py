@@ -0,0 +1,71 @@
+"""
+Benchmark độ trễ so khớp 1 encoding theo kích thước gallery
+
+- before: list các ndarray float64 + face_recognition.face_distance
+          (dựng lại mảng từ list ở mỗi lần gọi, như FaceDetector.find_best_match)
+- after:  FaceGallery (ma trận float32 + cached squared norms, 1 phép GEMV)
+
+Chạy: python benchmarks/bench_gallery_match.py [--sizes 1000,10000,40000]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.gallery import FaceGallery
+
+try:
+    from face_recognition import face_distance
+except Exception:
+    def face_distance(face_encodings, face_to_compare):
+        # Cùng cài đặt với face_recognition.face_distance
+        if len(face_encodings) == 0:
+            return np.empty((0))
+        return np.linalg.norm(face_encodings - face_to_compare, axis=1)
+
+
+def legacy_best_match(known_encodings, known_ids, unknown_encoding):
+    distances = face_distance(known_encodings, unknown_encoding)
+    idx = np.argmin(distances)
+    return known_ids[idx], distances[idx]
+
+
+def timeit(fn, repeat):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return np.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,10000,20000,40000')
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'gallery':>8} | {'before (ms)':>11} | {'after (ms)':>10} | {'speedup':>7}")
+    print('-' * 47)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        encodings = [rng.normal(0, 0.1, 128) for _ in range(size)]
+        ids = [f"SV{i:06d}" for i in range(size)]
+        query = encodings[size // 2] + rng.normal(0, 0.01, 128)
+
+        gallery = FaceGallery()
+        gallery.load(ids, encodings)
+
+        before = timeit(lambda: legacy_best_match(encodings, ids, query), args.repeat)
+        after = timeit(lambda: gallery.best_match(query, tolerance=10.0), args.repeat)
+
+        assert legacy_best_match(encodings, ids, query)[0] == gallery.best_match(query, tolerance=10.0)[0]
+        print(f"{size:>8} | {before:>11.3f} | {after:>10.3f} | {before / after:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
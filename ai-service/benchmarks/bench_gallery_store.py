@@ -0,0 +1,116 @@
+"""
+Benchmark lưu trữ gallery: file pickle (ghi lại toàn bộ) vs snapshot .npy + log append-only
+
+Với gallery N sinh viên, đo:
+- cold start: pickle.load + FaceGallery.load so với GalleryStore.open (mmap + replay log)
+- chi phí lưu một lần đăng ký: ghi lại cả file pickle so với append một bản ghi log (có fsync)
+- đăng ký đồng thời qua EncodingStore (group commit, sync=True): độ trễ p50/p95 và số lần fsync
+
+Chạy: python benchmarks/bench_gallery_store.py [--students 100000] [--registrations 50] [--threads 8]
+"""
+import os
+import sys
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.gallery import FaceGallery, SnapshotGallery
+from models.gallery_store import GalleryStore
+from models.encoding_log import OP_UPSERT
+from models.encoding_store import EncodingStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--registrations', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ids = [f"SV{i:06d}" for i in range(args.students)]
+    encodings = rng.normal(size=(args.students, 128)).astype(np.float32)
+    new_encodings = rng.normal(size=(args.registrations, 128)).astype(np.float32)
+    root = tempfile.mkdtemp(prefix='gallery-store-')
+
+    try:
+        # ---- Pickle: mỗi lần đăng ký ghi lại toàn bộ file ----
+        gallery = FaceGallery()
+        gallery.load(ids, encodings)
+        pickle_file = os.path.join(root, 'face_encodings.pkl')
+        start = time.perf_counter()
+        for i, encoding in enumerate(new_encodings):
+            gallery.upsert(f"NEW{i}", encoding)
+            with open(pickle_file, 'wb') as f:
+                pickle.dump({'encodings': gallery.matrix.copy(), 'ids': gallery.row_ids}, f)
+        pickle_save = (time.perf_counter() - start) / args.registrations * 1000
+
+        start = time.perf_counter()
+        with open(pickle_file, 'rb') as f:
+            data = pickle.load(f)
+        FaceGallery().load(data['ids'], data['encodings'])
+        pickle_start = (time.perf_counter() - start) * 1000
+
+        # ---- Store: snapshot một lần, mỗi lần đăng ký append một bản ghi ----
+        store = GalleryStore(os.path.join(root, 'gallery'))
+        gallery = FaceGallery()
+        gallery.load(ids, encodings)
+        with store.locked():
+            store.compact(gallery)
+        start = time.perf_counter()
+        for i, encoding in enumerate(new_encodings):
+            gallery.upsert(f"NEW{i}", encoding)
+            with store.locked():
+                store.append([(OP_UPSERT, f"NEW{i}", gallery.get_templates(f"NEW{i}"))])
+        store_save = (time.perf_counter() - start) / args.registrations * 1000
+
+        start = time.perf_counter()
+        restored = SnapshotGallery()
+        store.open(restored)
+        store_start = (time.perf_counter() - start) * 1000
+        assert restored.num_students == gallery.num_students
+
+        print(f"{args.students} students, {args.registrations} registrations")
+        print(f"{'':<10} {'cold start ms':>14} {'save / registration ms':>24}")
+        print(f"{'pickle':<10} {pickle_start:>14.1f} {pickle_save:>24.2f}")
+        print(f"{'store':<10} {store_start:>14.1f} {store_save:>24.2f}")
+
+        # ---- Đăng ký đồng thời: group commit gom nhiều request vào một fsync ----
+        encoding_store = EncodingStore(os.path.join(root, 'gallery'), reload_interval=0, legacy_dir=root)
+        latencies = []
+        latencies_lock = threading.Lock()
+
+        def register(worker):
+            for i in range(args.registrations):
+                start = time.perf_counter()
+                encoding_store.upsert(f"T{worker}-{i}", new_encodings[i], sync=True)
+                with latencies_lock:
+                    latencies.append(time.perf_counter() - start)
+
+        commits_before = encoding_store.committer.commits
+        threads = [threading.Thread(target=register, args=(w,)) for w in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        total = args.threads * args.registrations
+        commits = encoding_store.committer.commits - commits_before
+        latencies_ms = np.array(latencies) * 1000
+        print(f"\n{args.threads} threads x {args.registrations} registrations (sync=True):")
+        print(f"  p50 {np.percentile(latencies_ms, 50):.2f} ms, p95 {np.percentile(latencies_ms, 95):.2f} ms, "
+              f"{total / elapsed:.0f} registrations/s, {commits} fsync batches for {total} registrations")
+        encoding_store.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
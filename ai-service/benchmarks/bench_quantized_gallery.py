@@ -0,0 +1,81 @@
+"""
+Benchmark gallery nén (float16 / int8) + re-rank chính xác float32
+
+Gallery được gắn như snapshot của store (attach() trên file .npy memory-mapped): bản nén là
+bộ nhớ riêng duy nhất, ma trận float32 chỉ được đọc khi re-rank.
+Với mỗi kích thước gallery và mỗi chế độ lưu trữ, đo:
+- bộ nhớ của ma trận được quét và bộ nhớ riêng của process
+- độ trễ so khớp 1 encoding (p50)
+- recall@1 so với tìm kiếm chính xác float32
+
+Chạy: python benchmarks/bench_quantized_gallery.py [--sizes 20000,100000] [--rerank 64]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from models.gallery import FaceGallery
+
+
+def run(gallery, queries):
+    found, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        student_id, _, _ = gallery.best_match(query, tolerance=np.inf)
+        latencies.append(time.perf_counter() - start)
+        found.append(student_id)
+    return found, np.median(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='20000,100000')
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--noise', type=float, default=0.05)
+    parser.add_argument('--rerank', type=int, default=Config.QUANT_RERANK)
+    args = parser.parse_args()
+
+    Config.QUANT_MIN_GALLERY_SIZE = 0
+    Config.QUANT_RERANK = args.rerank
+    rng = np.random.default_rng(0)
+
+    print(f"{'gallery':>8} | {'storage':>7} | {'scanned MB':>10} | {'private MB':>10} | {'p50 (ms)':>8} | {'recall@1':>8}")
+    print('-' * 69)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        # Phân phối gần giống encoding dlib: mỗi chiều ~ N(0, 0.09)
+        matrix = rng.normal(0, 0.09, (size, 128)).astype(np.float32)
+        ids = [f"SV{i:07d}" for i in range(size)]
+        picks = rng.choice(size, args.queries, replace=False)
+        queries = matrix[picks] + rng.normal(0, args.noise, (args.queries, 128)).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as root:
+            arrays = {'matrix': matrix, 'sq_norms': np.einsum('ij,ij->i', matrix, matrix),
+                      'labels': np.arange(size, dtype=np.int32)}
+            for name, array in arrays.items():
+                np.save(os.path.join(root, f'{name}.npy'), array)
+            mapped = [np.load(os.path.join(root, f'{name}.npy'), mmap_mode='r') for name in arrays]
+
+            reference = None
+            for storage in ('float32', 'float16', 'int8'):
+                gallery = FaceGallery(storage=storage)
+                gallery.set_index(None)
+                gallery.attach(*mapped, ids)
+                found, p50 = run(gallery, queries)
+                if reference is None:
+                    reference = found
+                recall = np.mean([a == b for a, b in zip(found, reference)])
+                usage = gallery.memory_usage()
+                print(f"{size:>8} | {storage:>7} | {usage['scanned_bytes'] / 2**20:>10.1f} | "
+                      f"{usage['private_bytes'] / 2**20:>10.1f} | {p50:>8.3f} | {recall:>8.4f}")
+                del gallery
+            del mapped
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Hiệu chỉnh ngưỡng độ nét của cổng chất lượng (Config.QUALITY_MIN_SHARPNESS)
+
+Mỗi ảnh mẫu (tên file <student_id>_<tên>.jpg) được tạo các biến thể có nhãn:
+- accept: gốc, JPEG chất lượng thấp, thu nhỏ rồi phóng lại, nhiễu, mờ nhẹ (Gaussian <= --max-accept-blur px)
+- reject: mờ nặng (Gaussian >= --min-reject-blur px)
+rồi đo luminance_stats (trên thumbnail QUALITY_THUMB_SIZE như cổng chất lượng) và phương sai
+Laplacian trên ảnh đầy đủ để so sánh. Cuối cùng in khoảng ngưỡng tách được hai nhóm.
+--scales phóng ảnh mẫu (mô phỏng frame camera lớn hơn); kích thước blur phóng theo cùng tỉ lệ
+để nhãn gắn với nội dung ảnh chứ không với số pixel.
+
+Chạy: python benchmarks/calibrate_quality_gate.py [--images data/images_raw] [--scales 1.0,2.0,2.6]
+"""
+import os
+import sys
+import argparse
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils.image_processing import ImageProcessor
+
+BLURS = (3, 5, 9, 15, 25, 51)
+
+
+def load_images(directory):
+    """{student_id: ảnh RGB} từ file <student_id>_<tên>.jpg"""
+    images = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().rsplit('.', 1)[-1] not in Config.ALLOWED_EXTENSIONS:
+            continue
+        image = ImageProcessor.load_image_from_file(os.path.join(directory, name))
+        if image is not None:
+            images[name.split('_', 1)[0]] = image
+    return images
+
+
+def variants(image, scale, max_accept_blur, min_reject_blur):
+    """[(tên, nhãn, ảnh)] với nhãn 'accept' / 'reject' / '-' (vùng chuyển tiếp, không tính)"""
+    height, width = image.shape[:2]
+    _, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 30])
+    small = cv2.resize(image, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+    noise = np.random.default_rng(0).normal(0, 8, image.shape)
+    result = [
+        ('original', 'accept', image),
+        ('jpeg_q30', 'accept', cv2.imdecode(jpeg, cv2.IMREAD_UNCHANGED)),
+        ('half_res', 'accept', cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)),
+        ('noise_8', 'accept', np.clip(image + noise, 0, 255).astype(np.uint8)),
+    ]
+    for size in BLURS:
+        label = 'accept' if size <= max_accept_blur else 'reject' if size >= min_reject_blur else '-'
+        kernel = int(size * scale) | 1
+        result.append((f'blur_{size}', label, cv2.GaussianBlur(image, (kernel, kernel), 0)))
+    return result
+
+
+def laplacian_variance(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default='data/images_raw')
+    parser.add_argument('--scales', default='1.0,2.0,2.6')
+    parser.add_argument('--max-accept-blur', type=int, default=5)
+    parser.add_argument('--min-reject-blur', type=int, default=15)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        print(f"❌ No images in {args.images}")
+        return
+
+    accepted, rejected = [], []
+    print(f"thumbnail {Config.QUALITY_THUMB_SIZE} px, QUALITY_MIN_SHARPNESS={Config.QUALITY_MIN_SHARPNESS}\n")
+    print(f"{'image':<8} {'scale':>5} {'variant':<10} {'label':<7} {'size':>9} {'thumb var':>10} "
+          f"{'full var':>9} {'gate':>8}")
+    for scale in (float(s) for s in args.scales.split(',')):
+        for student_id, image in images.items():
+            if scale != 1.0:
+                image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+            for name, label, variant in variants(image, scale, args.max_accept_blur, args.min_reject_blur):
+                reason, metrics = ImageProcessor.assess_quality(variant)
+                sharpness = metrics['sharpness']
+                if label == 'accept':
+                    accepted.append(sharpness)
+                elif label == 'reject':
+                    rejected.append(sharpness)
+                print(f"{student_id:<8} {scale:>5.1f} {name:<10} {label:<7} "
+                      f"{f'{variant.shape[1]}x{variant.shape[0]}':>9} {sharpness:>10.1f} "
+                      f"{laplacian_variance(variant):>9.1f} {reason or 'ok':>8}")
+
+    low, high = max(rejected), min(accepted)
+    print(f"\nreject max {low:.1f}, accept min {high:.1f}")
+    if low < high:
+        print(f"✅ Separable: QUALITY_MIN_SHARPNESS in ({low:.1f}, {high:.1f}), "
+              f"geometric mean {np.sqrt(max(low, 1e-6) * high):.1f}")
+    else:
+        print("⚠️ Not separable at this thumbnail size")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Đánh giá ANN index: recall@1 so với tìm kiếm chính xác + độ trễ mỗi query
+
+Đọc encodings từ data/encodings (face_encodings.pkl và các file <id>.pkl),
+có thể bổ sung identity tổng hợp để mô phỏng gallery lớn.
+
+Chạy:
+  python benchmarks/eval_ann_recall.py --synthetic 100000 --index ivf --nprobe 4,8,16,32
+  python benchmarks/eval_ann_recall.py --synthetic 100000 --index hnsw --ef 32,64,128
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from models.gallery import FaceGallery
+from models.ann_index import IVFIndex, HNSWIndex
+
+
+def load_store(encodings_path):
+    """Đọc cả hai định dạng pickle hiện có -> (ids, matrix)"""
+    ids, encodings = [], []
+    for file in sorted(os.listdir(encodings_path)):
+        if not file.endswith('.pkl'):
+            continue
+        with open(os.path.join(encodings_path, file), 'rb') as f:
+            data = pickle.load(f)
+        if file == 'face_encodings.pkl':
+            for sid, enc in zip(data.get('ids', []), data.get('encodings', [])):
+                ids.append(sid)
+                encodings.append(enc)
+            continue
+        student_id = os.path.splitext(file)[0]
+        if isinstance(data, dict):
+            student_id = data.get('info', {}).get('student_id', student_id)
+            enc_list = data.get('encodings', [])
+        else:
+            enc_list = data if isinstance(data, list) else [data]
+        for enc in enc_list:
+            ids.append(student_id)
+            encodings.append(enc)
+    matrix = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+    return ids, matrix
+
+
+def synthesize(matrix, count, rng):
+    """Sinh identity giả theo phân phối (mean/std) của store thật"""
+    if matrix.shape[0] >= 2:
+        mean, std = matrix.mean(axis=0), matrix.std(axis=0) + 0.05
+    else:
+        mean, std = np.zeros(128, dtype=np.float32), np.full(128, 0.1, dtype=np.float32)
+    return (mean + rng.standard_normal((count, 128)) * std).astype(np.float32)
+
+
+def evaluate(gallery, queries, exact_ids):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, exact_ids):
+        start = time.perf_counter()
+        student_id, _, _ = gallery.best_match(query, tolerance=np.inf)
+        latencies.append(time.perf_counter() - start)
+        hits += student_id == expected
+    return hits / len(queries), np.median(latencies) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--encodings', default=Config.ENCODINGS_PATH)
+    parser.add_argument('--synthetic', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.03, help='std nhiễu thêm vào query')
+    parser.add_argument('--index', choices=['ivf', 'hnsw'], default='ivf')
+    parser.add_argument('--nlist', type=int, default=0)
+    parser.add_argument('--nprobe', default='4,8,16,32,64')
+    parser.add_argument('--ef', default='16,32,64,128')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ids, matrix = load_store(args.encodings)
+    print(f"📦 Store: {len(ids)} encodings from {len(set(ids))} students")
+    if args.synthetic:
+        matrix = np.vstack([matrix, synthesize(matrix, args.synthetic, rng)])
+        ids = ids + [f"SYN{i:07d}" for i in range(args.synthetic)]
+    print(f"🔍 Evaluating on {len(ids)} encodings, {args.queries} queries")
+
+    picks = rng.choice(len(ids), args.queries, replace=False)
+    queries = matrix[picks] + rng.normal(0, args.noise, (args.queries, 128)).astype(np.float32)
+
+    exact = FaceGallery()
+    exact.set_index(None)
+    exact.load(ids, matrix)
+    exact_ids = [exact.best_match(q, tolerance=np.inf)[0] for q in queries]
+    _, exact_ms, exact_p99 = evaluate(exact, queries, exact_ids)
+    print(f"{'config':>16} | {'recall@1':>8} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'build (s)':>9}")
+    print('-' * 62)
+    print(f"{'exact':>16} | {1.0:>8.4f} | {exact_ms:>8.3f} | {exact_p99:>8.3f} | {0.0:>9.2f}")
+
+    Config.ANN_MIN_GALLERY_SIZE = 0
+    if args.index == 'ivf':
+        index = IVFIndex(nlist=args.nlist or None)
+        knobs = [('nprobe', int(v)) for v in args.nprobe.split(',')]
+    else:
+        index = HNSWIndex()
+        knobs = [('ef', int(v)) for v in args.ef.split(',')]
+
+    # Nạp không kèm index (load sẽ dựng ở nền), rồi dựng đồng bộ để đo thời gian
+    gallery = FaceGallery()
+    gallery.set_index(None)
+    gallery.load(ids, matrix)
+    gallery.set_index(index)
+    start = time.perf_counter()
+    gallery.rebuild_index()
+    build_s = time.perf_counter() - start
+    index = gallery.index
+
+    for knob, value in knobs:
+        if knob == 'nprobe':
+            index.nprobe = value
+        else:
+            index.set_ef(value)
+        recall, p50, p99 = evaluate(gallery, queries, exact_ids)
+        print(f"{f'{args.index} {knob}={value}':>16} | {recall:>8.4f} | {p50:>8.3f} | {p99:>8.3f} | {build_s:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Báo cáo độ chính xác / độ trễ của chế độ detect-small, encode-large (Config.DETECTION_SCALE)
+
+Mỗi ảnh mẫu (tên file <student_id>_<tên>.jpg) được tiền xử lý như pipeline (resize về
+WORKING_SIZE + enhance), rồi với từng tỉ lệ detect:
+- thời gian detect và encode (encode luôn trên ảnh đầy đủ)
+- số khuôn mặt tìm được so với detect ở tỉ lệ 1.0
+- IoU box trung bình so với box ở tỉ lệ 1.0
+- khoảng cách encoding so với encoding ở tỉ lệ 1.0 (drift do box lệch)
+- tỷ lệ nhận đúng so với gallery dựng từ --gallery (ngưỡng FACE_RECOGNITION_TOLERANCE)
+--upscale phóng ảnh mẫu trước khi tiền xử lý để mô phỏng khuôn mặt nhỏ / lớn trong khung hình.
+
+Chạy: python benchmarks/report_detection_scale.py [--images data/images_raw] [--gallery data/images_fixed]
+      [--scales 1.0,0.75,0.5,0.35,0.25] [--upscale 1.0] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils.image_processing import ImageProcessor
+from utils.face_detector import FaceDetector
+
+
+def load_images(directory, upscale=1.0):
+    """{student_id: ảnh RGB đã tiền xử lý} từ file <student_id>_<tên>.jpg"""
+    images = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().rsplit('.', 1)[-1] not in Config.ALLOWED_EXTENSIONS:
+            continue
+        image = ImageProcessor.load_image_from_file(os.path.join(directory, name))
+        if image is None:
+            continue
+        if upscale != 1.0:
+            image = cv2.resize(image, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_LINEAR)
+        images[name.split('_', 1)[0]] = ImageProcessor.preprocess_for_recognition(image)
+    return images
+
+
+def iou(a, b):
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default='data/images_raw')
+    parser.add_argument('--gallery', default='data/images_fixed')
+    parser.add_argument('--scales', default='1.0,0.75,0.5,0.35,0.25')
+    parser.add_argument('--upscale', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    scales = [float(s) for s in args.scales.split(',')]
+
+    detector = FaceDetector()
+    queries = load_images(args.images, args.upscale)
+    if not queries:
+        print(f"❌ No images in {args.images}")
+        return
+
+    # Gallery dựng ở tỉ lệ 1.0 như lúc đăng ký
+    gallery_ids, gallery_encodings = [], []
+    for student_id, image in load_images(args.gallery).items():
+        encodings = detector.get_face_encodings(image, detector.detect_faces(image, scale=1.0))
+        if encodings:
+            gallery_ids.append(student_id)
+            gallery_encodings.append(encodings[0])
+    gallery_encodings = np.asarray(gallery_encodings)
+
+    # Kết quả tham chiếu ở tỉ lệ 1.0
+    reference = {}
+    for student_id, image in queries.items():
+        locations = detector.detect_faces(image, scale=1.0)
+        reference[student_id] = (locations, detector.get_face_encodings(image, locations))
+
+    shape = next(iter(queries.values())).shape
+    print(f"{len(queries)} images at {shape[1]}x{shape[0]}, gallery {len(gallery_ids)} students, "
+          f"model {detector.detection_model}\n")
+    print(f"{'scale':>6} {'detect ms':>10} {'encode ms':>10} {'total ms':>9} {'faces':>7} "
+          f"{'box IoU':>8} {'enc drift':>10} {'matched':>8}")
+    for scale in scales:
+        detect_ms = encode_ms = 0.0
+        faces = ref_faces = matched = 0
+        ious, drifts = [], []
+        for student_id, image in queries.items():
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                locations = detector.detect_faces(image, scale=scale)
+                detected = time.perf_counter()
+                encodings = detector.get_face_encodings(image, locations)
+                detect_ms += (detected - start) * 1000
+                encode_ms += (time.perf_counter() - detected) * 1000
+
+            ref_locations, ref_encodings = reference[student_id]
+            faces += len(locations)
+            ref_faces += len(ref_locations)
+            # Ghép từng box với box tham chiếu trùng nhiều nhất
+            for location, encoding in zip(locations, encodings):
+                if not ref_locations:
+                    break
+                overlaps = [iou(location, ref) for ref in ref_locations]
+                best = int(np.argmax(overlaps))
+                ious.append(overlaps[best])
+                if best < len(ref_encodings):
+                    drifts.append(float(np.linalg.norm(np.asarray(encoding) - ref_encodings[best])))
+            if encodings and len(gallery_encodings):
+                distances = np.linalg.norm(gallery_encodings - encodings[0], axis=1)
+                best = int(np.argmin(distances))
+                matched += distances[best] <= Config.FACE_RECOGNITION_TOLERANCE and gallery_ids[best] == student_id
+
+        runs = len(queries) * args.repeat
+        mean_iou = f"{np.mean(ious):.3f}" if ious else '-'
+        mean_drift = f"{np.mean(drifts):.4f}" if drifts else '-'
+        print(f"{scale:>6.2f} {detect_ms / runs:>10.1f} {encode_ms / runs:>10.1f} "
+              f"{(detect_ms + encode_ms) / runs:>9.1f} {f'{faces}/{ref_faces}':>7} {mean_iou:>8} "
+              f"{mean_drift:>10} {f'{matched}/{len(queries)}':>8}")
+
+
+if __name__ == '__main__':
+    main()
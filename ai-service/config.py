@@ -24,9 +24,72 @@ class Config:
     
     # Face Recognition
     FACE_DETECTION_MODEL = os.getenv('FACE_DETECTION_MODEL', 'hog')
+    # Detect trên bản thu nhỏ theo tỉ lệ này rồi đổi box về ảnh gốc, encode trên ảnh đầy đủ (1.0 = tắt)
+    DETECTION_SCALE = float(os.getenv('DETECTION_SCALE', 1.0))
     FACE_RECOGNITION_TOLERANCE = float(os.getenv('FACE_RECOGNITION_TOLERANCE', 0.6))
     NUM_JITTERS = int(os.getenv('NUM_JITTERS', 1))
     
+    # Gallery (ma trận encoding float32)
+    GALLERY_INITIAL_CAPACITY = int(os.getenv('GALLERY_INITIAL_CAPACITY', 1024))
+    # Không cho hai khuôn mặt trong cùng ảnh khớp cùng một student_id
+    FACE_UNIQUE_ASSIGNMENT = os.getenv('FACE_UNIQUE_ASSIGNMENT', 'True') == 'True'
+    # Top-k: số ứng viên trả về và khoảng cách tối thiểu giữa hạng 1 và hạng 2 để chấp nhận
+    FACE_TOP_K = int(os.getenv('FACE_TOP_K', 5))
+    FACE_MIN_MARGIN = float(os.getenv('FACE_MIN_MARGIN', 0.03))
+    
+    # ANN index cho gallery lớn: 'exact' | 'ivf' | 'hnsw'
+    GALLERY_INDEX = os.getenv('GALLERY_INDEX', 'exact')
+    ANN_MIN_GALLERY_SIZE = int(os.getenv('ANN_MIN_GALLERY_SIZE', 20000))
+    # Index dựng ở nền khi nạp snapshot; quét chính xác khi index chưa xong hoặc số hàng đổi vượt tỉ lệ này
+    ANN_REBUILD_RATIO = float(os.getenv('ANN_REBUILD_RATIO', 0.1))
+    ANN_CANDIDATES = int(os.getenv('ANN_CANDIDATES', 32))
+    IVF_NLIST = int(os.getenv('IVF_NLIST', 0))  # 0 = tự chọn ~4*sqrt(N)
+    IVF_NPROBE = int(os.getenv('IVF_NPROBE', 16))
+    IVF_TRAIN_ITERATIONS = int(os.getenv('IVF_TRAIN_ITERATIONS', 10))
+    HNSW_M = int(os.getenv('HNSW_M', 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 200))
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 64))
+    
+    # Gallery nén: 'float32' (tắt) | 'float16' | 'int8', re-rank chính xác QUANT_RERANK hàng tốt nhất
+    # Chỉ nén snapshot memory-mapped: bản nén là bộ nhớ riêng duy nhất, float32 chỉ đọc khi re-rank.
+    # Mặc định tắt: benchmarks/bench_quantized_gallery.py (1 query, p50) cho float32 0.6-0.8 ms / int8
+    # 0.8-1.0 ms ở 20k hàng, 5.0-6.2 / 3.7-5.3 ms ở 100k; float16 chậm 5-8 lần (NumPy giải nén
+    # float16 -> float32 chậm hơn cả một lần GEMV float32). Chỉ cân nhắc int8 khi >= 100k hàng
+    GALLERY_STORAGE = os.getenv('GALLERY_STORAGE', 'float32')
+    QUANT_MIN_GALLERY_SIZE = int(os.getenv('QUANT_MIN_GALLERY_SIZE', 20000))
+    QUANT_RERANK = int(os.getenv('QUANT_RERANK', 64))
+    QUANT_BLOCK_SIZE = int(os.getenv('QUANT_BLOCK_SIZE', 1024))  # block float32 512 KB, nằm trong L2
+    
+    # Store gallery: snapshot .npy memory-mapped (dùng chung giữa các worker) + log append-only
+    GALLERY_SNAPSHOT_PATH = os.getenv('GALLERY_SNAPSHOT_PATH', os.path.join(ENCODINGS_PATH, 'gallery'))
+    GALLERY_KEEP_GENERATIONS = int(os.getenv('GALLERY_KEEP_GENERATIONS', 3))
+    GALLERY_LOG_COMPACT_BYTES = int(os.getenv('GALLERY_LOG_COMPACT_BYTES', 8 * 1024 * 1024))  # compact khi log vượt ngưỡng
+    GALLERY_COMMIT_WINDOW_MS = float(os.getenv('GALLERY_COMMIT_WINDOW_MS', 5))  # cửa sổ gom ghi (group commit)
+    GALLERY_SYNC_WRITES = os.getenv('GALLERY_SYNC_WRITES', 'True') == 'True'  # False: fire-and-forget
+    GALLERY_RELOAD_INTERVAL = float(os.getenv('GALLERY_RELOAD_INTERVAL', 2.0))  # giây, 0 = tắt hot reload
+    GALLERY_TRANSFER_CHUNK = int(os.getenv('GALLERY_TRANSFER_CHUNK', 1000))  # số sinh viên mỗi khối export/import
+    
+    # Cache kết quả detect + encode theo hash ảnh upload (retry / gửi lại cùng frame)
+    RECOGNITION_CACHE_SIZE = int(os.getenv('RECOGNITION_CACHE_SIZE', 256))  # số ảnh, 0 = tắt
+    RECOGNITION_CACHE_TTL = float(os.getenv('RECOGNITION_CACHE_TTL', 60))  # giây
+    
+    # Cổng chất lượng trước detect / encode (thumbnail xám lấy mẫu hàng, ~0.3 ms ở 800x600, ~0.4 ms ở 1080p): loại frame tối, cháy sáng, mờ
+    QUALITY_GATE_ENABLED = os.getenv('QUALITY_GATE_ENABLED', 'True') == 'True'
+    QUALITY_THUMB_SIZE = int(os.getenv('QUALITY_THUMB_SIZE', 160))  # px, cạnh dài tối đa thumbnail
+    QUALITY_MIN_BRIGHTNESS = float(os.getenv('QUALITY_MIN_BRIGHTNESS', 25))  # mức xám trung bình
+    QUALITY_MAX_BRIGHTNESS = float(os.getenv('QUALITY_MAX_BRIGHTNESS', 235))
+    QUALITY_MIN_CONTRAST = float(os.getenv('QUALITY_MIN_CONTRAST', 8))  # độ lệch chuẩn mức xám
+    # Phương sai Laplacian trên thumbnail; phụ thuộc QUALITY_THUMB_SIZE, hiệu chỉnh lại bằng
+    # benchmarks/calibrate_quality_gate.py khi đổi. Mặc định nới lỏng (chỉ loại mờ rất nặng) cho tới khi
+    # hiệu chỉnh trên frame thật của camera (ảnh mẫu + blur tổng hợp, 160 px: mờ nặng <= 580, dùng được >= 1058)
+    QUALITY_MIN_SHARPNESS = float(os.getenv('QUALITY_MIN_SHARPNESS', 100))
+    
+    # Enhance thích ứng: 'adaptive' (bỏ qua / LUT gamma / CLAHE theo độ sáng thumbnail), 'clahe' (luôn CLAHE), 'none'
+    ENHANCE_MODE = os.getenv('ENHANCE_MODE', 'adaptive')
+    ENHANCE_MIN_BRIGHTNESS = float(os.getenv('ENHANCE_MIN_BRIGHTNESS', 80))  # ngoài khoảng -> gamma
+    ENHANCE_MAX_BRIGHTNESS = float(os.getenv('ENHANCE_MAX_BRIGHTNESS', 180))
+    ENHANCE_MIN_CONTRAST = float(os.getenv('ENHANCE_MIN_CONTRAST', 40))  # dưới ngưỡng -> CLAHE
+    
     # Backend
     BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:4000')
     
@@ -41,6 +104,8 @@ class Config:
     # Performance
     MAX_WORKERS = int(os.getenv('MAX_WORKERS', 4))
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', 10))
+    BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 32))  # số ảnh tối đa mỗi request batch
+    BATCH_DETECT_PROCESSES = int(os.getenv('BATCH_DETECT_PROCESSES', 2))  # process detect + encode, 0 = dùng thread
     
     @staticmethod
     def init_app():
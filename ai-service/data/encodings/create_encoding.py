@@ -1,6 +1,10 @@
 import face_recognition
-import pickle
 import os
+import sys
+
+# Chạy từ thư mục ai-service/data/encodings: thêm ai-service vào sys.path để import models
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from models.encoding_store import EncodingStore
 
 # ====== Thông tin sinh viên ======
 student_id = "12345"
@@ -18,23 +22,8 @@ if len(encodings) == 0:
 
 encoding = encodings[0]
 
-# ====== Tạo dữ liệu theo đúng định dạng Flask dùng ======
-data = {
-    "encodings": [encoding],
-    "info": {
-        "student_id": student_id,
-        "name": student_name,
-        "class": student_class
-    }
-}
-
-# ====== Lưu mỗi sinh viên 1 file riêng ======
-encodings_folder = "data/encodings"
-os.makedirs(encodings_folder, exist_ok=True)
-
-file_path = os.path.join(encodings_folder, f"{student_id}.pkl")
-
-with open(file_path, "wb") as f:
-    pickle.dump(data, f)
+# ====== Lưu vào store chung (encoding + thông tin sinh viên) ======
+store = EncodingStore(reload_interval=0)
+store.upsert(student_id, encoding, name=student_name, class_name=student_class)
 
-print(f"✅ Đã lưu encoding cho sinh viên {student_name} ({student_id}) tại {file_path}")
+print(f"✅ Đã lưu encoding cho sinh viên {student_name} ({student_id}) tại {store.store.root}")
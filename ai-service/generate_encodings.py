@@ -349,10 +349,10 @@
 
 import os
 import cv2
-import pickle
 import face_recognition
 import numpy as np
 import shutil
+from models.encoding_store import EncodingStore
 
 # ====== Folder ======
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -361,6 +361,9 @@ RAW_DIR = r"D:\monthu2\student-attendance-systeam\data\images_raw"  # đường
 FIXED_DIR = os.path.join(DATA_DIR, "images_fixed")
 ENCODINGS_DIR = os.path.join(DATA_DIR, "encodings")
 
+# Store encoding chung (service đang chạy tự hot reload khi store đổi)
+store = EncodingStore(reload_interval=0)
+
 # Tạo folder nếu chưa có
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(FIXED_DIR, exist_ok=True)
@@ -418,18 +421,8 @@ for student_folder_name in os.listdir(FIXED_DIR):
         print(f"⚠️ Không tạo được encoding cho {student_folder_name}, bỏ qua.")
         continue
 
-    data = {
-        "encodings": encodings,
-        "info": {
-            "student_id": student_folder_name,
-            "name": student_folder_name,
-            "class": "Unknown"
-        }
-    }
-
-    file_path = os.path.join(ENCODINGS_DIR, f"{student_folder_name}.pkl")
-    with open(file_path, "wb") as f:
-        pickle.dump(data, f)
+    # Ghi vào store chung: encodings + thông tin sinh viên (một bản ghi log)
+    store.upsert(student_folder_name, encodings, name=student_folder_name, class_name="Unknown")
 
     print(f"✅ Đã lưu encoding cho {student_folder_name}")
 
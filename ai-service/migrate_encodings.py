@@ -0,0 +1,38 @@
+"""
+Chuyển encodings từ hai định dạng pickle cũ sang store chung (snapshot .npy + log)
+- face_encodings.pkl: {'encodings', 'ids'} của FaceRecognitionModel
+- <student_id>.pkl: {'encodings', 'info'} / list encoding của generate_encodings.py, create_encoding.py
+
+Sinh viên đã có trong store sẽ bị thay template bằng dữ liệu từ file pickle.
+File pickle cũ được giữ nguyên (xóa thủ công sau khi kiểm tra).
+
+Chạy: python migrate_encodings.py [--encodings data/encodings] [--store data/encodings/gallery] [--dry-run]
+"""
+import argparse
+
+from config import Config
+from models.encoding_store import EncodingStore, read_legacy_encodings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--encodings', default=Config.ENCODINGS_PATH, help='thư mục chứa các file .pkl cũ')
+    parser.add_argument('--store', default=Config.GALLERY_SNAPSHOT_PATH, help='thư mục store mới')
+    parser.add_argument('--dry-run', action='store_true', help='chỉ đọc và thống kê, không ghi')
+    args = parser.parse_args()
+
+    templates, info = read_legacy_encodings(args.encodings)
+    total = sum(len(encodings) for encodings in templates.values())
+    print(f"🔍 Found {len(templates)} students ({total} encodings, {len(info)} with info) in {args.encodings}")
+    if args.dry_run or not templates:
+        return
+
+    # Không để store tự chuyển pickle khi mở (sẽ nhập hai lần và thống kê sai)
+    store = EncodingStore(root=args.store, reload_interval=0, migrate_legacy=False)
+    created, updated = store.import_legacy(args.encodings)
+    print(f"✅ Migrated to {args.store}: {created} new, {updated} updated, "
+          f"{store.gallery.num_students} students in store")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import numpy as np
+from config import Config
+
+# Optional hnswlib cho HNSW index
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except Exception:
+    HNSWLIB_AVAILABLE = False
+
+
+def _sq_distances(queries, points, point_sq_norms):
+    """Bình phương khoảng cách Euclid Q x P (float32)"""
+    sq = queries @ points.T
+    sq *= -2.0
+    sq += point_sq_norms[None, :]
+    sq += np.einsum('ij,ij->i', queries, queries)[:, None]
+    return sq
+
+
+class IVFIndex:
+    """
+    Inverted file index (coarse quantization) thuần NumPy
+    - k-means chia gallery thành nlist cụm
+    - Khi tìm kiếm chỉ quét các hàng thuộc nprobe cụm gần nhất
+    nprobe càng lớn: recall càng cao, độ trễ càng lớn
+    """
+
+    name = 'ivf'
+
+    def __init__(self, nlist=None, nprobe=None, iterations=None, seed=0):
+        self.nlist = Config.IVF_NLIST if nlist is None else nlist
+        self.nprobe = Config.IVF_NPROBE if nprobe is None else nprobe
+        self.iterations = Config.IVF_TRAIN_ITERATIONS if iterations is None else iterations
+        self.seed = seed
+        self.centroids = None
+        self._centroid_sq_norms = None
+        self._list_rows = None      # row index sắp xếp theo cụm
+        self._list_offsets = None   # offsets[c]:offsets[c+1] là các hàng của cụm c
+
+    def _assign(self, matrix, chunk_size=8192):
+        """Gán từng hàng cho centroid gần nhất (xử lý theo chunk để giới hạn bộ nhớ)"""
+        labels = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], chunk_size):
+            chunk = matrix[start:start + chunk_size]
+            sq = _sq_distances(chunk, self.centroids, self._centroid_sq_norms)
+            labels[start:start + chunk_size] = np.argmin(sq, axis=1)
+        return labels
+
+    def build(self, matrix):
+        n = matrix.shape[0]
+        nlist = self.nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+
+        # Train k-means trên một mẫu (tối đa 64 điểm / cụm)
+        sample_size = min(n, nlist * 64)
+        sample = matrix[rng.choice(n, sample_size, replace=False)] if sample_size < n else matrix
+        self.centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            self._centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+            labels = self._assign(sample)
+            order = np.argsort(labels, kind='stable')
+            counts = np.bincount(labels, minlength=nlist)
+            non_empty = np.nonzero(counts)[0]
+            offsets = np.concatenate([[0], np.cumsum(counts[non_empty])[:-1]])
+            sums = np.add.reduceat(sample[order], offsets, axis=0)
+            self.centroids[non_empty] = sums / counts[non_empty, None]
+        self._centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+        # Inverted lists dạng CSR
+        labels = self._assign(matrix)
+        self._list_rows = np.argsort(labels, kind='stable')
+        self._list_offsets = np.searchsorted(labels[self._list_rows], np.arange(nlist + 1))
+
+    def candidates(self, queries):
+        """Hợp các hàng thuộc nprobe cụm gần nhất của mỗi query"""
+        nlist = self.centroids.shape[0]
+        nprobe = max(1, min(self.nprobe, nlist))
+        sq = _sq_distances(queries, self.centroids, self._centroid_sq_norms)
+        if nprobe < nlist:
+            probes = np.argpartition(sq, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(nlist), sq.shape)
+        probes = np.unique(probes)
+        starts = self._list_offsets[probes]
+        ends = self._list_offsets[probes + 1]
+        return np.concatenate([self._list_rows[s:e] for s, e in zip(starts, ends)])
+
+
+class HNSWIndex:
+    """
+    HNSW graph index (cần hnswlib)
+    ef_search càng lớn: recall càng cao, độ trễ càng lớn
+    """
+
+    name = 'hnsw'
+
+    def __init__(self, m=None, ef_construction=None, ef_search=None, k=None):
+        if not HNSWLIB_AVAILABLE:
+            raise RuntimeError("hnswlib is not installed")
+        self.m = Config.HNSW_M if m is None else m
+        self.ef_construction = Config.HNSW_EF_CONSTRUCTION if ef_construction is None else ef_construction
+        self.ef_search = Config.HNSW_EF_SEARCH if ef_search is None else ef_search
+        self.k = Config.ANN_CANDIDATES if k is None else k
+        self._index = None
+        self._size = 0
+
+    def build(self, matrix):
+        n, dim = matrix.shape
+        self._index = hnswlib.Index(space='l2', dim=dim)
+        self._index.init_index(max_elements=max(n, 1), ef_construction=self.ef_construction, M=self.m)
+        self._index.add_items(matrix, np.arange(n))
+        self._index.set_ef(max(self.ef_search, self.k))
+        self._size = n
+
+    def set_ef(self, ef_search):
+        """Đổi ef_search khi đang chạy (knob recall/latency)"""
+        self.ef_search = ef_search
+        if self._index is not None:
+            self._index.set_ef(max(self.ef_search, self.k))
+
+    def candidates(self, queries):
+        """Hợp k láng giềng gần nhất (xấp xỉ) của mỗi query"""
+        k = min(self.k, self._size)
+        labels, _ = self._index.knn_query(queries, k=k)
+        return np.unique(labels.astype(np.int64))
+
+
+def create_index(kind=None):
+    """Tạo ANN index theo Config.GALLERY_INDEX ('exact' | 'ivf' | 'hnsw')"""
+    kind = (kind or Config.GALLERY_INDEX).lower()
+    if kind == 'ivf':
+        return IVFIndex()
+    if kind == 'hnsw':
+        if HNSWLIB_AVAILABLE:
+            return HNSWIndex()
+        print("⚠️ hnswlib not installed - falling back to IVF index")
+        return IVFIndex()
+    return None
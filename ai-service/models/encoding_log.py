@@ -0,0 +1,143 @@
+import os
+import json
+import struct
+import zlib
+import numpy as np
+
+# Bản ghi: crc32 | op | độ dài student_id | count, rồi student_id (utf-8) và payload
+# - OP_UPSERT: payload là count x dim float32
+# - OP_INFO: payload là count byte JSON (name, class)
+# - OP_ROSTER: student_id là classroom_id, payload là count byte JSON (list student_id); count = 0: xóa roster
+_HEADER = struct.Struct('<IBHI')
+
+OP_UPSERT = 1   # thay toàn bộ template của student
+OP_DELETE = 2   # tombstone (xóa cả template và thông tin)
+OP_INFO = 3     # thông tin sinh viên
+OP_ROSTER = 4   # roster của lớp
+
+
+class EncodingLog:
+    """
+    Log append-only các thay đổi gallery (upsert / tombstone)
+    - Thông tin sinh viên (name, class) và roster các lớp nằm cùng log với encoding
+    - Mỗi bản ghi có CRC32: bản ghi ghi dở do crash bị bỏ qua khi replay và cắt khỏi file
+    - Mỗi lần ghi là một lần os.write vào file O_APPEND (+ fsync): chi phí I/O O(1)
+      theo kích thước gallery thay vì ghi lại toàn bộ file
+    """
+
+    def __init__(self, path, dim=128):
+        self.path = path
+        self.dim = dim
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def _encode(self, op, student_id, vectors=None, info=None):
+        key = str(student_id).encode('utf-8')
+        if vectors is not None:
+            payload = np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+            count = len(vectors)
+        elif info is not None:
+            payload = json.dumps(info, ensure_ascii=False).encode('utf-8')
+            count = len(payload)
+        else:
+            payload = b''
+            count = 0
+        body = _HEADER.pack(0, op, len(key), count)[4:] + key + payload
+        return struct.pack('<I', zlib.crc32(body)) + body
+
+    def append(self, records, sync=True):
+        """
+        Ghi một lô bản ghi theo đúng thứ tự (một lần write + một fsync)
+        records: iterable (op, student_id, payload) - payload là vectors T x dim (OP_UPSERT),
+                 dict thông tin (OP_INFO), list student_id (OP_ROSTER) hoặc None (OP_DELETE, xóa roster)
+        Returns: số byte đã ghi
+        """
+        data = b''.join(
+            self._encode(op, student_id, payload, None) if op == OP_UPSERT
+            else self._encode(op, student_id, None, payload)
+            for op, student_id, payload in records
+        )
+        if not data:
+            return 0
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        return len(data)
+
+    def replay(self, start=0):
+        """
+        Đọc các bản ghi hợp lệ từ offset start
+        Returns: (records, end) với records là list (op, student_id, vectors / info / None)
+                 và end là offset ngay sau bản ghi hợp lệ cuối cùng
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = f.read()
+        except OSError:
+            return [], start
+
+        records = []
+        offset = 0
+        record_size = self.dim * 4
+        while offset + _HEADER.size <= len(data):
+            crc, op, key_len, count = _HEADER.unpack_from(data, offset)
+            payload_size = count * record_size if op == OP_UPSERT else count
+            end = offset + _HEADER.size + key_len + payload_size
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                break
+            key_end = offset + _HEADER.size + key_len
+            student_id = data[offset + _HEADER.size:key_end].decode('utf-8')
+            payload = None
+            if op == OP_UPSERT:
+                payload = np.frombuffer(data, dtype=np.float32, count=count * self.dim,
+                                        offset=key_end).reshape(count, self.dim)
+            elif op in (OP_INFO, OP_ROSTER) and count:
+                payload = json.loads(data[key_end:end].decode('utf-8'))
+            records.append((op, student_id, payload))
+            offset = end
+        return records, start + offset
+
+    def truncate(self, size):
+        """Cắt phần đuôi hỏng (bản ghi ghi dở khi crash)"""
+        if self.size() > size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def apply_records(gallery, records, info=None):
+    """
+    Áp dụng các bản ghi log lên gallery (encoding + roster) và bảng thông tin sinh viên
+    (gom upsert liên tiếp vào bulk API để chỉ đánh version một lần)
+    """
+    upserts = []
+    for op, student_id, payload in records:
+        if op == OP_UPSERT:
+            upserts.append((student_id, payload))
+        elif op == OP_INFO:
+            if info is not None:
+                info[student_id] = payload
+        elif op == OP_ROSTER:
+            if payload is None:
+                gallery.remove_partition(student_id)
+            else:
+                gallery.set_partition(student_id, payload)
+        else:
+            if upserts:
+                gallery.bulk_upsert(upserts)
+                upserts = []
+            gallery.bulk_remove([student_id])
+            if info is not None:
+                info.pop(student_id, None)
+    if upserts:
+        gallery.bulk_upsert(upserts)
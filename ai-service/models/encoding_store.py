@@ -0,0 +1,436 @@
+import os
+import pickle
+import threading
+import numpy as np
+from config import Config
+from models.gallery import FaceGallery, SnapshotGallery
+from models.gallery_store import GalleryStore
+from models.student_table import StudentTable
+from models.gallery_reloader import GalleryReloader
+from models.group_commit import GroupCommitter
+from models.encoding_log import OP_UPSERT, OP_DELETE, OP_INFO, OP_ROSTER, apply_records
+
+# File gộp của FaceRecognitionModel (định dạng cũ)
+LEGACY_MODEL_FILE = 'face_encodings.pkl'
+
+
+def _make_info(name=None, class_name=None):
+    return {'name': name, 'class': class_name}
+
+
+def read_legacy_encodings(encodings_dir):
+    """
+    Đọc encodings từ hai định dạng pickle cũ trong encodings_dir
+    - face_encodings.pkl: {'encodings': [...], 'ids': [...]} (FaceRecognitionModel)
+    - <student_id>.pkl: {'encodings': [...], 'info': {...}}, list encoding hoặc một encoding
+      (app.py, generate_encodings.py, create_encoding.py)
+    Returns: (templates, info) với templates: student_id -> ndarray T x dim
+    """
+    templates = {}
+    info = {}
+    if not os.path.isdir(encodings_dir):
+        return templates, info
+
+    for file_name in sorted(os.listdir(encodings_dir)):
+        if not file_name.endswith('.pkl'):
+            continue
+        try:
+            with open(os.path.join(encodings_dir, file_name), 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Cannot read {file_name}: {e}")
+            continue
+
+        if file_name == LEGACY_MODEL_FILE:
+            for student_id, encoding in zip(data.get('ids', []), data.get('encodings', [])):
+                templates.setdefault(str(student_id), []).append(encoding)
+            continue
+
+        student_id = os.path.splitext(file_name)[0]
+        if isinstance(data, dict) and 'encodings' in data:
+            enc_list = data['encodings']
+            student_info = data.get('info') or {}
+            student_id = str(student_info.get('student_id') or student_id)
+            info[student_id] = _make_info(student_info.get('name'), student_info.get('class'))
+        elif isinstance(data, list):
+            enc_list = data
+        else:
+            enc_list = [data]
+        templates.setdefault(student_id, []).extend(enc for enc in enc_list if isinstance(enc, np.ndarray))
+
+    # Cùng sinh viên có thể nằm trong cả hai định dạng: bỏ template trùng
+    templates = {
+        student_id: np.unique(np.asarray(encodings, dtype=np.float32), axis=0)
+        for student_id, encodings in templates.items() if len(encodings) > 0
+    }
+    return templates, info
+
+
+class EncodingStore:
+    """
+    Store encoding + thông tin sinh viên (name, class) + roster các lớp dùng chung cho mọi entry point
+    (API model, app.py realtime, attendance_webcam.py, generate_encodings.py)
+    - Trên đĩa: GalleryStore (snapshot .npy memory-mapped + log append-only)
+    - Trong bộ nhớ: tuple (gallery, info) được swap atomic khi hot reload,
+      reader lấy snapshot() một lần cho cả request và không cần lock;
+      gallery là SnapshotGallery (snapshot mmap dùng chung + overlay nhỏ chứa thay đổi sau snapshot,
+      partitions là roster các lớp),
+      info là StudentTable (bảng cột, mỗi sinh viên một hàng, tên lớp intern)
+    - Hot reload tăng dần: cùng generation thì chỉ replay phần log mới (delta),
+      generation đổi (sau compaction) mới nạp lại snapshot
+    - Ghi (kể cả replay delta) sửa trên gallery.fork() rồi swap, không bao giờ sửa gallery reader đang giữ
+    - Ghi write-behind: thay đổi áp dụng ngay trong bộ nhớ, bản ghi log được group commit
+      (nhiều đăng ký liền nhau chung một fsync); mỗi lần gọi chọn chờ commit (sync=True)
+      hoặc fire-and-forget (sync=False), mặc định Config.GALLERY_SYNC_WRITES
+    - Lần đầu mở store trống: tự chuyển dữ liệu từ các file pickle cũ (migrate_legacy=False
+      để tắt, vd: migrate_encodings.py tự nhập và thống kê)
+    """
+
+    def __init__(self, root=None, dim=128, reload_interval=None, legacy_dir=None, migrate_legacy=True):
+        self.dim = dim
+        self.store = GalleryStore(root, dim=dim)
+        self.legacy_dir = Config.ENCODINGS_PATH if legacy_dir is None else legacy_dir
+        self.migrate_legacy = migrate_legacy
+        self._state = (SnapshotGallery(dim), StudentTable())
+        # Lock ghi trong process (writer + hot reload); reader không bao giờ chờ
+        self.write_lock = threading.RLock()
+        self.reloader = GalleryReloader(
+            self.store.signature, self._read, self._swap, interval=reload_interval,
+            lock=self.write_lock, delta_fn=self._catch_up
+        )
+        self._compact_due = False
+        self.committer = GroupCommitter(self._commit, self._after_commit)
+        self.open()
+
+    @property
+    def gallery(self):
+        return self._state[0]
+
+    @property
+    def info(self):
+        return self._state[1]
+
+    def snapshot(self):
+        """(gallery, info) nhất quán với nhau"""
+        return self._state
+
+    def get_info(self, student_id):
+        """Thông tin sinh viên (name, class); mặc định name = student_id"""
+        name, class_name = self.info.lookup(student_id)
+        return _make_info(name or student_id, class_name)
+
+    # ---------- Nạp / hot reload ----------
+    def _read(self):
+        gallery = SnapshotGallery(self.dim)
+        info = StudentTable()
+        self.store.open(gallery, info)
+        # Bản ghi của process này chưa kịp commit: áp lại lên dữ liệu từ đĩa
+        # (upsert / info / tombstone đều idempotent nên áp trùng không sao)
+        apply_records(gallery, self.committer.pending(), info)
+        return gallery, info
+
+    def _catch_up(self, signature):
+        """
+        Áp các bản ghi process khác ghi thêm kể từ signature lên gallery hiện tại (gọi trong write_lock)
+        Returns: signature mới hoặc None nếu generation đã đổi
+        """
+        delta = self.store.read_delta(signature)
+        if delta is None:
+            return None
+        records, signature = delta
+        if not records:
+            return signature
+        gallery = self.gallery.fork()
+        apply_records(gallery, records, self.info)
+        # Bản ghi của process này chưa commit phải thắng bản ghi cũ hơn trên đĩa
+        apply_records(gallery, self.committer.pending(), self.info)
+        self._publish(gallery)
+        return signature
+
+    def _swap(self, state):
+        """Thay (gallery, info) bằng bản mới (roster nạp cùng gallery từ store)"""
+        self._state = state
+
+    def _publish(self, gallery):
+        """
+        Đưa gallery đã sửa (bản fork của gallery hiện hành, cùng roster) vào dùng (gọi trong write_lock)
+        Chỉ là một phép gán: reader không khóa thấy trọn bản cũ hoặc trọn bản mới
+        """
+        self._state = (gallery, self.info)
+
+    def open(self):
+        """Nạp store (snapshot mmap + log); store trống thì chuyển dữ liệu pickle cũ sang"""
+        with self.write_lock:
+            try:
+                with self.store.locked():
+                    if self.store.current_generation() is None:
+                        if self.migrate_legacy:
+                            templates, info = read_legacy_encodings(self.legacy_dir)
+                        else:
+                            templates, info = {}, {}
+                        gallery = FaceGallery(self.dim)
+                        gallery.bulk_upsert(templates.items())
+                        if templates:
+                            print(f"ℹ️ Migrating {len(templates)} students from legacy pickle files")
+                        else:
+                            print("ℹ️ No encodings found. Starting fresh.")
+                        self.store.compact(gallery, info)
+                    elif self.store.verify(self.store.current_generation(), deep=False):
+                        # Snapshot hiện hành hỏng (crash / lỗi đĩa): quay về snapshot hợp lệ trước đó
+                        for action in self.store.repair():
+                            print(f"🔧 {action}")
+                    signature = self.store.signature()
+                    self._swap(self._read())
+                print(f"✅ Loaded {len(self.gallery)} face encodings ({self.gallery.num_students} students)")
+            except Exception as e:
+                print(f"❌ Error loading encodings: {e}")
+                self._swap((SnapshotGallery(self.dim), StudentTable()))
+                signature = None
+            self.reloader.mark_current(signature)
+
+    def start_reload(self):
+        """Bật thread nền hot reload (Config.GALLERY_RELOAD_INTERVAL)"""
+        self.reloader.start()
+
+    def refresh(self):
+        """Nạp ngay thay đổi của process khác. Returns: True nếu đã nạp lại"""
+        return self.reloader.check()
+
+    # ---------- Ghi ----------
+    def _commit(self, records):
+        """Ghi một lô bản ghi vào log (thread committer)"""
+        with self.store.locked():
+            before = self.store.signature()
+            signature = self.store.append(records)
+        # Không có process khác ghi xen vào: store khớp bộ nhớ, không cần reload
+        if before == self.reloader.signature:
+            self.reloader.mark_current(signature)
+        self._compact_due = signature[1] >= Config.GALLERY_LOG_COMPACT_BYTES
+
+    def _after_commit(self):
+        """
+        Compact khi log quá lớn (ngoài lock của committer để writer không phải chờ)
+        Chạy trên thread committer nên chỉ thử lấy write_lock: thread đang giữ write_lock có thể
+        đang chờ chính committer (flush trong clear / export / import) -> chờ lock sẽ deadlock.
+        Lock bận thì bỏ qua, lần commit sau (log vẫn quá lớn) sẽ thử lại
+        """
+        if not self._compact_due or not self.write_lock.acquire(blocking=False):
+            return
+        try:
+            self._compact_due = False
+            self.compact()
+        finally:
+            self.write_lock.release()
+
+    def _submit(self, records):
+        """
+        Xếp hàng bản ghi cho committer (gọi trong write_lock để giữ đúng thứ tự)
+        Returns: ticket, hoặc None nếu không có gì để ghi
+        """
+        return self.committer.submit(records) if records else None
+
+    def _wait(self, ticket, sync):
+        """Chờ commit nếu là ghi đồng bộ; lỗi I/O được báo cho caller"""
+        if sync is None:
+            sync = Config.GALLERY_SYNC_WRITES
+        if sync and ticket is not None and not self.committer.wait(ticket):
+            raise IOError("Could not persist encodings (will retry in background)")
+
+    def flush(self, timeout=None):
+        """Chờ mọi thay đổi đang chờ được ghi xuống đĩa. Returns: True nếu thành công"""
+        return self.committer.flush(timeout)
+
+    def close(self):
+        """Flush và dừng committer (tự gọi khi thoát chương trình)"""
+        self.committer.close()
+
+    def _compact(self):
+        """
+        Ghi snapshot mới rồi map lại nó để bản riêng của process được giải phóng
+        Gọi trong `with self.write_lock, self.store.locked()`
+        """
+        signature = self.store.compact(self.gallery, self.info)
+        self._swap(self._read())
+        print(f"✅ Compacted {len(self.gallery)} face encodings")
+        return signature
+
+    def compact(self):
+        """Ghi snapshot đầy đủ (compaction)"""
+        with self.write_lock, self.store.locked():
+            self.refresh()
+            self.reloader.mark_current(self._compact())
+
+    def upsert(self, student_id, encodings, append=False, name=None, class_name=None, sync=None):
+        """
+        Thêm / thay template của student_id (append=True: thêm template)
+        name, class_name: cập nhật thông tin sinh viên nếu có
+        sync: True chờ ghi xuống đĩa, False fire-and-forget (None: Config.GALLERY_SYNC_WRITES)
+        Returns: True nếu là student mới
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self.write_lock:
+            # Nạp thay đổi của process khác trước khi sửa để không ghi đè mất
+            self.refresh()
+            gallery = self.gallery.fork()
+            if append:
+                is_new = student_id not in gallery
+                for encoding in encodings:
+                    gallery.add_template(student_id, encoding)
+            else:
+                is_new = gallery.set_templates(student_id, encodings)
+            records = [(OP_UPSERT, student_id, gallery.get_templates(student_id))]
+            if name is not None or class_name is not None:
+                self.info[student_id] = _make_info(name, class_name)
+                records.append((OP_INFO, student_id, dict(self.info[student_id])))
+            self._publish(gallery)
+            ticket = self._submit(records)
+        self._wait(ticket, sync)
+        return is_new
+
+    def bulk_upsert(self, items, infos=None, sync=None):
+        """
+        Thêm mới / thay template cho nhiều student, commit chung một lô
+        items: iterable (student_id, encodings); infos: dict student_id -> {'name', 'class'}
+        Returns: (created, updated)
+        """
+        items = list(items)
+        infos = infos or {}
+        with self.write_lock:
+            self.refresh()
+            gallery = self.gallery.fork()
+            created, updated = gallery.bulk_upsert(items)
+            for student_id, student_info in infos.items():
+                self.info[student_id] = _make_info(student_info.get('name'), student_info.get('class'))
+            self._publish(gallery)
+            student_ids = dict.fromkeys(student_id for student_id, _ in items)
+            records = [(OP_UPSERT, student_id, gallery.get_templates(student_id)) for student_id in student_ids]
+            records += [(OP_INFO, student_id, dict(self.info[student_id])) for student_id in infos]
+            ticket = self._submit(records)
+        self._wait(ticket, sync)
+        return created, updated
+
+    def set_info(self, student_id, name=None, class_name=None, sync=None):
+        """Cập nhật thông tin sinh viên (không đổi encoding)"""
+        with self.write_lock:
+            self.refresh()
+            self.info[student_id] = _make_info(name, class_name)
+            ticket = self._submit([(OP_INFO, student_id, dict(self.info[student_id]))])
+        self._wait(ticket, sync)
+
+    def remove(self, student_id, sync=None):
+        """Xóa template + thông tin của student_id. Returns: True nếu đã xóa"""
+        return self.bulk_remove([student_id], sync) > 0
+
+    def bulk_remove(self, student_ids, sync=None):
+        """Xóa nhiều student, commit chung một lô. Returns: số student đã xóa"""
+        with self.write_lock:
+            self.refresh()
+            gallery = self.gallery
+            existing = [student_id for student_id in dict.fromkeys(student_ids)
+                        if student_id in gallery or student_id in self.info]
+            removed = 0
+            if any(student_id in gallery for student_id in existing):
+                gallery = gallery.fork()
+                removed = gallery.bulk_remove(existing)
+                self._publish(gallery)
+            for student_id in existing:
+                self.info.pop(student_id, None)
+            ticket = self._submit([(OP_DELETE, student_id, None) for student_id in existing])
+        self._wait(ticket, sync)
+        return removed
+
+    def clear(self):
+        """Xóa toàn bộ store (cẩn thận!)"""
+        with self.write_lock:
+            # Bản ghi cũ đang chờ phải xuống đĩa trước, nếu không sẽ được áp lại sau snapshot rỗng
+            self.committer.flush()
+            with self.store.locked():
+                # Giữ roster các lớp, chỉ xóa encoding + thông tin sinh viên
+                gallery = SnapshotGallery(self.dim)
+                for classroom_id, student_ids in self.gallery.partitions.items():
+                    gallery.set_partition(classroom_id, student_ids)
+                self._swap((gallery, StudentTable()))
+                self.reloader.mark_current(self._compact())
+
+    def set_roster(self, classroom_id, student_ids, sync=None):
+        """Gán roster (danh sách student_id) cho lớp, ghi vào log như encoding"""
+        with self.write_lock:
+            self.refresh()
+            gallery = self.gallery.fork()
+            gallery.set_partition(classroom_id, student_ids)
+            self._publish(gallery)
+            ticket = self._submit([(OP_ROSTER, classroom_id, gallery.get_partition(classroom_id))])
+        self._wait(ticket, sync)
+
+    def remove_roster(self, classroom_id, sync=None):
+        """Xóa roster của lớp. Returns: True nếu lớp có roster"""
+        with self.write_lock:
+            self.refresh()
+            if self.gallery.get_partition(classroom_id) is None:
+                return False
+            gallery = self.gallery.fork()
+            gallery.remove_partition(classroom_id)
+            self._publish(gallery)
+            ticket = self._submit([(OP_ROSTER, classroom_id, None)])
+        self._wait(ticket, sync)
+        return True
+
+    def export_snapshot(self):
+        """
+        Snapshot bất biến trên đĩa để export (compact trước nếu log còn thay đổi)
+        Returns: (ids, matrix, labels, info) - matrix, labels là mảng memory-mapped;
+                 ids gồm cả student chỉ có thông tin (nằm sau các student có template)
+        """
+        with self.write_lock:
+            self.committer.flush()
+            with self.store.locked():
+                self.refresh()
+                if self.store.signature()[1] > 0:
+                    self.reloader.mark_current(self._compact())
+                _, matrix, _, labels, ids, info, _ = self.store.load()
+        known = set(ids)
+        extra_ids = [student_id for student_id in info if student_id not in known]
+        return ids + extra_ids, matrix, labels, info
+
+    def import_chunks(self, chunks, replace=False):
+        """
+        Nhập gallery theo từng khối (items, infos) rồi ghi một snapshot duy nhất
+        (không ghi log cho từng student). Giữ lock ghi của store trong suốt quá trình nhập;
+        lỗi giữa chừng thì không có gì được ghi, gallery đang dùng giữ nguyên.
+        replace=True: xóa các student không có trong dữ liệu nhập
+        Returns: (created, updated, removed)
+        """
+        created = updated = removed = 0
+        seen = set()
+        with self.write_lock:
+            self.committer.flush()
+            with self.store.locked():
+                self.refresh()
+                # Nhập vào bản sao: lỗi giữa chừng thì bỏ bản sao, gallery đang dùng không đổi
+                gallery, info = self.gallery.fork(), self.info.copy()
+                for items, infos in chunks:
+                    chunk_created, chunk_updated = gallery.bulk_upsert(items)
+                    created += chunk_created
+                    updated += chunk_updated
+                    for student_id, student_info in infos.items():
+                        info[student_id] = _make_info(student_info.get('name'), student_info.get('class'))
+                    seen.update(student_id for student_id, _ in items)
+                    seen.update(infos)
+                if replace:
+                    missing = [student_id for student_id in list(gallery.ids) + list(info) if student_id not in seen]
+                    removed = gallery.bulk_remove(missing)
+                    for student_id in missing:
+                        info.pop(student_id, None)
+                self._state = (gallery, info)
+                self.reloader.mark_current(self._compact())
+        return created, updated, removed
+
+    def import_legacy(self, encodings_dir):
+        """
+        Nhập dữ liệu từ các file pickle cũ vào store (ghi đè template của sinh viên trùng id)
+        Returns: (created, updated)
+        """
+        templates, info = read_legacy_encodings(encodings_dir)
+        created, updated = self.bulk_upsert(templates.items(), info)
+        self.compact()
+        return created, updated
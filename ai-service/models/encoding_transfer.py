@@ -0,0 +1,98 @@
+import json
+import struct
+import zlib
+import numpy as np
+
+# Định dạng export/import gallery dạng cột, đọc / ghi theo từng khối (chunk):
+#   header: magic 'FGAL' | version (u16) | dim (u16)
+#   mỗi khối: crc32 | số student | số hàng | độ dài ids | độ dài metadata, rồi
+#     ids (JSON list), counts (u16, số template của từng student),
+#     ma trận float32 (số hàng x dim), metadata (JSON {'names': [...], 'classes': [...]})
+#   khối kết thúc: số student = 0
+MAGIC = b'FGAL'
+FORMAT_VERSION = 1
+MIME_TYPE = 'application/octet-stream'
+_FILE_HEADER = struct.Struct('<4sHH')
+_CHUNK_HEADER = struct.Struct('<IIIII')
+
+
+def iter_export(ids, matrix, labels, info=None, dim=128, chunk_size=1000):
+    """
+    Sinh các khối bytes của file export từ snapshot (ids, matrix, labels) của gallery
+    matrix / labels có thể là mảng memory-mapped: mỗi lần chỉ đọc một khối vào bộ nhớ
+    ids có thể dài hơn số slot trong labels: phần thêm là student chỉ có thông tin (0 template)
+    """
+    info = info or {}
+    yield _FILE_HEADER.pack(MAGIC, FORMAT_VERSION, dim)
+    labels = np.asarray(labels)
+    # Gom hàng theo student: order[offsets[s]:offsets[s + 1]] là các hàng của student s
+    order = np.argsort(labels, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=len(ids)))))
+    for start in range(0, len(ids), chunk_size):
+        end = min(start + chunk_size, len(ids))
+        chunk_ids = list(ids[start:end])
+        rows = order[offsets[start]:offsets[end]]
+        counts = np.diff(offsets[start:end + 1]).astype(np.uint16)
+        vectors = np.ascontiguousarray(matrix[rows], dtype=np.float32)
+        students = [info.get(student_id) or {} for student_id in chunk_ids]
+        meta = {'names': [s.get('name') for s in students], 'classes': [s.get('class') for s in students]}
+        yield _encode_chunk(chunk_ids, counts, vectors, meta)
+    yield _CHUNK_HEADER.pack(0, 0, 0, 0, 0)
+
+
+def _encode_chunk(ids, counts, vectors, meta):
+    ids_bytes = json.dumps(ids, ensure_ascii=False).encode('utf-8')
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    body = ids_bytes + counts.tobytes() + vectors.tobytes() + meta_bytes
+    header = _CHUNK_HEADER.pack(0, len(ids), len(vectors), len(ids_bytes), len(meta_bytes))
+    crc = zlib.crc32(header[4:] + body)
+    return struct.pack('<I', crc) + header[4:] + body
+
+
+def _read_exact(stream, size):
+    parts = []
+    remaining = size
+    while remaining > 0:
+        part = stream.read(remaining)
+        if not part:
+            raise ValueError("Unexpected end of import stream")
+        parts.append(part)
+        remaining -= len(part)
+    return b''.join(parts)
+
+
+def iter_import(stream, dim=128):
+    """
+    Đọc file export theo từng khối từ stream (file, request.stream...)
+    Yields: (items, infos) với items là list (student_id, encodings T x dim)
+            và infos là dict student_id -> {'name', 'class'} (chỉ student có thông tin)
+    """
+    magic, version, file_dim = _FILE_HEADER.unpack(_read_exact(stream, _FILE_HEADER.size))
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a gallery export stream")
+    if file_dim != dim:
+        raise ValueError(f"Export has {file_dim}-dimensional encodings, expected {dim}")
+    while True:
+        header = _read_exact(stream, _CHUNK_HEADER.size)
+        crc, num_students, num_rows, ids_len, meta_len = _CHUNK_HEADER.unpack(header)
+        if num_students == 0:
+            return
+        body = _read_exact(stream, ids_len + num_students * 2 + num_rows * dim * 4 + meta_len)
+        if zlib.crc32(header[4:] + body) != crc:
+            raise ValueError("Corrupt chunk in import stream")
+        ids = json.loads(body[:ids_len].decode('utf-8'))
+        offset = ids_len
+        counts = np.frombuffer(body, dtype=np.uint16, count=num_students, offset=offset)
+        offset += num_students * 2
+        vectors = np.frombuffer(body, dtype=np.float32, count=num_rows * dim, offset=offset).reshape(num_rows, dim)
+        offset += num_rows * dim * 4
+        meta = json.loads(body[offset:].decode('utf-8'))
+        bounds = [0] + np.cumsum(counts, dtype=np.int64).tolist()
+        items = [(student_id, vectors[bounds[i]:bounds[i + 1]])
+                 for i, student_id in enumerate(ids) if counts[i] > 0]
+        infos = {
+            student_id: {'name': name, 'class': class_name}
+            for student_id, name, class_name in zip(ids, meta['names'], meta['classes'])
+            if name is not None or class_name is not None
+        }
+        yield items, infos
@@ -1,10 +1,15 @@
-import pickle
+import json
 import os
-import numpy as np
+import time
 from datetime import datetime
 from config import Config
 from utils.face_detector import FaceDetector
 from utils.image_processing import ImageProcessor
+from utils.pipeline import RecognitionPipeline
+from utils.recognition_cache import RecognitionCache
+from utils.batch_recognition import BatchRecognizer
+from models.encoding_store import EncodingStore
+from models.encoding_transfer import iter_export, iter_import
 
 class FaceRecognitionModel:
     """Model quản lý và nhận diện khuôn mặt"""
@@ -12,73 +17,116 @@ class FaceRecognitionModel:
     def __init__(self):
         self.face_detector = FaceDetector()
         self.image_processor = ImageProcessor()
-        self.encodings_file = os.path.join(Config.ENCODINGS_PATH, 'face_encodings.pkl')
-        self.known_encodings = []
-        self.known_ids = []
-        self.load_encodings()
+        # Mọi method nhận ảnh RGB thô hoặc Frame của pipeline (stage đã chạy không chạy lại)
+        # Cache detect + encode theo hash ảnh upload (retry cùng ảnh không tính lại)
+        self.recognition_cache = RecognitionCache() if Config.RECOGNITION_CACHE_SIZE > 0 else None
+        self.pipeline = RecognitionPipeline(self.image_processor, self.face_detector, self.recognition_cache)
+        # Nhiều ảnh một request: decode song song (thread), detect + encode trên process worker
+        self.batch = BatchRecognizer(self.pipeline)
+        # Roster cũ (trước khi roster nằm trong store), chỉ dùng để chuyển dữ liệu
+        self.rosters_file = os.path.join(Config.ENCODINGS_PATH, 'classroom_rosters.json')
+        # Store chung (snapshot mmap + log, kèm thông tin sinh viên + roster), hot reload trong thread nền
+        self.store = EncodingStore()
+        self.load_rosters()
+        self.store.start_reload()
+    
+    @property
+    def gallery(self):
+        """Gallery hiện hành của store (có thể bị hot reload thay bằng bản mới)"""
+        return self.store.gallery
+    
+    @property
+    def known_encodings(self):
+        """Ma trận encoding float32 (view của snapshot nếu chưa có thay đổi) - giữ tương thích API cũ"""
+        return self.gallery.matrix
+    
+    @property
+    def known_ids(self):
+        return self.gallery.ids
     
     def load_encodings(self):
-        """Load face encodings từ file"""
-        if os.path.exists(self.encodings_file):
-            try:
-                with open(self.encodings_file, 'rb') as f:
-                    data = pickle.load(f)
-                    self.known_encodings = data.get('encodings', [])
-                    self.known_ids = data.get('ids', [])
-                print(f"✅ Loaded {len(self.known_encodings)} face encodings")
-            except Exception as e:
-                print(f"❌ Error loading encodings: {e}")
-                self.known_encodings = []
-                self.known_ids = []
-        else:
-            print("ℹ️ No encodings file found. Starting fresh.")
-            self.known_encodings = []
-            self.known_ids = []
+        """Load face encodings từ store"""
+        self.store.open()
     
     def save_encodings(self):
-        """Lưu face encodings vào file"""
+        """Ghi snapshot đầy đủ của gallery (compaction)"""
         try:
-            data = {
-                'encodings': self.known_encodings,
-                'ids': self.known_ids,
-                'last_updated': datetime.now().isoformat()
-            }
-            with open(self.encodings_file, 'wb') as f:
-                pickle.dump(data, f)
-            print(f"✅ Saved {len(self.known_encodings)} face encodings")
+            self.store.compact()
             return True
         except Exception as e:
             print(f"❌ Error saving encodings: {e}")
             return False
     
-    def register_face(self, student_id, image):
+    def refresh_gallery(self):
+        """Nạp ngay gallery mới nếu store đã bị process khác thay đổi"""
+        return self.store.refresh()
+    
+    def load_rosters(self):
+        """
+        Roster các lớp nằm trong store (snapshot + log, hot reload như encoding)
+        File classroom_rosters.json cũ: chuyển các lớp store chưa có vào store rồi đổi tên file
+        """
+        if not os.path.exists(self.rosters_file):
+            return
+        try:
+            with open(self.rosters_file, 'r', encoding='utf-8') as f:
+                rosters = json.load(f)
+            migrated = 0
+            for classroom_id, student_ids in rosters.items():
+                if self.gallery.get_partition(classroom_id) is None:
+                    self.store.set_roster(classroom_id, student_ids, sync=True)
+                    migrated += 1
+            os.replace(self.rosters_file, self.rosters_file + '.migrated')
+            print(f"✅ Migrated rosters for {migrated} classrooms into the gallery store")
+        except FileNotFoundError:
+            # Process khác vừa chuyển xong
+            return
+        except Exception as e:
+            print(f"❌ Error loading rosters: {e}")
+    
+    def set_classroom_roster(self, classroom_id, student_ids):
+        """
+        Gán roster cho lớp: nhận diện trong lớp chỉ quét encodings của roster
+        Returns: (success, message)
+        """
+        try:
+            self.store.set_roster(classroom_id, student_ids)
+        except IOError as e:
+            return False, str(e)
+        return True, f"Roster for classroom {classroom_id} set ({len(self.gallery.get_partition(classroom_id))} students)"
+    
+    def get_classroom_roster(self, classroom_id):
+        return self.gallery.get_partition(classroom_id)
+    
+    def delete_classroom_roster(self, classroom_id):
+        if not self.store.remove_roster(classroom_id):
+            return False, f"Classroom {classroom_id} has no roster"
+        return True, f"Deleted roster for classroom {classroom_id}"
+    
+    def register_face(self, student_id, image, append=False, sync=None):
         """
         Đăng ký khuôn mặt mới
+        append=True: thêm template cho student thay vì thay thế
+        sync: True chờ ghi xuống đĩa, False fire-and-forget (None: Config.GALLERY_SYNC_WRITES)
         Returns: (success, message, encoding)
         """
-        # Tiền xử lý ảnh
-        processed_image = self.image_processor.preprocess_for_recognition(image)
-        
-        # Lấy encoding
-        encoding, message = self.face_detector.get_single_face_encoding(processed_image)
+        # Tiền xử lý + lấy encoding (mỗi stage chạy một lần)
+        encoding, message = self.pipeline.single_encoding(self.pipeline.frame(image))
         
         if encoding is None:
             return False, message, None
         
-        # Kiểm tra xem student_id đã tồn tại chưa
-        if student_id in self.known_ids:
-            # Cập nhật encoding cũ
-            idx = self.known_ids.index(student_id)
-            self.known_encodings[idx] = encoding
-            message = f"Updated face encoding for student {student_id}"
-        else:
-            # Thêm encoding mới
-            self.known_encodings.append(encoding)
-            self.known_ids.append(student_id)
+        # Thêm mới, thêm template hoặc thay encoding cũ (bản ghi log được group commit)
+        try:
+            is_new = self.store.upsert(student_id, encoding, append=append, sync=sync)
+        except IOError as e:
+            return False, str(e), None
+        if is_new:
             message = f"Registered new face for student {student_id}"
-        
-        # Lưu vào file
-        self.save_encodings()
+        elif append:
+            message = f"Added face template for student {student_id}"
+        else:
+            message = f"Updated face encoding for student {student_id}"
         
         return True, message, encoding.tolist()
     
@@ -87,61 +135,116 @@ class FaceRecognitionModel:
         Nhận diện khuôn mặt từ ảnh
         Returns: (student_id, confidence, message)
         """
-        if len(self.known_encodings) == 0:
+        # Giữ reference snapshot hiện tại cho cả request (hot reload có thể swap)
+        gallery = self.gallery
+        if len(gallery) == 0:
             return None, 0, "No registered faces in database"
         
-        # Tiền xử lý ảnh
-        processed_image = self.image_processor.preprocess_for_recognition(image)
-        
-        # Lấy encoding
-        encoding, message = self.face_detector.get_single_face_encoding(processed_image)
+        # Tiền xử lý + lấy encoding (mỗi stage chạy một lần)
+        encoding, message = self.pipeline.single_encoding(self.pipeline.frame(image))
         
         if encoding is None:
             return None, 0, message
         
         # Tìm khuôn mặt khớp nhất
-        student_id, distance, confidence = self.face_detector.find_best_match(
-            encoding,
-            self.known_encodings,
-            self.known_ids
-        )
+        student_id, distance, confidence = gallery.best_match(encoding)
         
         if student_id is None:
             return None, 0, "No matching face found"
         
         return student_id, confidence, f"Recognized student {student_id}"
     
-    def recognize_multiple_faces(self, image):
+    def recognize_face_top_k(self, image, k=None, classroom_id=None, tolerance=None, min_margin=None):
+        """
+        Nhận diện một khuôn mặt, trả về k ứng viên tốt nhất và quyết định chấp nhận
+        Chấp nhận khi ứng viên hạng 1 trong ngưỡng tolerance và cách hạng 2
+        ít nhất min_margin (tránh nhận nhầm khi hai sinh viên gần như ngang nhau)
+        Returns: (result dict hoặc None, message)
+        """
+        # Giữ reference snapshot hiện tại cho cả request (hot reload có thể swap)
+        gallery = self.gallery
+        if tolerance is None:
+            tolerance = Config.FACE_RECOGNITION_TOLERANCE
+        if min_margin is None:
+            min_margin = Config.FACE_MIN_MARGIN
+        
+        if len(gallery) == 0:
+            return None, "No registered faces in database"
+        
+        # Tiền xử lý + lấy encoding (mỗi stage chạy một lần)
+        encoding, message = self.pipeline.single_encoding(self.pipeline.frame(image))
+        
+        if encoding is None:
+            return None, message
+        
+        ranked = gallery.top_k([encoding], k=k, partition=classroom_id)[0]
+        candidates = [
+            {'student_id': sid, 'distance': dist, 'confidence': (1 - dist) * 100}
+            for sid, dist in ranked['candidates']
+        ]
+        margin = ranked['margin']
+        if not candidates:
+            # Roster của lớp chưa có ai đăng ký: không khớp ai
+            return {
+                'recognized': False,
+                'student_id': None,
+                'confidence': 0,
+                'margin': None,
+                'candidates': []
+            }, "No matching face found"
+        best = candidates[0]
+        within_tolerance = best['distance'] <= tolerance
+        clear_margin = margin is None or margin >= min_margin
+        recognized = within_tolerance and clear_margin
+        
+        if recognized:
+            message = f"Recognized student {best['student_id']}"
+        elif not within_tolerance:
+            message = "No matching face found"
+        else:
+            message = f"Ambiguous match: margin {margin:.3f} < {min_margin:.3f}"
+        
+        return {
+            'recognized': recognized,
+            'student_id': best['student_id'] if recognized else None,
+            'confidence': best['confidence'] if recognized else 0,
+            'margin': margin,
+            'candidates': candidates
+        }, message
+    
+    def recognize_multiple_faces(self, image, unique_assignment=False, classroom_id=None):
         """
         Nhận diện nhiều khuôn mặt trong một ảnh
+        image: ảnh RGB thô hoặc Frame (stage decode / resize / enhance đã chạy sẽ không chạy lại)
+        unique_assignment: mỗi student_id chỉ được gán cho tối đa một khuôn mặt
+        classroom_id: chỉ so khớp với roster của lớp (nếu lớp chưa có roster
+                      thì dùng toàn bộ gallery)
         Returns: list of (student_id, confidence, face_location)
         """
-        if len(self.known_encodings) == 0:
+        # Giữ reference snapshot hiện tại cho cả request (hot reload có thể swap)
+        gallery = self.gallery
+        if len(gallery) == 0:
             return [], "No registered faces in database"
         
-        # Tiền xử lý ảnh
-        processed_image = self.image_processor.preprocess_for_recognition(image)
-        
-        # Phát hiện tất cả khuôn mặt
-        face_locations = self.face_detector.detect_faces(processed_image)
+        # Tiền xử lý + phát hiện tất cả khuôn mặt (bỏ qua stage frame đã chạy)
+        frame = self.pipeline.frame(image)
+        face_locations = self.pipeline.detect(frame)
         
         if len(face_locations) == 0:
+            if frame.reject_reason is not None:
+                return [], self.pipeline.reject_message(frame)
             return [], "No faces detected"
         
-        # Lấy encodings của tất cả khuôn mặt
-        face_encodings = self.face_detector.get_face_encodings(
-            processed_image, 
-            face_locations
-        )
+        # Encode tất cả khuôn mặt, tính khoảng cách F x N một lần cho tất cả
+        # Kết quả match trong cache chỉ dùng lại khi gallery + roster chưa đổi version
+        matches = self.pipeline.match(frame, lambda face_encodings: gallery.best_matches(
+            face_encodings,
+            unique=unique_assignment,
+            partition=classroom_id
+        ), gallery=gallery, match_key=('multiple', unique_assignment, classroom_id))
         
         results = []
-        for i, encoding in enumerate(face_encodings):
-            student_id, distance, confidence = self.face_detector.find_best_match(
-                encoding,
-                self.known_encodings,
-                self.known_ids
-            )
-            
+        for i, (student_id, distance, confidence) in enumerate(matches):
             results.append({
                 'student_id': student_id,
                 'confidence': confidence,
@@ -151,66 +254,146 @@ class FaceRecognitionModel:
         
         return results, "Success"
     
+    def recognize_batch(self, images, unique_assignment=False, classroom_id=None):
+        """
+        Nhận diện nhiều ảnh (vd: các ảnh chụp trong một phiên thi)
+        images: list ảnh RGB thô hoặc Frame (thường là Frame chưa decode từ upload)
+        Các ảnh xong cùng đợt được match chung một lần tính khoảng cách trên gallery
+        Yields: (index, results, message, frame) theo thứ tự ảnh xử lý xong,
+                results giống recognize_multiple_faces
+        """
+        # Cùng một snapshot gallery cho cả batch
+        gallery = self.gallery
+        frames = [self.pipeline.frame(image) for image in images]
+        
+        for ready in self.batch.run(frames):
+            with_faces = [i for i in ready if frames[i].encodings]
+            matches = {}
+            if with_faces and len(gallery) > 0:
+                start = time.perf_counter()
+                grouped = gallery.best_matches_batch(
+                    [frames[i].encodings for i in with_faces],
+                    unique=unique_assignment,
+                    partition=classroom_id
+                )
+                match_ms = (time.perf_counter() - start) * 1000
+                for i, frame_matches in zip(with_faces, grouped):
+                    matches[i] = frame_matches
+                    # Thời gian match của cả đợt (dùng chung giữa các ảnh trong đợt)
+                    frames[i].timings['match'] = match_ms
+            
+            for i in ready:
+                frame = frames[i]
+                if i in matches:
+                    frame.matches = matches[i]
+                    results = [{
+                        'student_id': student_id,
+                        'confidence': confidence,
+                        'distance': distance,
+                        'face_location': location
+                    } for (student_id, distance, confidence), location in zip(matches[i], frame.locations)]
+                    yield i, results, "Success", frame
+                elif frame.encodings is None:
+                    yield i, [], self.pipeline.reject_message(frame), frame
+                elif len(gallery) == 0:
+                    yield i, [], "No registered faces in database", frame
+                else:
+                    yield i, [], "No faces detected", frame
+    
     def verify_face(self, student_id, image):
         """
         Xác minh khuôn mặt có phải của student_id không
         Returns: (is_match, confidence, message)
         """
-        if student_id not in self.known_ids:
+        # Giữ reference snapshot hiện tại cho cả request (hot reload có thể swap)
+        gallery = self.gallery
+        if student_id not in gallery:
             return False, 0, f"Student {student_id} not registered"
         
-        # Lấy encoding đã lưu
-        idx = self.known_ids.index(student_id)
-        known_encoding = self.known_encodings[idx]
-        
-        # Tiền xử lý ảnh
-        processed_image = self.image_processor.preprocess_for_recognition(image)
-        
-        # Lấy encoding từ ảnh mới
-        encoding, message = self.face_detector.get_single_face_encoding(processed_image)
+        # Tiền xử lý + lấy encoding từ ảnh mới (mỗi stage chạy một lần)
+        encoding, message = self.pipeline.single_encoding(self.pipeline.frame(image))
         
         if encoding is None:
             return False, 0, message
         
-        # So sánh
-        is_match, distance, confidence = self.face_detector.compare_faces(
-            known_encoding,
-            encoding
-        )
+        # So sánh với mọi template đã lưu (lấy khoảng cách nhỏ nhất)
+        is_match, distance, confidence = gallery.verify(student_id, encoding)
         
         return is_match, confidence, "Match" if is_match else "No match"
     
-    def delete_face(self, student_id):
+    def delete_face(self, student_id, sync=None):
         """
         Xóa encoding của student
         Returns: (success, message)
         """
-        if student_id not in self.known_ids:
-            return False, f"Student {student_id} not found"
-        
-        idx = self.known_ids.index(student_id)
-        del self.known_encodings[idx]
-        del self.known_ids[idx]
-        
-        self.save_encodings()
+        try:
+            if not self.store.remove(student_id, sync=sync):
+                return False, f"Student {student_id} not found"
+        except IOError as e:
+            return False, str(e)
         
         return True, f"Deleted face encoding for student {student_id}"
     
+    def bulk_upsert_encodings(self, items, infos=None, sync=None):
+        """
+        Đồng bộ encodings cho nhiều sinh viên (vd: từ backend), commit chung một lô
+        items: iterable (student_id, encodings)
+        infos: dict student_id -> {'name', 'class'} (tùy chọn)
+        Returns: (success, message, created, updated)
+        """
+        try:
+            created, updated = self.store.bulk_upsert(items, infos, sync=sync)
+        except (ValueError, IOError) as e:
+            return False, str(e), 0, 0
+        return True, f"Upserted {created + updated} students ({created} new, {updated} updated)", created, updated
+    
+    def bulk_delete_faces(self, student_ids, sync=None):
+        """
+        Xóa encodings của nhiều sinh viên, commit chung một lô
+        Returns: (success, message, removed)
+        """
+        try:
+            removed = self.store.bulk_remove(student_ids, sync=sync)
+        except IOError as e:
+            return False, str(e), 0
+        return True, f"Deleted {removed} students", removed
+    
+    def export_encodings(self, chunk_size=None):
+        """
+        Export toàn bộ gallery (encodings + name, class) theo định dạng cột, từng khối
+        Returns: generator các khối bytes (đọc từ snapshot memory-mapped, bộ nhớ giới hạn theo khối)
+        """
+        ids, matrix, labels, info = self.store.export_snapshot()
+        return iter_export(ids, matrix, labels, info, dim=self.store.dim,
+                           chunk_size=chunk_size or Config.GALLERY_TRANSFER_CHUNK)
+
+    def import_encodings(self, stream, replace=False):
+        """
+        Nhập gallery từ stream định dạng export (đọc và áp dụng từng khối)
+        replace=True: xóa sinh viên không có trong dữ liệu nhập
+        Returns: (success, message, created, updated, removed)
+        """
+        try:
+            created, updated, removed = self.store.import_chunks(iter_import(stream, self.store.dim), replace)
+        except (ValueError, IOError) as e:
+            return False, str(e), 0, 0, 0
+        return True, (f"Imported {created + updated} students ({created} new, {updated} updated, "
+                      f"{removed} removed)"), created, updated, removed
+
     def get_all_registered_students(self):
         """Lấy danh sách tất cả sinh viên đã đăng ký"""
-        return self.known_ids
+        return list(self.gallery.ids)
     
     def get_statistics(self):
         """Lấy thống kê"""
         return {
-            'total_registered': len(self.known_ids),
-            'students': self.known_ids,
+            'total_registered': self.gallery.num_students,
+            'total_encodings': len(self.gallery),
+            'students': list(self.gallery.ids),
             'last_updated': datetime.now().isoformat()
         }
     
     def clear_all_encodings(self):
         """Xóa tất cả encodings (cẩn thận!)"""
-        self.known_encodings = []
-        self.known_ids = []
-        self.save_encodings()
+        self.store.clear()
         return True, "All face encodings cleared"
\ No newline at end of file
@@ -0,0 +1,944 @@
+import copy
+import time
+import threading
+import numpy as np
+from config import Config
+from models.ann_index import create_index
+from models.quantization import create_codec
+
+# Optional scipy: phép gán Hungarian tối ưu, nếu không có thì dùng greedy
+try:
+    from scipy.optimize import linear_sum_assignment
+    SCIPY_AVAILABLE = True
+except Exception:
+    SCIPY_AVAILABLE = False
+
+
+def assign_unique(distances, tolerance):
+    """
+    Gán mỗi khuôn mặt (hàng) cho tối đa một cột, mỗi cột dùng tối đa một lần
+    Chỉ xét các cặp có distance <= tolerance
+    Returns: mảng cột được gán cho từng hàng (-1 nếu không khớp)
+    """
+    num_faces = distances.shape[0]
+    assigned = np.full(num_faces, -1, dtype=np.int64)
+    rows, cols = np.nonzero(distances <= tolerance)
+    if len(rows) == 0:
+        return assigned
+
+    if SCIPY_AVAILABLE:
+        # Chỉ giữ các cột ứng viên để bài toán gán nhỏ (F x C thay vì F x N)
+        candidates = np.unique(cols)
+        cost = distances[:, candidates].astype(np.float64)
+        # Phạt nặng cặp vượt ngưỡng: ưu tiên số cặp khớp, sau đó tổng distance nhỏ nhất
+        penalty = num_faces * (tolerance + 1.0) + 1.0
+        cost[cost > tolerance] = penalty
+        row_ind, col_ind = linear_sum_assignment(cost)
+        for r, c in zip(row_ind, col_ind):
+            if cost[r, c] <= tolerance:
+                assigned[r] = candidates[c]
+        return assigned
+
+    # Greedy: duyệt các cặp theo distance tăng dần
+    order = np.argsort(distances[rows, cols], kind='stable')
+    used = set()
+    for k in order:
+        r, c = rows[k], cols[k]
+        if assigned[r] != -1 or c in used:
+            continue
+        assigned[r] = c
+        used.add(c)
+    return assigned
+
+
+class FaceGallery:
+    """
+    Gallery encoding dạng ma trận float32 liên tục (N x dim).
+    - Cấp phát trước và tăng dung lượng theo cấp số nhân khi thêm mới
+    - Cache bình phương chuẩn (squared norm) của từng hàng
+    - So khớp bằng một phép nhân ma trận-vector duy nhất (BLAS)
+    - Mỗi student có thể có nhiều template (nhiều hàng); labels[row] là
+      slot của student, khoảng cách theo student là min trên các template
+      (segment reduction theo offsets)
+    """
+
+    def __init__(self, dim=128, capacity=None, index=None, storage=None):
+        if capacity is None:
+            capacity = Config.GALLERY_INITIAL_CAPACITY
+        capacity = max(int(capacity), 1)
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._labels = np.zeros(capacity, dtype=np.int32)
+        self._size = 0
+        # Bảng student: slot -> student_id, student_id -> slot (hash index O(1)),
+        # slot -> danh sách hàng của student
+        self._ids = []
+        self._slot_of = {}
+        self._student_rows = []
+        # Tăng mỗi khi gallery thay đổi (dùng để làm mới cache phụ thuộc vào hàng)
+        self.version = 0
+        # Cache segment (order, offsets, slots) cho reduction theo student
+        self._segments = None
+        # Sub-gallery theo lớp: key -> danh sách student_id (roster)
+        self._partitions = {}
+        self._partition_rows = {}
+        # Tăng mỗi khi roster đổi (cache kết quả match theo lớp dựa vào giá trị này)
+        self.partitions_version = 0
+        # ANN index (None = luôn tìm kiếm chính xác)
+        self.index = create_index() if index is None else index
+        self._index_built_size = 0
+        self._index_stale = True
+        # Các hàng < built_size đã đổi nội dung kể từ lần dựng index
+        self._index_dirty_rows = set()
+        # Bản nén (float16/int8, Config.GALLERY_STORAGE) chỉ dựng cho snapshot read-only gắn bằng
+        # attach(): quét thô trên bản nén, re-rank trên ma trận float32 memory-mapped
+        # (không giữ thêm bản float32 riêng); lần ghi đầu tiên bỏ bản nén
+        self.storage = storage
+        self.codec = None
+
+    def __len__(self):
+        """Số encoding (template) trong gallery"""
+        return self._size
+
+    def __contains__(self, student_id):
+        return student_id in self._slot_of
+
+    @property
+    def ids(self):
+        """Danh sách student_id (mỗi student một lần)"""
+        return self._ids
+
+    @property
+    def num_students(self):
+        return len(self._ids)
+
+    @property
+    def row_ids(self):
+        """student_id của từng hàng (theo thứ tự hàng)"""
+        return [self._ids[slot] for slot in self._labels[:self._size]]
+
+    @property
+    def matrix(self):
+        """View (không copy) của các hàng đang dùng"""
+        return self._matrix[:self._size]
+
+    @property
+    def capacity(self):
+        return self._matrix.shape[0]
+
+    def _as_vector(self, encoding):
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Encoding must have {self.dim} dimensions, got {vector.shape[0]}")
+        return vector
+
+    def _as_matrix(self, encodings):
+        return np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+
+    def _ensure_capacity(self, needed):
+        """
+        Tăng gấp đôi dung lượng khi cần (amortized O(1) cho mỗi lần thêm)
+        Nếu đang dùng snapshot read-only (memory-mapped) thì copy sang bản riêng (copy-on-write)
+        Mọi thao tác ghi đều qua đây: bỏ bản nén (chỉ dùng cho snapshot bất biến)
+        """
+        self.codec = None
+        capacity = self.capacity
+        if needed <= capacity and self._matrix.flags.writeable:
+            return
+        new_capacity = max(needed, capacity * 2, 1)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        labels = np.zeros(new_capacity, dtype=np.int32)
+        labels[:self._size] = self._labels[:self._size]
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+        self._labels = labels
+
+    def _changed(self):
+        self.version += 1
+        self._segments = None
+
+    def index_of(self, student_id):
+        """Trả về slot của student_id hoặc None (O(1))"""
+        return self._slot_of.get(student_id)
+
+    def _rows_of(self, slot):
+        return np.array(self._student_rows[slot], dtype=np.int64)
+
+    def get_templates(self, student_id):
+        """Bản sao các template (T x dim) của student_id hoặc None"""
+        slot = self.index_of(student_id)
+        if slot is None:
+            return None
+        return self._matrix[self._rows_of(slot)]
+
+    def _new_slot(self, student_id):
+        slot = len(self._ids)
+        self._ids.append(student_id)
+        self._slot_of[student_id] = slot
+        self._student_rows.append([])
+        return slot
+
+    def _mark_dirty(self, row):
+        if row < self._index_built_size:
+            self._index_dirty_rows.add(row)
+
+    def _write_row(self, row, slot, vector):
+        self._matrix[row] = vector
+        self._sq_norms[row] = vector.dot(vector)
+        self._labels[row] = slot
+        self._mark_dirty(row)
+
+    def _append_rows(self, slot, vectors):
+        start = self._size
+        self._ensure_capacity(start + len(vectors))
+        end = start + len(vectors)
+        self._matrix[start:end] = vectors
+        self._sq_norms[start:end] = np.einsum('ij,ij->i', vectors, vectors)
+        self._labels[start:end] = slot
+        self._student_rows[slot].extend(range(start, end))
+        for row in range(start, end):
+            self._mark_dirty(row)
+        self._size = end
+
+    def _swap_remove_row(self, row):
+        """Xóa một hàng bằng cách chuyển hàng cuối vào chỗ trống (không dồn hàng)"""
+        last = self._size - 1
+        if row != last:
+            moved_slot = int(self._labels[last])
+            self._matrix[row] = self._matrix[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._labels[row] = moved_slot
+            rows = self._student_rows[moved_slot]
+            rows[rows.index(last)] = row
+            self._mark_dirty(row)
+        self._size = last
+
+    def _swap_remove_slot(self, slot):
+        """Xóa student khỏi bảng bằng cách chuyển student cuối vào slot trống"""
+        last = len(self._ids) - 1
+        student_id = self._ids[slot]
+        if slot != last:
+            moved_id = self._ids[last]
+            moved_rows = self._student_rows[last]
+            self._ids[slot] = moved_id
+            self._slot_of[moved_id] = slot
+            self._student_rows[slot] = moved_rows
+            self._labels[moved_rows] = slot
+        self._ids.pop()
+        self._student_rows.pop()
+        del self._slot_of[student_id]
+
+    def _clear_rows(self, slot):
+        # Xóa từ hàng lớn nhất để các hàng còn lại của student không bị di chuyển
+        for row in sorted(self._student_rows[slot], reverse=True):
+            self._student_rows[slot].remove(row)
+            self._swap_remove_row(row)
+
+    def _set_templates(self, student_id, vectors):
+        self._ensure_capacity(self._size)
+        slot = self.index_of(student_id)
+        is_new = slot is None
+        if is_new:
+            slot = self._new_slot(student_id)
+        elif len(self._student_rows[slot]) == len(vectors):
+            # Cùng số template: ghi đè tại chỗ
+            for row, vector in zip(self._student_rows[slot], vectors):
+                self._write_row(row, slot, vector)
+            return is_new
+        else:
+            self._clear_rows(slot)
+        self._append_rows(slot, vectors)
+        return is_new
+
+    def _remove(self, student_id):
+        slot = self.index_of(student_id)
+        if slot is None:
+            return False
+        self._ensure_capacity(self._size)
+        self._clear_rows(slot)
+        self._swap_remove_slot(slot)
+        return True
+
+    def add_template(self, student_id, encoding):
+        """
+        Thêm một template cho student_id (tạo student mới nếu chưa có)
+        Returns: True nếu là student mới
+        """
+        vector = self._as_vector(encoding)
+        slot = self.index_of(student_id)
+        is_new = slot is None
+        if is_new:
+            slot = self._new_slot(student_id)
+        self._append_rows(slot, vector[None, :])
+        self._changed()
+        return is_new
+
+    def set_templates(self, student_id, encodings):
+        """
+        Thay toàn bộ template của student_id
+        Returns: True nếu là student mới
+        """
+        is_new = self._set_templates(student_id, self._as_matrix(encodings))
+        self._changed()
+        return is_new
+
+    def upsert(self, student_id, encoding):
+        """
+        Thêm mới hoặc thay encoding (một template duy nhất)
+        Returns: True nếu là student mới
+        """
+        return self.set_templates(student_id, [encoding])
+
+    def remove(self, student_id):
+        """Xóa student_id và mọi template. Returns: True nếu đã xóa"""
+        removed = self._remove(student_id)
+        if removed:
+            self._changed()
+        return removed
+
+    def bulk_upsert(self, items):
+        """
+        Thêm mới / thay template cho nhiều student trong một lần
+        items: iterable (student_id, encodings) với encodings là 1 hoặc T encoding
+        Returns: (created, updated)
+        """
+        items = [(student_id, self._as_matrix(encodings)) for student_id, encodings in items]
+        self._ensure_capacity(self._size + sum(len(vectors) for _, vectors in items))
+        created = updated = 0
+        for student_id, vectors in items:
+            if self._set_templates(student_id, vectors):
+                created += 1
+            else:
+                updated += 1
+        self._changed()
+        return created, updated
+
+    def bulk_remove(self, student_ids):
+        """
+        Xóa nhiều student trong một lần
+        Returns: số student đã xóa
+        """
+        removed = sum(1 for student_id in student_ids if self._remove(student_id))
+        if removed:
+            self._changed()
+        return removed
+
+    def load(self, ids, encodings):
+        """
+        Nạp toàn bộ gallery từ ids + encodings (list hoặc ndarray)
+        ids có thể lặp lại: mỗi lần lặp là một template của cùng student
+        """
+        ids = list(ids)
+        self.codec = None
+        self._size = 0
+        self._ids = []
+        self._slot_of = {}
+        self._student_rows = []
+        if len(ids) > 0:
+            matrix = self._as_matrix(encodings)
+            labels = np.empty(len(ids), dtype=np.int32)
+            for row, student_id in enumerate(ids):
+                slot = self._slot_of.get(student_id)
+                if slot is None:
+                    slot = self._new_slot(student_id)
+                self._student_rows[slot].append(row)
+                labels[row] = slot
+            self._ensure_capacity(len(ids))
+            self._matrix[:len(ids)] = matrix
+            self._sq_norms[:len(ids)] = np.einsum('ij,ij->i', matrix, matrix)
+            self._labels[:len(ids)] = labels
+            self._size = len(ids)
+        self._index_stale = True
+        self._changed()
+        self._build_index_if_due()
+
+    def requantize(self):
+        """Dựng bản nén mới (ước lượng tham số + nén) cho toàn bộ snapshot đang gắn rồi mới gắn vào"""
+        codec = create_codec(self.dim, max(self._size, 1), self.storage)
+        if codec is not None:
+            matrix = self._matrix[:self._size]
+            codec.fit(matrix)
+            codec.write_rows(0, matrix)
+        self.codec = codec
+
+    def arrays(self):
+        """(matrix, sq_norms, labels, ids) của các hàng đang dùng (dữ liệu ghi snapshot)"""
+        n = self._size
+        return self._matrix[:n], self._sq_norms[:n], self._labels[:n], self._ids
+
+    def memory_usage(self):
+        """Số byte của ma trận được quét (bản nén nếu có), của ma trận float32 và bộ nhớ riêng của process"""
+        exact = self._matrix[:self._size].nbytes
+        codes = self.codec.nbytes(self._size) if self.codec is not None else 0
+        # Snapshot memory-mapped (read-only) nằm trong page cache dùng chung, không tính là bộ nhớ riêng
+        private = codes + (exact if self._matrix.flags.writeable else 0)
+        return {'scanned_bytes': codes or exact, 'float32_bytes': exact, 'private_bytes': private}
+
+    def clear(self):
+        self.load([], [])
+
+    def attach(self, matrix, sq_norms, labels, ids):
+        """
+        Dùng trực tiếp các mảng có sẵn (vd: snapshot memory-mapped read-only)
+        làm dữ liệu gallery, không copy. Lần ghi đầu tiên sẽ copy sang bản riêng.
+        """
+        n = len(labels)
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+        self._labels = labels
+        self._size = n
+        self._ids = list(ids)
+        self._slot_of = {student_id: slot for slot, student_id in enumerate(self._ids)}
+        order = np.argsort(labels, kind='stable').tolist()
+        ends = np.cumsum(np.bincount(labels, minlength=len(self._ids))).tolist()
+        self._student_rows = [order[start:end] for start, end in zip([0] + ends[:-1], ends)]
+        self._index_stale = True
+        self._index_dirty_rows = set()
+        self.requantize()
+        self._changed()
+        self._build_index_if_due()
+
+    def set_partition(self, key, student_ids):
+        """Khai báo sub-gallery (vd: roster của một lớp) theo key"""
+        self._partitions[key] = list(dict.fromkeys(student_ids))
+        self._partition_rows.pop(key, None)
+        self.partitions_version += 1
+
+    def remove_partition(self, key):
+        self._partitions.pop(key, None)
+        self._partition_rows.pop(key, None)
+        self.partitions_version += 1
+
+    def get_partition(self, key):
+        return self._partitions.get(key)
+
+    @property
+    def partitions(self):
+        return self._partitions
+
+    def partition_rows(self, key):
+        """
+        Chỉ số hàng (row-index view) của sub-gallery, cache theo version
+        Returns: None nếu key không có roster (dùng gallery toàn cục); mảng rỗng nếu
+                 roster không có ai đã đăng ký (không khớp ai)
+        """
+        student_ids = self._partitions.get(key)
+        if student_ids is None:
+            return None
+        cached = self._partition_rows.get(key)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        rows = [row for slot in map(self.index_of, student_ids) if slot is not None
+                for row in self._student_rows[slot]]
+        rows = np.array(rows, dtype=np.int64)
+        self._partition_rows[key] = (self.version, rows)
+        return rows
+
+    def set_index(self, index):
+        """Gắn ANN index khác (None = tìm kiếm chính xác), quét chính xác cho tới khi rebuild_index()"""
+        self.index = index
+        self._index_stale = True
+
+    def rebuild_index(self, background=False):
+        """
+        Dựng ANN index mới trên gallery hiện tại (vào bản sao của index) rồi mới gắn vào:
+        reader vẫn dùng index cũ hoặc quét chính xác trong lúc dựng
+        background=True: dựng trên thread nền; gallery đổi trong lúc dựng thì bỏ kết quả
+        Returns: thread nền hoặc None
+        """
+        if self.index is None:
+            return None
+        index, version, size = copy.copy(self.index), self.version, self._size
+        matrix = self._matrix[:size]
+
+        def build():
+            index.build(matrix)
+            if self.version != version:
+                return False
+            self.index = index
+            self._index_built_size = size
+            self._index_dirty_rows = set()
+            self._index_stale = False
+            return True
+
+        if not background:
+            build()
+            return None
+
+        def build_in_background():
+            start = time.perf_counter()
+            try:
+                if build():
+                    print(f"✅ ANN index built on {size} encodings ({time.perf_counter() - start:.1f}s)")
+            except Exception as e:
+                print(f"⚠️ ANN index build failed: {e}")
+
+        thread = threading.Thread(target=build_in_background, name='gallery-index', daemon=True)
+        thread.start()
+        return thread
+
+    def _build_index_if_due(self):
+        """Sau khi nạp / gắn snapshot: dựng ANN index ở nền nếu gallery đủ lớn"""
+        if self.index is not None and self._size >= Config.ANN_MIN_GALLERY_SIZE:
+            self.rebuild_index(background=True)
+
+    def _candidate_rows(self, queries):
+        """
+        Các hàng ứng viên từ ANN index, hoặc None nếu quét toàn bộ gallery
+        Các hàng thêm hoặc đổi nội dung sau lần dựng index gần nhất
+        luôn được quét chính xác. Index chưa dựng xong hoặc quá cũ thì quét chính xác
+        (không bao giờ train index trên request)
+        """
+        if self.index is None or self._size < Config.ANN_MIN_GALLERY_SIZE:
+            return self._quantized_candidate_rows(queries)
+        pending = max(self._size - self._index_built_size, 0) + len(self._index_dirty_rows)
+        if self._index_stale or pending > Config.ANN_REBUILD_RATIO * self._index_built_size:
+            return self._quantized_candidate_rows(queries)
+        rows = self.index.candidates(queries)
+        rows = rows[rows < self._size]
+        extra = [np.arange(self._index_built_size, self._size)]
+        if self._index_dirty_rows:
+            extra.append(np.fromiter(self._index_dirty_rows, dtype=np.int64))
+        return np.unique(np.concatenate([rows] + extra))
+
+    def _quantized_candidate_rows(self, queries):
+        """
+        Quét thô trên bản nén, giữ QUANT_RERANK hàng tốt nhất mỗi query để
+        re-rank chính xác bằng float32. None nếu không bật nén.
+        """
+        codec = self.codec
+        if codec is None or self._size < Config.QUANT_MIN_GALLERY_SIZE:
+            return None
+        keep = min(Config.QUANT_RERANK, self._size)
+        scores = codec.coarse_scores(queries, self._size)
+        if keep < self._size:
+            top = np.argpartition(scores, keep - 1, axis=1)[:, :keep]
+        else:
+            top = np.broadcast_to(np.arange(self._size), scores.shape)
+        return np.unique(top)
+
+    def distances(self, encoding):
+        """
+        Khoảng cách Euclid từ encoding tới mọi hàng trong gallery
+        ||k - q||^2 = ||k||^2 - 2 k.q + ||q||^2
+        """
+        query = self._as_vector(encoding)
+        n = self._size
+        sq = self._sq_norms[:n] - 2.0 * (self._matrix[:n] @ query)
+        sq += query.dot(query)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+    
+    def distance_matrix(self, encodings, rows=None):
+        """
+        Ma trận khoảng cách F x N giữa F encodings và toàn bộ gallery
+        (một phép nhân ma trận duy nhất thay vì F lần quét gallery)
+        rows: chỉ tính với các hàng này (F x len(rows))
+        """
+        queries = self._as_matrix(encodings)
+        if rows is None:
+            matrix = self._matrix[:self._size]
+            sq_norms = self._sq_norms[:self._size]
+        else:
+            matrix = self._matrix[rows]
+            sq_norms = self._sq_norms[rows]
+        sq = queries @ matrix.T
+        sq *= -2.0
+        sq += sq_norms[None, :]
+        sq += np.einsum('ij,ij->i', queries, queries)[:, None]
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def _segments_for(self, rows=None):
+        """
+        Segment theo student: (order, offsets, slots)
+        distances[:, order] gom các template của cùng student liền nhau,
+        offsets là vị trí bắt đầu mỗi segment, slots là student tương ứng.
+        Với toàn bộ gallery kết quả được cache theo version.
+        """
+        if rows is None:
+            if self._segments is not None:
+                return self._segments
+            labels = self._labels[:self._size]
+        else:
+            labels = self._labels[rows]
+
+        order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[order]
+        boundary = np.ones(len(sorted_labels), dtype=bool)
+        boundary[1:] = sorted_labels[1:] != sorted_labels[:-1]
+        offsets = np.flatnonzero(boundary)
+        segments = (order, offsets, sorted_labels[offsets])
+
+        if rows is None:
+            self._segments = segments
+        return segments
+
+    def student_distance_matrix(self, encodings, rows=None):
+        """
+        Khoảng cách F x S tới từng student (min trên các template),
+        tính bằng một lần quét ma trận + np.minimum.reduceat theo segment
+        Returns: (distances F x S, slots S)
+        """
+        distances = self.distance_matrix(encodings, rows)
+        order, offsets, slots = self._segments_for(rows)
+        if len(offsets) == len(order):
+            # Mỗi student một template: chỉ cần sắp lại cột
+            return distances[:, order], slots
+        return np.minimum.reduceat(distances[:, order], offsets, axis=1), slots
+
+    def _student_distances(self, queries, partition=None):
+        """
+        Khoảng cách F x S tới các student cần so: roster của partition nếu có,
+        nếu không thì ứng viên ANN / bản nén (hoặc toàn bộ gallery)
+        Returns: (distances, slots) hoặc None nếu không có student nào để so
+        """
+        if self._size == 0:
+            return None
+        rows = self.partition_rows(partition) if partition is not None else None
+        if rows is None:
+            rows = self._candidate_rows(queries)
+        if rows is not None and len(rows) == 0:
+            return None
+        return self.student_distance_matrix(queries, rows)
+
+    def _id_of(self, slot):
+        return self._ids[slot]
+
+    def verify(self, student_id, encoding, tolerance=None):
+        """
+        So sánh encoding với mọi template của student_id
+        Returns: (is_match, distance, confidence) hoặc None nếu chưa đăng ký
+        """
+        if tolerance is None:
+            tolerance = Config.FACE_RECOGNITION_TOLERANCE
+
+        slot = self.index_of(student_id)
+        if slot is None:
+            return None
+        distance = float(self.distance_matrix([encoding], self._rows_of(slot)).min())
+        return distance <= tolerance, distance, (1 - distance) * 100
+
+    def top_k(self, encodings, k=None, partition=None):
+        """
+        k student gần nhất cho mỗi encoding, dùng partial selection
+        (np.argpartition, O(S)) thay vì sắp xếp toàn bộ
+        Returns: list (mỗi encoding) of dict {'candidates': [(student_id, distance), ...],
+                 'margin': distance thứ 2 - distance thứ 1 (None nếu < 2 student)}
+        """
+        if k is None:
+            k = Config.FACE_TOP_K
+        queries = self._as_matrix(encodings)
+        num_faces = queries.shape[0]
+        columns = self._student_distances(queries, partition) if num_faces else None
+        if columns is None:
+            return [{'candidates': [], 'margin': None} for _ in range(num_faces)]
+        distances, slots = columns
+
+        num_students = distances.shape[1]
+        k = max(1, min(int(k), num_students))
+        if k < num_students:
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(num_students), distances.shape)
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.take_along_axis(top_distances, order, axis=1)
+
+        # Margin cần ít nhất 2 student: lấy từ top-k nếu k >= 2, nếu không thì chọn riêng
+        if num_students >= 2 and k < 2:
+            second = np.partition(distances, 1, axis=1)[:, 1]
+        else:
+            second = top_distances[:, 1] if num_students >= 2 else None
+
+        results = []
+        for face_idx in range(num_faces):
+            candidates = [
+                (self._id_of(slots[col]), float(dist))
+                for col, dist in zip(top[face_idx], top_distances[face_idx])
+            ]
+            margin = None if second is None else float(second[face_idx] - top_distances[face_idx, 0])
+            results.append({'candidates': candidates, 'margin': margin})
+        return results
+
+    def best_match(self, encoding, tolerance=None, partition=None):
+        """
+        Tìm khuôn mặt khớp nhất
+        Returns: (student_id, distance, confidence) hoặc (None, None, None)
+        """
+        if tolerance is None:
+            tolerance = Config.FACE_RECOGNITION_TOLERANCE
+
+        return self.best_matches([encoding], tolerance, partition=partition)[0]
+
+    def best_matches(self, encodings, tolerance=None, unique=False, partition=None):
+        """
+        So khớp nhiều encodings cùng lúc
+        unique=True: hai khuôn mặt không bao giờ cùng trả về một student_id
+        partition: chỉ so khớp trong sub-gallery này (dùng gallery toàn cục nếu
+                   partition chưa có roster; roster không ai đăng ký thì không khớp ai)
+        Returns: list of (student_id, distance, confidence), (None, None, None) nếu không khớp
+        """
+        if tolerance is None:
+            tolerance = Config.FACE_RECOGNITION_TOLERANCE
+
+        num_faces = len(encodings)
+        columns = self._student_distances(self._as_matrix(encodings), partition) if num_faces else None
+        if columns is None:
+            return [(None, None, None)] * num_faces
+
+        distances, slots = columns
+        return self._assign(distances, slots, tolerance, unique)
+
+    def best_matches_batch(self, groups, tolerance=None, unique=False, partition=None):
+        """
+        best_matches cho nhiều nhóm encodings (vd: các ảnh của một batch) với một lần tính
+        khoảng cách duy nhất trên tất cả khuôn mặt; unique áp dụng riêng trong từng nhóm
+        Returns: list kết quả best_matches theo thứ tự groups
+        """
+        if tolerance is None:
+            tolerance = Config.FACE_RECOGNITION_TOLERANCE
+
+        sizes = [len(encodings) for encodings in groups]
+        columns = None
+        if sum(sizes) > 0:
+            queries = self._as_matrix([encoding for encodings in groups for encoding in encodings])
+            columns = self._student_distances(queries, partition)
+        if columns is None:
+            return [[(None, None, None)] * size for size in sizes]
+
+        distances, slots = columns
+        results = []
+        start = 0
+        for size in sizes:
+            results.append(self._assign(distances[start:start + size], slots, tolerance, unique))
+            start += size
+        return results
+
+    def _assign(self, distances, slots, tolerance, unique):
+        """Gán student cho từng khuôn mặt từ ma trận khoảng cách F x S"""
+        num_faces = len(distances)
+        if num_faces == 0:
+            return []
+        if unique:
+            assigned = assign_unique(distances, tolerance)
+        else:
+            assigned = np.argmin(distances, axis=1)
+            best = distances[np.arange(num_faces), assigned]
+            assigned[best > tolerance] = -1
+
+        results = []
+        for face_idx, idx in enumerate(assigned):
+            if idx < 0:
+                results.append((None, None, None))
+                continue
+            distance = float(distances[face_idx, idx])
+            results.append((self._id_of(slots[idx]), distance, (1 - distance) * 100))
+        return results
+
+
+class SnapshotGallery(FaceGallery):
+    """
+    Gallery hai lớp của EncodingStore: snapshot read-only (memory-mapped, các worker dùng chung
+    page cache) + overlay nhỏ chứa thay đổi sau snapshot (replay log, đăng ký mới)
+    - Snapshot không bao giờ bị ghi hay copy: student bị sửa / xóa chỉ bị ẩn khỏi snapshot
+      (mask theo slot), template mới nằm trong overlay (phần FaceGallery kế thừa)
+    - Mỗi student chỉ có mặt ở một lớp; khi match, khoảng cách theo student của hai lớp
+      được ghép cột (slot overlay đánh số sau slot snapshot)
+    - ANN index / bản nén chỉ dựng trên snapshot (index dựng ở nền khi gắn snapshot),
+      overlay luôn quét chính xác
+    - Compaction ghi cả hai lớp (arrays()) thành snapshot mới rồi map lại
+    - Ghi đồng thời với reader: sửa trên fork() rồi swap, không sửa gallery đang được đọc
+    """
+
+    def __init__(self, dim=128, capacity=None, storage=None):
+        super().__init__(dim, capacity, storage=storage)
+        self.index = None
+        self._set_base(self._new_base())
+
+    def _new_base(self):
+        return FaceGallery(self.dim, capacity=1, storage=self.storage)
+
+    def _set_base(self, base):
+        self._base = base
+        # _hidden[slot]: student của snapshot đã bị sửa / xóa (cấp phát khi cần)
+        self._hidden = None
+        self._hidden_students = 0
+        self._hidden_rows = 0
+        self._base_partition_rows = {}
+
+    def __len__(self):
+        return len(self._base) - self._hidden_rows + self._size
+
+    def __contains__(self, student_id):
+        return student_id in self._slot_of or self._base_slot(student_id) is not None
+
+    @property
+    def ids(self):
+        base_ids = self._base.ids
+        if self._hidden is not None:
+            base_ids = [student_id for slot, student_id in enumerate(base_ids) if not self._hidden[slot]]
+        return base_ids + self._ids
+
+    @property
+    def num_students(self):
+        return self._base.num_students - self._hidden_students + len(self._ids)
+
+    @property
+    def row_ids(self):
+        _, _, labels, ids = self.arrays()
+        return [ids[slot] for slot in labels]
+
+    @property
+    def matrix(self):
+        """Các hàng đang dùng: view của snapshot nếu chưa có thay đổi, nếu không thì bản ghép"""
+        return self.arrays()[0]
+
+    def _base_slot(self, student_id):
+        """Slot của student trong snapshot nếu chưa bị ẩn, ngược lại None"""
+        slot = self._base.index_of(student_id)
+        if slot is None or (self._hidden is not None and self._hidden[slot]):
+            return None
+        return slot
+
+    def _hide(self, student_id):
+        """Ẩn student khỏi snapshot. Returns: True nếu student đang có trong snapshot"""
+        slot = self._base_slot(student_id)
+        if slot is None:
+            return False
+        if self._hidden is None:
+            self._hidden = np.zeros(self._base.num_students, dtype=bool)
+        self._hidden[slot] = True
+        self._hidden_students += 1
+        self._hidden_rows += len(self._base._student_rows[slot])
+        return True
+
+    def get_templates(self, student_id):
+        if student_id in self._slot_of or self._base_slot(student_id) is None:
+            return super().get_templates(student_id)
+        return self._base.get_templates(student_id)
+
+    def _set_templates(self, student_id, vectors):
+        in_base = self._hide(student_id)
+        return super()._set_templates(student_id, vectors) and not in_base
+
+    def _remove(self, student_id):
+        in_base = self._hide(student_id)
+        return super()._remove(student_id) or in_base
+
+    def add_template(self, student_id, encoding):
+        if student_id not in self._slot_of and self._base_slot(student_id) is not None:
+            # Chuyển các template cũ của student từ snapshot sang overlay
+            templates = self._base.get_templates(student_id)
+            self._hide(student_id)
+            self._append_rows(self._new_slot(student_id), templates)
+        return super().add_template(student_id, encoding)
+
+    def load(self, ids, encodings):
+        self._set_base(self._new_base())
+        super().load(ids, encodings)
+
+    def attach(self, matrix, sq_norms, labels, ids):
+        """Gắn snapshot (read-only, không copy) làm lớp dưới, overlay rỗng"""
+        base = self._new_base()
+        base.attach(matrix, sq_norms, labels, ids)
+        self._set_base(base)
+        super().load([], [])
+
+    def fork(self):
+        """
+        Bản sao để sửa rồi swap (copy-and-swap): dùng chung snapshot, chỉ copy overlay + mask
+        Reader đang giữ bản cũ không bao giờ thấy hàng / slot đang bị sửa dở
+        """
+        other = copy.copy(self)
+        other._matrix = self._matrix.copy()
+        other._sq_norms = self._sq_norms.copy()
+        other._labels = self._labels.copy()
+        other._ids = list(self._ids)
+        other._slot_of = dict(self._slot_of)
+        other._student_rows = [list(rows) for rows in self._student_rows]
+        other._index_dirty_rows = set(self._index_dirty_rows)
+        if self._hidden is not None:
+            other._hidden = self._hidden.copy()
+        other._partitions = dict(self._partitions)
+        other._partition_rows = {}
+        other._base_partition_rows = {}
+        return other
+
+    def arrays(self):
+        """(matrix, sq_norms, labels, ids) của cả hai lớp, bỏ các student đã bị ẩn"""
+        matrix, sq_norms, labels, ids = self._base.arrays()
+        if self._hidden is None and self._size == 0 and not self._ids:
+            return matrix, sq_norms, labels, ids
+        if self._hidden is not None:
+            live = np.flatnonzero(~self._hidden)
+            remap = np.full(len(ids), -1, dtype=np.int32)
+            remap[live] = np.arange(len(live), dtype=np.int32)
+            rows = np.flatnonzero(~self._hidden[labels])
+            matrix, sq_norms, labels = matrix[rows], sq_norms[rows], remap[labels[rows]]
+            ids = [ids[slot] for slot in live]
+        overlay_matrix, overlay_sq_norms, overlay_labels, overlay_ids = super().arrays()
+        return (np.concatenate([matrix, overlay_matrix]),
+                np.concatenate([sq_norms, overlay_sq_norms]),
+                np.concatenate([labels, overlay_labels + len(ids)]).astype(np.int32),
+                list(ids) + overlay_ids)
+
+    def memory_usage(self):
+        base, overlay = self._base.memory_usage(), super().memory_usage()
+        return {key: base[key] + overlay[key] for key in base}
+
+    def set_index(self, index):
+        self._base.set_index(index)
+
+    def rebuild_index(self, background=False):
+        return self._base.rebuild_index(background)
+
+    def base_partition_rows(self, key):
+        """Hàng trong snapshot của roster key (bỏ student đã bị ẩn), cache theo version"""
+        stamp = (self.version, self.partitions_version)
+        cached = self._base_partition_rows.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        base = self._base
+        rows = [row for slot in map(self._base_slot, self._partitions[key]) if slot is not None
+                for row in base._student_rows[slot]]
+        rows = np.array(rows, dtype=np.int64)
+        self._base_partition_rows[key] = (stamp, rows)
+        return rows
+
+    def _student_distances(self, queries, partition=None):
+        columns = []
+        base = self._base
+        roster = partition is not None and partition in self._partitions
+        if len(base):
+            rows = self.base_partition_rows(partition) if roster else base._candidate_rows(queries)
+            if rows is None or len(rows):
+                distances, slots = base.student_distance_matrix(queries, rows)
+                if self._hidden is not None and not roster:
+                    keep = ~self._hidden[slots]
+                    distances, slots = distances[:, keep], slots[keep]
+                if len(slots):
+                    columns.append((distances, slots))
+        overlay = super()._student_distances(queries, partition)
+        if overlay is not None:
+            columns.append((overlay[0], overlay[1] + base.num_students))
+        if len(columns) < 2:
+            return columns[0] if columns else None
+        return (np.concatenate([distances for distances, _ in columns], axis=1),
+                np.concatenate([slots for _, slots in columns]))
+
+    def _id_of(self, slot):
+        base_students = self._base.num_students
+        if slot < base_students:
+            return self._base._ids[slot]
+        return self._ids[slot - base_students]
+
+    def verify(self, student_id, encoding, tolerance=None):
+        if student_id in self._slot_of or self._base_slot(student_id) is None:
+            return super().verify(student_id, encoding, tolerance)
+        return self._base.verify(student_id, encoding, tolerance)
@@ -0,0 +1,76 @@
+import threading
+from config import Config
+
+
+class GalleryReloader:
+    """
+    Hot reload gallery khi store trên đĩa thay đổi, không cần restart service
+    - signature_fn(): giá trị đại diện trạng thái store (generation, mtime + size...)
+    - build_fn(): dựng snapshot mới, chạy trong thread nền (ngoài luồng request)
+    - swap_fn(snapshot): gán reference mới. Phép gán attribute là atomic nên
+      request đang chạy vẫn đọc snapshot cũ mà không cần lock
+    - delta_fn(signature) (tùy chọn): áp phần thay đổi kể từ signature đã nạp,
+      trả về signature mới hoặc None nếu không áp được (khi đó dựng lại toàn bộ)
+    """
+
+    def __init__(self, signature_fn, build_fn, swap_fn, interval=None, lock=None, delta_fn=None):
+        self.signature_fn = signature_fn
+        self.build_fn = build_fn
+        self.swap_fn = swap_fn
+        self.delta_fn = delta_fn
+        self.interval = Config.GALLERY_RELOAD_INTERVAL if interval is None else interval
+        # Lock chỉ dùng chung với writer trong process, reader không bao giờ chờ
+        self.lock = lock or threading.RLock()
+        self.signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def mark_current(self, signature=None):
+        """Đánh dấu store hiện tại đã được nạp (vd: sau khi chính process này ghi)"""
+        self.signature = self.signature_fn() if signature is None else signature
+
+    def check(self):
+        """
+        Nạp lại nếu store đã đổi so với lần nạp trước
+        Returns: True nếu đã swap snapshot mới
+        """
+        with self.lock:
+            signature = self.signature_fn()
+            if signature is None or signature == self.signature:
+                return False
+            if self.delta_fn is not None and self.signature is not None:
+                try:
+                    applied = self.delta_fn(self.signature)
+                except Exception as e:
+                    print(f"⚠️ Error applying gallery delta, reloading fully: {e}")
+                    applied = None
+                if applied is not None:
+                    self.signature = applied
+                    return True
+            try:
+                snapshot = self.build_fn()
+            except Exception as e:
+                print(f"❌ Error reloading gallery: {e}")
+                return False
+            self.swap_fn(snapshot)
+            self.signature = signature
+            return True
+
+    def start(self):
+        """Chạy thread nền kiểm tra store mỗi `interval` giây (interval <= 0: tắt)"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='gallery-reloader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.check():
+                print("🔄 Gallery reloaded from store")
@@ -0,0 +1,427 @@
+import os
+import json
+import shutil
+import zlib
+from contextlib import contextmanager
+import numpy as np
+from config import Config
+from models.encoding_log import EncodingLog, apply_records
+from models.gallery import SnapshotGallery
+from models.student_table import StudentTable
+
+# Khóa file giữa các process (chỉ có trên POSIX)
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+def _file_crc32(path, chunk_size=1 << 20):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _fsync_dir(path):
+    """fsync thư mục để thao tác rename bền vững (không hỗ trợ trên Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class GalleryStore:
+    """
+    Store gallery trên đĩa: snapshot .npy memory-mapped + log append-only
+    - Mỗi lần compact ghi một generation (version) mới: <root>/gen-<n>/
+      (matrix, norms, labels + students.json: id, name, class của từng sinh viên
+      + rosters.json: roster các lớp)
+    - Snapshot được ghi vào thư mục tạm rồi rename (write-then-rename), kèm MANIFEST.json
+      chứa kích thước + CRC32 từng file
+    - File CURRENT trỏ tới generation hiện hành, đổi bằng os.replace (atomic)
+    - Thay đổi sau snapshot được ghi vào gen-<n>/log.bin (delta: upsert / tombstone / roster);
+      worker đã nạp version (n, offset) chỉ cần replay log từ offset đó
+    - Worker map read-only (np.load mmap_mode='r'): các trang nằm trong page cache
+      của OS nên RSS không tăng theo số worker
+    """
+
+    CURRENT_FILE = 'CURRENT'
+    LOG_FILE = 'log.bin'
+    LOCK_FILE = 'LOCK'
+    MANIFEST_FILE = 'MANIFEST.json'
+    SNAPSHOT_FILES = ('matrix.npy', 'sq_norms.npy', 'labels.npy', 'students.json', 'rosters.json')
+
+    def __init__(self, root=None, keep_generations=None, dim=128):
+        self.root = root or Config.GALLERY_SNAPSHOT_PATH
+        self.keep_generations = keep_generations or Config.GALLERY_KEEP_GENERATIONS
+        self.dim = dim
+        self._verified_end = {}     # generation -> offset đã kiểm tra CRC khi append
+        os.makedirs(self.root, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Khóa ghi giữa các process (append log / compact)"""
+        with open(os.path.join(self.root, self.LOCK_FILE), 'a') as f:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def log(self, generation):
+        return EncodingLog(os.path.join(self._generation_dir(generation), self.LOG_FILE), self.dim)
+
+    def signature(self):
+        """(generation, kích thước log) - đổi mỗi khi có process ghi; None nếu store trống"""
+        generation = self.current_generation()
+        if generation is None:
+            return None
+        return generation, self.log(generation).size()
+
+    def _generation_dir(self, generation):
+        return os.path.join(self.root, f"gen-{generation:08d}")
+
+    def generations(self):
+        """Các generation đang có trên đĩa, mới nhất trước"""
+        generations = []
+        for name in os.listdir(self.root):
+            if name.startswith('gen-'):
+                try:
+                    generations.append(int(name[4:]))
+                except ValueError:
+                    continue
+        return sorted(generations, reverse=True)
+
+    def _damaged_dir(self, generation):
+        return os.path.join(self.root, f".gen-{generation:08d}.damaged")
+
+    def damaged_generations(self):
+        """Các generation đã bị repair tách ra (.gen-<n>.damaged), mới nhất trước"""
+        generations = []
+        for name in os.listdir(self.root):
+            if name.startswith('.gen-') and name.endswith('.damaged'):
+                try:
+                    generations.append(int(name[5:-8]))
+                except ValueError:
+                    continue
+        return sorted(generations, reverse=True)
+
+    def current_generation(self):
+        """Generation hiện hành hoặc None nếu chưa publish lần nào"""
+        try:
+            with open(os.path.join(self.root, self.CURRENT_FILE), 'r', encoding='utf-8') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _write_array(self, path, array):
+        with open(path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _set_current(self, generation):
+        tmp_path = os.path.join(self.root, f"{self.CURRENT_FILE}.{generation}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.root, self.CURRENT_FILE))
+        _fsync_dir(self.root)
+
+    def publish(self, gallery, info=None):
+        """
+        Ghi snapshot mới của gallery (+ roster, thông tin sinh viên) rồi đổi CURRENT sang generation đó
+        Crash giữa chừng chỉ để lại thư mục tạm .gen-<n>.tmp, CURRENT vẫn trỏ snapshot cũ
+        Returns: generation đã publish
+        """
+        # Luôn mới hơn mọi generation đã có, kể cả generation hỏng đã tách ra
+        generation = max([self.current_generation() or 0] + self.generations() + self.damaged_generations()) + 1
+        path = os.path.join(self.root, f".gen-{generation:08d}.tmp")
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+        matrix, sq_norms, labels, ids = gallery.arrays()
+        n = len(labels)
+        self._write_array(os.path.join(path, 'matrix.npy'), matrix)
+        self._write_array(os.path.join(path, 'sq_norms.npy'), sq_norms)
+        self._write_array(os.path.join(path, 'labels.npy'), labels)
+        # Bảng sinh viên dạng cột: một lần đọc tuần tự khi khởi động
+        if not isinstance(info, StudentTable):
+            info = StudentTable(info)
+        known = set(ids)
+        students = {
+            'ids': list(ids),
+            # Sinh viên chỉ có thông tin, chưa có encoding
+            'extra_ids': [student_id for student_id in info if student_id not in known],
+        }
+        all_ids = students['ids'] + students['extra_ids']
+        columns = [info.lookup(student_id) for student_id in all_ids]
+        students['names'] = [name for name, _ in columns]
+        students['classes'] = [class_name for _, class_name in columns]
+        with open(os.path.join(path, 'students.json'), 'w', encoding='utf-8') as f:
+            json.dump(students, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(path, 'rosters.json'), 'w', encoding='utf-8') as f:
+            json.dump(gallery.partitions, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Manifest ghi sau cùng: checksum đọc lại từ file đã ghi
+        manifest = {
+            'generation': generation,
+            'dim': gallery.dim,
+            'rows': n,
+            'students': len(ids),
+            'files': {
+                name: {'size': os.path.getsize(os.path.join(path, name)),
+                       'crc32': _file_crc32(os.path.join(path, name))}
+                for name in self.SNAPSHOT_FILES
+            }
+        }
+        with open(os.path.join(path, self.MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(path)
+        os.rename(path, self._generation_dir(generation))
+        _fsync_dir(self.root)
+
+        # Chỉ tiến generation về phía trước
+        current = self.current_generation()
+        if current is None or current < generation:
+            self._set_current(generation)
+
+        self._cleanup(generation)
+        return generation
+
+    def load(self, generation=None):
+        """
+        Map read-only snapshot của generation (mặc định: CURRENT)
+        Returns: (generation, matrix, sq_norms, labels, ids, info, rosters) hoặc None - info là StudentTable,
+                 rosters là dict classroom_id -> list student_id
+        """
+        if generation is None:
+            generation = self.current_generation()
+        if generation is None:
+            return None
+        problems = self.verify(generation, deep=False)
+        if problems:
+            print(f"❌ Gallery snapshot {generation} is damaged: {'; '.join(problems)}")
+            return None
+        path = self._generation_dir(generation)
+        try:
+            matrix = np.load(os.path.join(path, 'matrix.npy'), mmap_mode='r')
+            sq_norms = np.load(os.path.join(path, 'sq_norms.npy'), mmap_mode='r')
+            labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+            students_file = os.path.join(path, 'students.json')
+            if os.path.exists(students_file):
+                with open(students_file, 'r', encoding='utf-8') as f:
+                    students = json.load(f)
+            else:
+                # Snapshot cũ chỉ có ids.json (chưa có thông tin sinh viên)
+                with open(os.path.join(path, 'ids.json'), 'r', encoding='utf-8') as f:
+                    ids = json.load(f)
+                students = {'ids': ids, 'extra_ids': [], 'names': [None] * len(ids), 'classes': [None] * len(ids)}
+            rosters = {}
+            rosters_file = os.path.join(path, 'rosters.json')
+            if os.path.exists(rosters_file):
+                # Snapshot cũ không có roster (roster nằm ở classroom_rosters.json)
+                with open(rosters_file, 'r', encoding='utf-8') as f:
+                    rosters = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ Error loading gallery snapshot {generation}: {e}")
+            return None
+        ids = students['ids']
+        info = StudentTable.from_columns(ids + students['extra_ids'], students['names'], students['classes'])
+        return generation, matrix, sq_norms, labels, ids, info, rosters
+
+    def verify(self, generation, deep=True):
+        """
+        Kiểm tra snapshot của generation
+        deep=False: chỉ kiểm tra manifest + kích thước file (nhanh, dùng khi nạp)
+        deep=True: kiểm tra cả CRC32 từng file và đuôi log
+        Returns: list mô tả lỗi (rỗng nếu hợp lệ)
+        """
+        path = self._generation_dir(generation)
+        if not os.path.isdir(path):
+            return ["missing directory"]
+        manifest_file = os.path.join(path, self.MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            # Snapshot ghi trước khi có manifest: không kiểm tra được checksum
+            return ["no manifest (written by an older version)"] if deep else []
+        problems = []
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            return [f"unreadable manifest: {e}"]
+        for name, expected in manifest['files'].items():
+            file_path = os.path.join(path, name)
+            if not os.path.exists(file_path):
+                problems.append(f"{name} missing")
+            elif os.path.getsize(file_path) != expected['size']:
+                problems.append(f"{name} size {os.path.getsize(file_path)} != {expected['size']}")
+            elif deep and _file_crc32(file_path) != expected['crc32']:
+                problems.append(f"{name} checksum mismatch")
+        if deep:
+            log = self.log(generation)
+            _, end = log.replay()
+            if end < log.size():
+                problems.append(f"log has {log.size() - end} bytes of torn/corrupt tail")
+        return problems
+
+    def open(self, gallery, info=None):
+        """
+        Nạp store vào gallery (+ dict thông tin sinh viên): map snapshot hiện hành rồi replay log
+        Snapshot hiện hành hỏng thì dùng generation cũ hơn còn nguyên vẹn
+        Returns: signature đã nạp hoặc None nếu store trống
+        """
+        snapshot = self.load()
+        if snapshot is None:
+            current = self.current_generation()
+            for generation in self.generations():
+                if current is not None and generation < current:
+                    snapshot = self.load(generation)
+                    if snapshot is not None:
+                        print(f"⚠️ Falling back to gallery snapshot {generation} "
+                              f"(run verify_gallery_store.py --repair)")
+                        break
+        if snapshot is None:
+            return None
+        return self._attach(snapshot, gallery, info)
+
+    def _attach(self, snapshot, gallery, info):
+        """Gắn snapshot (kết quả load) vào gallery + info rồi replay log của generation đó"""
+        generation, matrix, sq_norms, labels, ids, snapshot_info, rosters = snapshot
+        gallery.attach(matrix, sq_norms, labels, ids)
+        for classroom_id, student_ids in rosters.items():
+            gallery.set_partition(classroom_id, student_ids)
+        if info is not None:
+            info.clear()
+            info.update(snapshot_info)
+        records, end = self.log(generation).replay()
+        apply_records(gallery, records, info)
+        return generation, end
+
+    def append(self, records, sync=True):
+        """
+        Ghi các bản ghi (op, student_id, payload) vào log của generation hiện hành
+        (gọi trong `with store.locked()`)
+        Returns: signature sau khi ghi
+        """
+        generation = self.current_generation()
+        if generation is None:
+            raise RuntimeError("Gallery store is empty - compact a snapshot first")
+        log = self.log(generation)
+        # Cắt đuôi hỏng do crash trước đó để bản ghi mới không nằm sau rác
+        # (chỉ kiểm tra phần log ghi thêm từ lần trước)
+        _, end = log.replay(self._verified_end.get(generation, 0))
+        log.truncate(end)
+        log.append(records, sync=sync)
+        size = log.size()
+        self._verified_end = {generation: size}
+        return generation, size
+
+    def compact(self, gallery, info=None):
+        """
+        Ghi snapshot mới từ gallery, log của generation mới bắt đầu rỗng
+        (gọi trong `with store.locked()`)
+        Returns: signature sau khi ghi
+        """
+        generation = self.publish(gallery, info)
+        self._verified_end = {generation: 0}
+        return generation, 0
+
+    def read_delta(self, signature):
+        """
+        Các bản ghi ghi thêm kể từ version signature = (generation, offset)
+        Returns: (records, signature mới) hoặc None nếu generation đã đổi (cần nạp lại toàn bộ)
+        """
+        if signature is None:
+            return None
+        generation, offset = signature
+        if self.current_generation() != generation:
+            return None
+        records, end = self.log(generation).replay(offset)
+        return records, (generation, end)
+
+    def repair(self):
+        """
+        Sửa store sau crash (gọi trong `with store.locked()`):
+        cắt đuôi log hỏng, xóa thư mục tạm, tách snapshot hỏng ra (.gen-<n>.damaged)
+        và trỏ CURRENT về snapshot hợp lệ mới nhất.
+        Log của generation hỏng mới hơn snapshot đó chứa các thay đổi chưa có trong snapshot nào:
+        phần còn đọc được được replay lên snapshot hợp lệ rồi publish thành generation mới
+        (kể cả .gen-<n>.damaged của lần repair trước bị ngắt trước khi publish).
+        Không còn snapshot hợp lệ thì giữ nguyên CURRENT (cần khôi phục thủ công)
+        Returns: list mô tả các thao tác đã làm
+        """
+        actions = []
+        for name in os.listdir(self.root):
+            if name.startswith('.gen-') and name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                actions.append(f"removed unfinished snapshot {name}")
+        valid = []
+        for generation in self.generations():
+            problems = [p for p in self.verify(generation) if not p.startswith('log ') and not p.startswith('no manifest')]
+            if problems:
+                # Giữ lại để kiểm tra thủ công, không còn được coi là generation
+                damaged = self._damaged_dir(generation)
+                os.rename(self._generation_dir(generation), damaged)
+                actions.append(f"moved damaged generation {generation} to {os.path.basename(damaged)}: "
+                               f"{'; '.join(problems)}")
+                continue
+            valid.append(generation)
+            log = self.log(generation)
+            _, end = log.replay()
+            if end < log.size():
+                actions.append(f"truncated {log.size() - end} bytes of torn log in generation {generation}")
+                log.truncate(end)
+        current = self.current_generation()
+        self._verified_end = {}
+        if not valid:
+            if current is not None:
+                actions.append("no valid snapshot left: CURRENT unchanged, restore a backup or re-import")
+            return actions
+
+        orphaned = sorted(generation for generation in self.damaged_generations() if generation > valid[0])
+        if not orphaned:
+            if current not in valid:
+                self._set_current(valid[0])
+                actions.append(f"CURRENT {current} -> {valid[0]}")
+            return actions
+
+        gallery = SnapshotGallery(self.dim)
+        info = StudentTable()
+        self._attach(self.load(valid[0]), gallery, info)
+        replayed = 0
+        for generation in orphaned:
+            log = EncodingLog(os.path.join(self._damaged_dir(generation), self.LOG_FILE), self.dim)
+            records, _ = log.replay()
+            apply_records(gallery, records, info)
+            replayed += len(records)
+        generation = self.publish(gallery, info)
+        self._verified_end = {generation: 0}
+        actions.append(f"replayed {replayed} log records of damaged generation(s) "
+                       f"{', '.join(map(str, orphaned))} onto generation {valid[0]}")
+        actions.append(f"CURRENT {current} -> {generation}")
+        return actions
+
+    def _cleanup(self, latest):
+        """Xóa các generation cũ (worker đang map vẫn đọc được trên POSIX)"""
+        for generation in self.generations():
+            if generation <= latest - self.keep_generations:
+                shutil.rmtree(self._generation_dir(generation), ignore_errors=True)
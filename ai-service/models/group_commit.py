@@ -0,0 +1,114 @@
+import atexit
+import threading
+import time
+from config import Config
+
+
+class GroupCommitter:
+    """
+    Write-behind group commit: gom các bản ghi trong một cửa sổ ngắn rồi commit một lô
+    (một lần ghi + một fsync) trong thread nền
+    - submit(records): xếp hàng, trả về ticket (không chờ I/O)
+    - wait(ticket): chờ tới khi lô chứa ticket đã commit (chế độ bền vững)
+    - flush() / close(): commit mọi bản ghi đang chờ; close() được gọi khi thoát (atexit)
+    Lô lỗi được xếp lại đầu hàng đợi và thử lại ở lần commit sau
+    """
+
+    def __init__(self, commit_fn, after_commit_fn=None, window=None):
+        self.commit_fn = commit_fn
+        self.after_commit_fn = after_commit_fn
+        self.window = Config.GALLERY_COMMIT_WINDOW_MS / 1000 if window is None else window
+        self._cond = threading.Condition()
+        self._queue = []
+        self._inflight = []
+        self._submitted = 0     # ticket của lần submit gần nhất
+        self._committed = 0     # mọi ticket <= giá trị này đã bền vững
+        self._failed = 0        # ticket <= giá trị này đã gặp lỗi ít nhất một lần
+        self._closed = False
+        self.commits = 0        # số lô đã commit (thống kê)
+        self._thread = threading.Thread(target=self._run, name='gallery-committer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, records):
+        """Xếp hàng các bản ghi. Returns: ticket để wait()"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Committer is closed")
+            self._queue.extend(records)
+            self._submitted += 1
+            self._cond.notify_all()
+            return self._submitted
+
+    def wait(self, ticket, timeout=None):
+        """
+        Chờ ticket được commit
+        Returns: True nếu đã bền vững, False nếu lô bị lỗi hoặc hết thời gian chờ
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._committed < ticket:
+                if self._failed >= ticket:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def pending(self):
+        """Các bản ghi chưa bền vững (đang chờ + đang ghi), theo thứ tự submit"""
+        with self._cond:
+            return self._inflight + self._queue
+
+    def flush(self, timeout=None):
+        """Commit ngay mọi bản ghi đang chờ. Returns: True nếu thành công"""
+        with self._cond:
+            ticket = self._submitted
+        return self.wait(ticket, timeout)
+
+    def close(self):
+        """Flush rồi dừng thread nền"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                closing = self._closed
+            # Cửa sổ gom: các request đến liền nhau đi chung một lần fsync
+            if self.window > 0 and not closing:
+                time.sleep(self.window)
+            with self._cond:
+                batch, self._queue = self._queue, []
+                self._inflight = batch
+                ticket = self._submitted
+            try:
+                self.commit_fn(batch)
+                ok = True
+            except Exception as e:
+                print(f"❌ Error committing {len(batch)} gallery records: {e}")
+                ok = False
+            with self._cond:
+                self._inflight = []
+                if ok:
+                    self._committed = ticket
+                    self.commits += 1
+                else:
+                    self._queue = batch + self._queue
+                    self._failed = ticket
+                self._cond.notify_all()
+            if not ok:
+                if closing:
+                    return
+                time.sleep(max(self.window, 0.1))
+            elif self.after_commit_fn is not None:
+                self.after_commit_fn()
@@ -0,0 +1,105 @@
+import numpy as np
+from config import Config
+
+
+class Float16Codec:
+    """
+    Lưu bản nén float16 của gallery (2 byte / chiều)
+    Điểm thô: ||h||^2 - 2 h.q, tính theo block để không giải nén toàn bộ ma trận
+    """
+
+    name = 'float16'
+    dtype = np.float16
+
+    def __init__(self, dim, capacity):
+        self.dim = dim
+        self.codes = np.zeros((capacity, dim), dtype=self.dtype)
+        self.code_sq_norms = np.zeros(capacity, dtype=np.float32)
+
+    def fit(self, matrix):
+        """float16 không cần tham số"""
+        return
+
+    def write_rows(self, start, vectors):
+        end = start + len(vectors)
+        self.codes[start:end] = self._encode(vectors)
+        decoded = self.codes[start:end].astype(np.float32)
+        self.code_sq_norms[start:end] = np.einsum('ij,ij->i', decoded, decoded)
+
+    def _encode(self, vectors):
+        return vectors.astype(self.dtype)
+
+    def _query_weights(self, queries):
+        return queries
+
+    def coarse_scores(self, queries, size, block_size=None):
+        """
+        Xấp xỉ ||x - q||^2 - ||q||^2 cho mọi hàng (F x size)
+        Giải nén từng block vào một buffer float32 nhỏ (nằm trong cache) rồi nhân ma trận
+        """
+        if block_size is None:
+            block_size = Config.QUANT_BLOCK_SIZE
+        weights = self._query_weights(queries)
+        scores = np.empty((queries.shape[0], size), dtype=np.float32)
+        buffer = np.empty((min(block_size, size), self.dim), dtype=np.float32)
+        for start in range(0, size, block_size):
+            end = min(start + block_size, size)
+            block = buffer[:end - start]
+            np.copyto(block, self.codes[start:end])
+            scores[:, start:end] = weights @ block.T
+        scores *= -2.0
+        scores += self.code_sq_norms[:size][None, :]
+        return scores
+
+    def nbytes(self, size):
+        return self.codes[:size].nbytes
+
+
+class Int8Codec(Float16Codec):
+    """
+    Lượng tử hóa int8 với scale + offset theo từng chiều (1 byte / chiều)
+    x ~= offset + scale * code
+    ||q - x||^2 = ||q'||^2 - 2 (q' * scale) . code + ||scale * code||^2, với q' = q - offset
+    """
+
+    name = 'int8'
+    dtype = np.int8
+
+    def __init__(self, dim, capacity):
+        super().__init__(dim, capacity)
+        self.offset = np.zeros(dim, dtype=np.float32)
+        self.scale = np.full(dim, 1.0 / 127, dtype=np.float32)
+
+    def fit(self, matrix):
+        """Ước lượng offset/scale theo chiều từ dữ liệu hiện có (có dư 10% cho encoding mới)"""
+        if matrix.shape[0] == 0:
+            return
+        low = matrix.min(axis=0)
+        high = matrix.max(axis=0)
+        self.offset = ((low + high) / 2).astype(np.float32)
+        half_range = np.maximum((high - low) / 2 * 1.1, 1e-6)
+        self.scale = (half_range / 127).astype(np.float32)
+
+    def _encode(self, vectors):
+        codes = np.rint((vectors - self.offset) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def write_rows(self, start, vectors):
+        end = start + len(vectors)
+        self.codes[start:end] = self._encode(vectors)
+        scaled = self.codes[start:end].astype(np.float32) * self.scale
+        self.code_sq_norms[start:end] = np.einsum('ij,ij->i', scaled, scaled)
+
+    def _query_weights(self, queries):
+        # Điểm tính trên q' = q - offset; hằng số ||q'||^2 không ảnh hưởng thứ hạng
+        return (queries - self.offset) * self.scale
+
+
+def create_codec(dim, capacity, kind=None):
+    """Tạo codec nén theo Config.GALLERY_STORAGE ('float32' | 'float16' | 'int8')"""
+    kind = (kind or Config.GALLERY_STORAGE).lower()
+    if kind == 'float16':
+        return Float16Codec(dim, capacity)
+    if kind == 'int8':
+        return Int8Codec(dim, capacity)
+    return None
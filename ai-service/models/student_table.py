@@ -0,0 +1,135 @@
+from array import array
+from collections.abc import MutableMapping
+
+
+class StudentTable(MutableMapping):
+    """
+    Bảng thông tin sinh viên (name, class) dạng cột, mỗi sinh viên một hàng
+    - student_id -> số hàng (ổn định, hàng bị xóa được dùng lại); cột names, class_codes
+    - Tên lớp được intern: mỗi lớp lưu một lần, mỗi hàng chỉ giữ mã lớp int32
+    - Dùng như dict student_id -> {'name', 'class'} (dict chỉ được tạo khi đọc);
+      lookup() trả về tuple (name, class) không tạo dict, dùng cho đường nhận diện
+    """
+
+    def __init__(self, items=None):
+        self._row_of = {}
+        self._ids = []
+        self._names = []
+        self._class_codes = array('i')
+        self._classes = []
+        self._code_of = {}
+        self._free_rows = []
+        if items:
+            self.update(items)
+
+    @classmethod
+    def from_columns(cls, ids, names, classes):
+        """Dựng bảng từ các cột (bỏ qua sinh viên không có cả name lẫn class)"""
+        table = cls()
+        for student_id, name, class_name in zip(ids, names, classes):
+            if name is not None or class_name is not None:
+                table.set(student_id, name, class_name)
+        return table
+
+    def _intern(self, class_name):
+        if class_name is None:
+            return -1
+        code = self._code_of.get(class_name)
+        if code is None:
+            code = len(self._classes)
+            self._classes.append(class_name)
+            self._code_of[class_name] = code
+        return code
+
+    def set(self, student_id, name=None, class_name=None):
+        """Gán thông tin của student_id. Returns: số hàng"""
+        row = self._row_of.get(student_id)
+        code = self._intern(class_name)
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+                self._ids[row] = student_id
+                self._names[row] = name
+                self._class_codes[row] = code
+            else:
+                row = len(self._ids)
+                self._ids.append(student_id)
+                self._names.append(name)
+                self._class_codes.append(code)
+            self._row_of[student_id] = row
+        else:
+            self._names[row] = name
+            self._class_codes[row] = code
+        return row
+
+    def row_of(self, student_id):
+        """Số hàng của student_id hoặc None"""
+        return self._row_of.get(student_id)
+
+    def row(self, row):
+        """(student_id, name, class) của hàng"""
+        code = self._class_codes[row]
+        return self._ids[row], self._names[row], self._classes[code] if code >= 0 else None
+
+    def lookup(self, student_id):
+        """(name, class) của student_id, (None, None) nếu chưa có thông tin"""
+        row = self._row_of.get(student_id)
+        if row is None:
+            return None, None
+        code = self._class_codes[row]
+        return self._names[row], self._classes[code] if code >= 0 else None
+
+    @property
+    def classes(self):
+        """Các tên lớp đã intern (theo mã lớp)"""
+        return self._classes
+
+    def __getitem__(self, student_id):
+        row = self._row_of[student_id]
+        _, name, class_name = self.row(row)
+        return {'name': name, 'class': class_name}
+
+    def __setitem__(self, student_id, info):
+        self.set(student_id, info.get('name'), info.get('class'))
+
+    def __delitem__(self, student_id):
+        row = self._row_of.pop(student_id)
+        self._ids[row] = None
+        self._names[row] = None
+        self._class_codes[row] = -1
+        self._free_rows.append(row)
+
+    def __iter__(self):
+        return iter(self._row_of)
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, student_id):
+        return student_id in self._row_of
+
+    def clear(self):
+        self.__init__()
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, StudentTable) and not kwargs:
+            if not self._row_of:
+                # Bảng rỗng: copy nguyên các cột
+                self._row_of = dict(other._row_of)
+                self._ids = list(other._ids)
+                self._names = list(other._names)
+                self._class_codes = array('i', other._class_codes)
+                self._classes = list(other._classes)
+                self._code_of = dict(other._code_of)
+                self._free_rows = list(other._free_rows)
+            else:
+                for student_id, row in other._row_of.items():
+                    _, name, class_name = other.row(row)
+                    self.set(student_id, name, class_name)
+            return
+        super().update(other, **kwargs)
+
+    def copy(self):
+        table = StudentTable()
+        table.update(self)
+        return table
@@ -0,0 +1,114 @@
+"""
+Test utils.batch_recognition: tách body nhiều ảnh và chạy batch chỉ bằng thread
+(pipeline giả, không cần dlib)
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+from concurrent.futures import Future
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.batch_recognition import BatchRecognizer, pack_images, unpack_images
+
+
+class FakeFrame:
+    def __init__(self, image):
+        self.image = image
+        self.locations = None
+        self.encodings = None
+        self.cache_key = None
+        self.cache_entry = None
+        self.timings = {}
+
+
+class FakePipeline:
+    """prepare lỗi với ảnh 'broken', loại ảnh 'reject'; encode ghi kết quả vào frame"""
+
+    cache = None
+
+    def __init__(self):
+        self.encoded = []
+
+    def prepare(self, frame):
+        if frame.image == 'broken':
+            raise RuntimeError("decode failed")
+        return frame.image != 'reject'
+
+    def encode(self, frame):
+        self.encoded.append(frame.image)
+        frame.locations = [(0, 1, 1, 0)]
+        frame.encodings = [frame.image]
+        return frame.encodings
+
+
+class FailingExecutor:
+    """Process pool giả: mọi task đều lỗi (như worker bị kill)"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        self.submitted += 1
+        future = Future()
+        future.set_exception(RuntimeError("worker died"))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def run_batch(recognizer, frames):
+    batches = list(recognizer.run(frames))
+    return sorted(i for batch in batches for i in batch)
+
+
+def test_unpack_images_round_trip():
+    images = [b'\xff\xd8jpeg', b'', b'\x89PNG' * 1000]
+    views = unpack_images(pack_images(images))
+    assert [bytes(view) for view in views] == images
+    assert all(isinstance(view, memoryview) for view in views)
+
+
+def test_unpack_images_empty_body():
+    assert unpack_images(b'') == []
+
+
+@pytest.mark.parametrize('body', [
+    b'\x00\x00',                  # header độ dài bị cắt
+    b'\x00\x00\x00\x05abc',       # dữ liệu ngắn hơn độ dài khai báo
+    pack_images([b'ok']) + b'\x00',
+])
+def test_unpack_images_truncated(body):
+    with pytest.raises(ValueError):
+        unpack_images(body)
+
+
+def test_thread_only_batch():
+    pipeline = FakePipeline()
+    recognizer = BatchRecognizer(pipeline, threads=2, processes=0)
+    frames = [FakeFrame(name) for name in ('a', 'reject', 'broken', 'b')]
+
+    assert run_batch(recognizer, frames) == [0, 1, 2, 3]
+    assert recognizer._processes is None
+    assert sorted(pipeline.encoded) == ['a', 'b']
+    assert frames[0].encodings == ['a'] and frames[3].encodings == ['b']
+    assert frames[1].encodings is None
+    assert frames[2].image is None
+
+
+def test_process_failure_falls_back_to_threads():
+    pipeline = FakePipeline()
+    recognizer = BatchRecognizer(pipeline, threads=2, processes=1)
+    executor = FailingExecutor()
+    # Pool giả luôn được dùng lại, kể cả sau khi BatchRecognizer reset pool lỗi
+    recognizer._process_pool = lambda: executor
+    frames = [FakeFrame(name) for name in ('a', 'b')]
+
+    assert run_batch(recognizer, frames) == [0, 1]
+    assert executor.submitted == 2
+    assert sorted(pipeline.encoded) == ['a', 'b']
+    assert [frame.encodings for frame in frames] == [['a'], ['b']]
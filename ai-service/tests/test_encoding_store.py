@@ -0,0 +1,129 @@
+"""
+Test models.encoding_store: hai store trên cùng thư mục như hai process
+(catch-up theo log, compaction, roster, nhập lỗi giữa chừng)
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.encoding_store import EncodingStore
+
+DIM = 8
+
+
+def contents(gallery):
+    return {student_id: sorted(map(tuple, gallery.get_templates(student_id))) for student_id in gallery.ids}
+
+
+def encoding(value):
+    return np.full(DIM, value, dtype=np.float32)
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def open_store():
+        store = EncodingStore(str(tmp_path), dim=DIM, reload_interval=0, migrate_legacy=False)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def test_catch_up_applies_other_process_writes(open_store):
+    writer, reader = open_store(), open_store()
+    writer.upsert('A', encoding(1), name='An', class_name='K1', sync=True)
+    writer.upsert('B', encoding(2), sync=True)
+    writer.upsert('A', encoding(3), append=True, sync=True)
+
+    before = reader.gallery
+    assert reader.refresh()
+    # Catch-up sửa trên bản fork: gallery reader đang giữ không đổi
+    assert len(before) == 0
+    assert reader.gallery is not before
+    assert contents(reader.gallery) == contents(writer.gallery)
+    assert reader.get_info('A') == {'name': 'An', 'class': 'K1'}
+    assert reader.reloader.signature == writer.store.signature()
+    assert not reader.refresh()
+
+    writer.remove('B', sync=True)
+    writer.set_info('A', name='An Nguyen', class_name='K2', sync=True)
+    assert reader.refresh()
+    assert reader.gallery.ids == ['A']
+    assert reader.get_info('A') == {'name': 'An Nguyen', 'class': 'K2'}
+
+
+def test_compaction_reloads_full_snapshot(open_store):
+    writer, reader = open_store(), open_store()
+    writer.bulk_upsert([(f"S{i}", [encoding(i)]) for i in range(10)],
+                       {'S0': {'name': 'Zero', 'class': None}}, sync=True)
+    writer.bulk_remove(['S3', 'S4'], sync=True)
+    generation = writer.store.current_generation()
+
+    writer.compact()
+    assert writer.store.signature() == (generation + 1, 0)
+    # Sau compaction mọi template nằm trong snapshot, overlay rỗng
+    assert len(writer.gallery._base) == 8 and writer.gallery._size == 0
+
+    assert reader.refresh()
+    assert contents(reader.gallery) == contents(writer.gallery)
+    assert reader.get_info('S0')['name'] == 'Zero'
+    assert contents(open_store().gallery) == contents(writer.gallery)
+
+
+def test_rosters_follow_the_store(open_store):
+    writer, reader = open_store(), open_store()
+    writer.upsert('A', encoding(1), sync=True)
+    published = writer.gallery
+    writer.set_roster('room', ['A', 'B'], sync=True)
+    # Roster đổi qua fork + swap, không sửa gallery đã publish
+    assert published.get_partition('room') is None
+    assert reader.refresh() and reader.gallery.get_partition('room') == ['A', 'B']
+
+    writer.compact()
+    assert open_store().gallery.get_partition('room') == ['A', 'B']
+    assert reader.remove_roster('room', sync=True)
+    assert not reader.remove_roster('room')
+    assert writer.refresh() and writer.gallery.get_partition('room') is None
+
+
+def test_failed_import_leaves_store_unchanged(open_store):
+    store = open_store()
+    store.upsert('A', encoding(1), sync=True)
+    signature = store.store.signature()
+    gallery = store.gallery
+
+    def chunks():
+        yield [('B', [encoding(2)])], {}
+        raise IOError("connection lost")
+
+    with pytest.raises(IOError):
+        store.import_chunks(chunks(), replace=True)
+    assert store.gallery is gallery
+    assert store.store.signature() == signature
+    assert contents(open_store().gallery) == {'A': [tuple(encoding(1))]}
+
+    created, updated, removed = store.import_chunks([([('B', [encoding(2)])], {})], replace=True)
+    assert (created, updated, removed) == (1, 0, 1)
+    assert store.gallery.ids == ['B']
+    assert contents(open_store().gallery) == {'B': [tuple(encoding(2))]}
+
+
+def test_clear_keeps_rosters(open_store):
+    store = open_store()
+    store.upsert('A', encoding(1), sync=True)
+    store.set_roster('room', ['A'], sync=True)
+    store.clear()
+    assert len(store.gallery) == 0
+    reopened = open_store()
+    assert len(reopened.gallery) == 0
+    assert reopened.gallery.get_partition('room') == ['A']
@@ -0,0 +1,67 @@
+"""
+Test FaceRecognitionModel.recognize_face_top_k với gallery thật và pipeline giả
+(cần face_recognition để import model; không chạy detect / encode)
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('face_recognition')
+
+from models.face_recognition_model import FaceRecognitionModel
+from models.gallery import FaceGallery
+
+
+class FakePipeline:
+    """Ảnh truyền vào chính là encoding"""
+
+    def frame(self, image):
+        return image
+
+    def single_encoding(self, frame):
+        return frame, None
+
+
+def make_model(gallery):
+    model = FaceRecognitionModel.__new__(FaceRecognitionModel)
+    model.store = SimpleNamespace(gallery=gallery)
+    model.pipeline = FakePipeline()
+    return model
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.default_rng(0)
+    gallery = FaceGallery(dim=128, index=None, storage='float32')
+    gallery.load(['A', 'B'], rng.normal(0, 0.09, (2, 128)))
+    return gallery
+
+
+@pytest.mark.parametrize('roster', [[], ['NOT_REGISTERED']])
+def test_top_k_empty_roster_is_not_recognized(gallery, roster):
+    gallery.set_partition('room', roster)
+    result, message = make_model(gallery).recognize_face_top_k(gallery.get_templates('A')[0], classroom_id='room')
+
+    assert result['recognized'] is False
+    assert result['student_id'] is None
+    assert result['candidates'] == []
+    assert message == "No matching face found"
+
+
+def test_top_k_roster_scopes_candidates(gallery):
+    gallery.set_partition('room', ['B', 'NOT_REGISTERED'])
+    model = make_model(gallery)
+
+    result, _ = model.recognize_face_top_k(gallery.get_templates('B')[0], classroom_id='room')
+    assert result['recognized'] is True
+    assert [c['student_id'] for c in result['candidates']] == ['B']
+
+    result, _ = model.recognize_face_top_k(gallery.get_templates('A')[0], classroom_id='room')
+    assert result['student_id'] != 'A'
@@ -0,0 +1,214 @@
+"""
+Test models.gallery: FaceGallery và SnapshotGallery so với so khớp brute force
+(swap-remove, nhiều template, roster, top_k, fork)
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.gallery import FaceGallery, SnapshotGallery
+
+DIM = 16
+
+
+def brute_force(reference, queries, student_ids=None):
+    """[(student_id, distance)] tăng dần cho mỗi query: min khoảng cách Euclid trên các template"""
+    student_ids = sorted(reference) if student_ids is None else [s for s in student_ids if s in reference]
+    results = []
+    for query in queries:
+        ranked = [(student_id, float(np.linalg.norm(reference[student_id] - query, axis=1).min()))
+                  for student_id in student_ids]
+        results.append(sorted(ranked, key=lambda item: item[1]))
+    return results
+
+
+def assert_matches(gallery, reference, queries, partition=None, student_ids=None):
+    """Nội dung + top_k + best_matches của gallery khớp với bản tham chiếu"""
+    assert sorted(gallery.ids) == sorted(reference)
+    assert gallery.num_students == len(reference)
+    assert len(gallery) == sum(len(templates) for templates in reference.values())
+    for student_id, templates in reference.items():
+        assert sorted(map(tuple, gallery.get_templates(student_id))) == sorted(map(tuple, templates))
+
+    expected = brute_force(reference, queries, student_ids)
+    results = gallery.top_k(queries, k=3, partition=partition)
+    matches = gallery.best_matches(queries, tolerance=10.0, partition=partition)
+    for result, match, ranked in zip(results, matches, expected):
+        assert [student_id for student_id, _ in result['candidates']] == [s for s, _ in ranked[:3]]
+        np.testing.assert_allclose([d for _, d in result['candidates']], [d for _, d in ranked[:3]], atol=1e-4)
+        if len(ranked) >= 2:
+            assert result['margin'] == pytest.approx(ranked[1][1] - ranked[0][1], abs=1e-4)
+        else:
+            assert result['margin'] is None
+        assert match[0] == (ranked[0][0] if ranked else None)
+
+
+def random_ops(gallery, reference, rng, steps=200):
+    """Chuỗi thao tác ngẫu nhiên áp lên gallery và bản tham chiếu dict student_id -> T x dim"""
+    queries = rng.normal(size=(4, DIM)).astype(np.float32)
+    for step in range(steps):
+        op = rng.integers(5)
+        student_id = f"S{rng.integers(30)}"
+        vectors = rng.normal(size=(int(rng.integers(1, 4)), DIM)).astype(np.float32)
+        if op == 0:
+            assert gallery.set_templates(student_id, vectors) == (student_id not in reference)
+            reference[student_id] = vectors
+        elif op == 1:
+            assert gallery.add_template(student_id, vectors[0]) == (student_id not in reference)
+            reference[student_id] = np.vstack([reference.get(student_id, np.empty((0, DIM), np.float32)),
+                                               vectors[:1]])
+        elif op == 2:
+            assert gallery.remove(student_id) == (student_id in reference)
+            reference.pop(student_id, None)
+        elif op == 3:
+            items = [(f"S{i}", rng.normal(size=(2, DIM)).astype(np.float32)) for i in rng.integers(30, size=3)]
+            gallery.bulk_upsert(items)
+            reference.update(items)
+        else:
+            student_ids = [f"S{i}" for i in rng.integers(30, size=3)]
+            expected = len({s for s in student_ids if s in reference})
+            assert gallery.bulk_remove(student_ids) == expected
+            for removed in student_ids:
+                reference.pop(removed, None)
+        if step % 20 == 0:
+            assert_matches(gallery, reference, queries)
+    assert_matches(gallery, reference, queries)
+
+
+def make_snapshot(rng, num_students=12):
+    """SnapshotGallery gắn trên mảng read-only (như snapshot memory-mapped) + bản tham chiếu"""
+    reference = {f"S{i}": rng.normal(size=(int(rng.integers(1, 4)), DIM)).astype(np.float32)
+                 for i in range(num_students)}
+    base = FaceGallery(DIM, capacity=4, index=None, storage='float32')
+    base.bulk_upsert(reference.items())
+    arrays = []
+    for array in base.arrays()[:3]:
+        array = array.copy()
+        array.flags.writeable = False
+        arrays.append(array)
+    gallery = SnapshotGallery(DIM, capacity=4, storage='float32')
+    gallery.attach(*arrays, list(base.ids))
+    return gallery, reference, arrays
+
+
+def test_face_gallery_matches_brute_force():
+    rng = np.random.default_rng(0)
+    gallery = FaceGallery(DIM, capacity=2, index=None, storage='float32')
+    random_ops(gallery, {}, rng)
+
+
+def test_snapshot_gallery_matches_brute_force():
+    rng = np.random.default_rng(1)
+    gallery, reference, arrays = make_snapshot(rng)
+    copies = [array.copy() for array in arrays]
+    random_ops(gallery, reference, rng)
+    # Snapshot không bao giờ bị ghi
+    for array, original in zip(arrays, copies):
+        np.testing.assert_array_equal(array, original)
+
+
+def test_snapshot_arrays_round_trip():
+    rng = np.random.default_rng(2)
+    gallery, reference, _ = make_snapshot(rng)
+    gallery.remove('S0')
+    gallery.add_template('S1', rng.normal(size=DIM))
+    gallery.upsert('NEW', rng.normal(size=DIM))
+    reference.pop('S0')
+
+    # Ghép hai lớp rồi gắn lại (như compaction) phải cho cùng nội dung
+    compacted = SnapshotGallery(DIM, storage='float32')
+    compacted.attach(*gallery.arrays())
+    reference['S1'] = gallery.get_templates('S1')
+    reference['NEW'] = gallery.get_templates('NEW')
+    assert_matches(compacted, reference, rng.normal(size=(3, DIM)))
+
+
+def test_swap_remove_keeps_rows_consistent():
+    gallery = FaceGallery(DIM, capacity=2, index=None, storage='float32')
+    for i in range(5):
+        gallery.set_templates(f"S{i}", np.full((2, DIM), i, dtype=np.float32))
+    gallery.remove('S1')
+    gallery.set_templates('S3', np.full((1, DIM), 7, dtype=np.float32))
+
+    for student_id in gallery.ids:
+        rows = gallery._student_rows[gallery.index_of(student_id)]
+        assert all(gallery._labels[row] == gallery.index_of(student_id) for row in rows)
+    # Mỗi hàng đang dùng thuộc đúng một student
+    assert sorted(row for rows in gallery._student_rows for row in rows) == list(range(len(gallery)))
+    np.testing.assert_array_equal(gallery.get_templates('S4'), np.full((2, DIM), 4))
+    np.testing.assert_array_equal(gallery.get_templates('S3'), np.full((1, DIM), 7))
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+def test_partition_scopes_matching(snapshot):
+    rng = np.random.default_rng(3)
+    if snapshot:
+        gallery, reference, _ = make_snapshot(rng)
+    else:
+        reference = {f"S{i}": rng.normal(size=(2, DIM)).astype(np.float32) for i in range(12)}
+        gallery = FaceGallery(DIM, index=None, storage='float32')
+        gallery.bulk_upsert(reference.items())
+    queries = rng.normal(size=(3, DIM))
+    roster = ['S1', 'S4', 'S7', 'NOT_REGISTERED']
+    gallery.set_partition('room', roster)
+    assert_matches(gallery, reference, queries, partition='room', student_ids=roster)
+
+    # Roster theo dõi thay đổi của gallery (cache theo version)
+    gallery.remove('S4')
+    reference.pop('S4')
+    gallery.upsert('S7', rng.normal(size=DIM))
+    reference['S7'] = gallery.get_templates('S7')
+    assert_matches(gallery, reference, queries, partition='room', student_ids=roster)
+
+    # Lớp không có roster: toàn bộ gallery; roster không ai đăng ký: không khớp ai
+    assert_matches(gallery, reference, queries, partition='other')
+    gallery.set_partition('empty', ['NOT_REGISTERED'])
+    assert gallery.top_k(queries, partition='empty')[0] == {'candidates': [], 'margin': None}
+    assert gallery.best_matches(queries, partition='empty') == [(None, None, None)] * 3
+
+    version = gallery.partitions_version
+    gallery.remove_partition('room')
+    assert gallery.get_partition('room') is None
+    assert gallery.partitions_version > version
+
+
+def test_top_k_clamps_k():
+    gallery = FaceGallery(DIM, index=None, storage='float32')
+    assert gallery.top_k(np.zeros((2, DIM)), k=3) == [{'candidates': [], 'margin': None}] * 2
+    gallery.upsert('A', np.zeros(DIM))
+    result = gallery.top_k([np.zeros(DIM)], k=5)[0]
+    assert result['candidates'] == [('A', 0.0)]
+    assert result['margin'] is None
+
+
+def test_fork_is_isolated():
+    rng = np.random.default_rng(4)
+    gallery, reference, _ = make_snapshot(rng)
+    gallery.upsert('OVERLAY', rng.normal(size=DIM))
+    reference['OVERLAY'] = gallery.get_templates('OVERLAY')
+    # Đã có mask ẩn snapshot trước khi fork
+    gallery.remove('S5')
+    reference.pop('S5')
+    gallery.set_partition('room', ['S0', 'OVERLAY'])
+    queries = rng.normal(size=(3, DIM))
+    version = gallery.version
+
+    fork = gallery.fork()
+    fork.remove('S0')
+    fork.remove('OVERLAY')
+    fork.set_templates('S2', rng.normal(size=(3, DIM)))
+    fork.upsert('FORK_ONLY', rng.normal(size=DIM))
+    fork.set_partition('room', ['S2'])
+
+    assert gallery.version == version
+    assert gallery.get_partition('room') == ['S0', 'OVERLAY']
+    assert_matches(gallery, reference, queries)
+    assert_matches(gallery, reference, queries, partition='room', student_ids=['S0', 'OVERLAY'])
+    assert 'FORK_ONLY' in fork and 'FORK_ONLY' not in gallery
+    assert 'S0' in gallery and 'S0' not in fork
@@ -0,0 +1,160 @@
+"""
+Test models.gallery_store: generation + CURRENT, replay log / delta, đuôi log hỏng
+và repair sau crash (snapshot hỏng, log của generation hỏng được replay lại)
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.encoding_log import OP_UPSERT, OP_DELETE, OP_INFO, OP_ROSTER
+from models.gallery import FaceGallery, SnapshotGallery
+from models.gallery_store import GalleryStore
+from models.student_table import StudentTable
+
+DIM = 8
+
+
+def contents(gallery):
+    """student_id -> các template (đã sắp) để so sánh không phụ thuộc thứ tự hàng"""
+    return {student_id: sorted(map(tuple, gallery.get_templates(student_id))) for student_id in gallery.ids}
+
+
+def opened(store):
+    """Nạp store vào gallery + bảng thông tin mới như một process khác"""
+    gallery, info = SnapshotGallery(DIM, storage='float32'), StudentTable()
+    signature = store.open(gallery, info)
+    return gallery, info, signature
+
+
+def templates(value, count=1):
+    return np.full((count, DIM), value, dtype=np.float32)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = GalleryStore(str(tmp_path), keep_generations=2, dim=DIM)
+    gallery = FaceGallery(DIM, index=None, storage='float32')
+    gallery.bulk_upsert([('A', templates(1, 2)), ('B', templates(2))])
+    gallery.set_partition('room', ['A'])
+    with store.locked():
+        store.compact(gallery, {'A': {'name': 'An', 'class': 'K1'}})
+    return store
+
+
+def test_empty_store(tmp_path):
+    store = GalleryStore(str(tmp_path), dim=DIM)
+    assert store.signature() is None
+    assert store.load() is None
+    assert opened(store)[2] is None
+
+
+def test_snapshot_round_trip(store):
+    gallery, info, signature = opened(store)
+    assert signature == (1, 0)
+    assert contents(gallery) == {'A': [(1.0,) * DIM] * 2, 'B': [(2.0,) * DIM]}
+    assert info['A'] == {'name': 'An', 'class': 'K1'}
+    assert gallery.get_partition('room') == ['A']
+    assert store.verify(1) == []
+    # Snapshot được map read-only, không copy
+    assert not gallery._base.matrix.flags.writeable
+
+
+def test_generations_and_cleanup(store):
+    gallery, info, _ = opened(store)
+    for _ in range(3):
+        with store.locked():
+            store.compact(gallery, info)
+    assert store.current_generation() == 4
+    # keep_generations=2: chỉ giữ hai generation mới nhất
+    assert store.generations() == [4, 3]
+    assert contents(opened(store)[0]) == contents(gallery)
+
+
+def test_log_replay_and_delta(store):
+    with store.locked():
+        signature = store.append([(OP_UPSERT, 'C', templates(3)), (OP_INFO, 'C', {'name': 'Cu', 'class': None})])
+        assert signature == store.signature()
+        after = store.append([(OP_DELETE, 'A', None), (OP_ROSTER, 'room', ['B', 'C']), (OP_ROSTER, 'old', None)])
+
+    gallery, info, loaded = opened(store)
+    assert loaded == after
+    assert contents(gallery) == {'B': [(2.0,) * DIM], 'C': [(3.0,) * DIM]}
+    assert 'A' not in info and info['C'] == {'name': 'Cu', 'class': None}
+    assert gallery.get_partition('room') == ['B', 'C']
+
+    records, delta_signature = store.read_delta(signature)
+    assert delta_signature == after
+    assert [(op, key) for op, key, _ in records] == [(OP_DELETE, 'A'), (OP_ROSTER, 'room'), (OP_ROSTER, 'old')]
+    assert store.read_delta(after) == ([], after)
+
+    # Generation đổi: delta không áp được, phải nạp lại toàn bộ
+    with store.locked():
+        store.compact(gallery, info)
+    assert store.read_delta(after) is None
+    assert opened(store)[0].get_partition('room') == ['B', 'C']
+
+
+def test_torn_log_tail(store):
+    with store.locked():
+        store.append([(OP_UPSERT, 'C', templates(3))])
+    log = store.log(1)
+    valid_size = log.size()
+    with open(log.path, 'ab') as f:
+        f.write(b'\x01\x02torn record')
+
+    # Đuôi hỏng bị bỏ qua khi nạp, verify sâu báo lỗi, append cắt đuôi trước khi ghi
+    gallery, _, signature = opened(store)
+    assert signature == (1, valid_size)
+    assert 'C' in gallery
+    assert any(problem.startswith('log ') for problem in store.verify(1))
+    with store.locked():
+        store.append([(OP_UPSERT, 'D', templates(4))])
+    assert sorted(opened(store)[0].ids) == ['A', 'B', 'C', 'D']
+    assert store.verify(1) == []
+
+
+def test_repair_replays_damaged_generation(store):
+    with store.locked():
+        store.append([(OP_UPSERT, 'C', templates(3))])
+        gallery, info, _ = opened(store)
+        store.compact(gallery, info)
+        store.append([(OP_UPSERT, 'D', templates(4)), (OP_DELETE, 'B', None), (OP_ROSTER, 'room', ['D'])])
+    expected = contents(opened(store)[0])
+
+    # Snapshot hiện hành hỏng (ghi dở): nạp quay về generation trước
+    matrix_file = os.path.join(store._generation_dir(2), 'matrix.npy')
+    with open(matrix_file, 'r+b') as f:
+        f.truncate(os.path.getsize(matrix_file) - 4)
+    assert store.load() is None
+    assert sorted(opened(store)[0].ids) == ['A', 'B', 'C']
+
+    # Thư mục tạm của lần publish bị ngắt cũng được dọn
+    os.makedirs(os.path.join(store.root, '.gen-00000009.tmp'))
+    with store.locked():
+        actions = store.repair()
+    assert any('removed unfinished snapshot' in action for action in actions)
+    assert store.damaged_generations() == [2]
+    # Log của generation hỏng được replay lên generation 1 rồi publish thành generation mới
+    assert store.current_generation() == 3
+    gallery, _, _ = opened(store)
+    assert contents(gallery) == expected
+    assert gallery.get_partition('room') == ['D']
+    assert store.verify(3) == []
+
+    # Repair lần nữa không còn gì để làm
+    with store.locked():
+        assert store.repair() == []
+
+
+def test_repair_without_valid_snapshot_keeps_current(store):
+    os.remove(os.path.join(store._generation_dir(1), 'labels.npy'))
+    with store.locked():
+        actions = store.repair()
+    assert store.current_generation() == 1
+    assert any('no valid snapshot left' in action for action in actions)
@@ -0,0 +1,50 @@
+"""
+Test ImageProcessor.decode_base64: chuỗi thường, header data URL (decode theo khúc),
+base64 có xuống dòng và bytes / memoryview
+
+Chạy: python -m pytest tests
+"""
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.image_processing as image_processing
+from utils.image_processing import ImageProcessor
+
+RAW = bytes(range(256)) * 41 + b'tail'
+ENCODED = base64.b64encode(RAW).decode()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Khúc nhỏ để chuỗi test đi qua nhiều khúc
+    monkeypatch.setattr(image_processing, '_BASE64_CHUNK', 64)
+
+
+@pytest.mark.parametrize('data', [
+    ENCODED,
+    'data:image/jpeg;base64,' + ENCODED,
+    'data:image/jpeg;base64,' + base64.encodebytes(RAW).decode(),  # MIME: xuống dòng mỗi 76 ký tự
+    ('data:image/jpeg;base64,' + ENCODED).encode(),
+    memoryview(ENCODED.encode()),
+])
+def test_decode_base64(data):
+    assert bytes(ImageProcessor.decode_base64(data)) == RAW
+
+
+@pytest.mark.parametrize('data, expected', [
+    ('', b''),
+    ('data:,', b''),
+    ('data:image/png;base64,QQ==', b'A'),
+])
+def test_decode_base64_short(data, expected):
+    assert bytes(ImageProcessor.decode_base64(data)) == expected
+
+
+def test_decode_base64_invalid():
+    with pytest.raises(ValueError):
+        ImageProcessor.decode_base64('data:image/png;base64,QQ=')
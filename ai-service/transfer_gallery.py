@@ -0,0 +1,66 @@
+"""
+Export / import gallery (encodings + name, class) theo định dạng cột nhị phân, từng khối
+- export: đọc snapshot memory-mapped của store, ghi ra file (hoặc tải từ service qua --url)
+- import: đọc file theo khối và nạp vào store (hoặc gửi lên service qua --url)
+
+Chạy:
+  python transfer_gallery.py export gallery.fgal [--store data/encodings/gallery] [--url http://localhost:8000/api]
+  python transfer_gallery.py import gallery.fgal [--store ...] [--url ...] [--replace]
+"""
+import shutil
+import argparse
+import urllib.request
+
+from config import Config
+from models.encoding_transfer import MIME_TYPE
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('file', help='file .fgal')
+    parser.add_argument('--store', default=Config.GALLERY_SNAPSHOT_PATH, help='thư mục store (khi không dùng --url)')
+    parser.add_argument('--url', help='base URL của AI service, vd: http://localhost:8000/api')
+    parser.add_argument('--chunk', type=int, default=Config.GALLERY_TRANSFER_CHUNK, help='số sinh viên mỗi khối')
+    parser.add_argument('--replace', action='store_true', help='import: xóa sinh viên không có trong file')
+    args = parser.parse_args()
+
+    if args.url:
+        base = args.url.rstrip('/')
+        if args.command == 'export':
+            with urllib.request.urlopen(f"{base}/face/export?chunk={args.chunk}") as response, \
+                    open(args.file, 'wb') as f:
+                shutil.copyfileobj(response, f, 1 << 20)
+            print(f"✅ Exported to {args.file}")
+        else:
+            with open(args.file, 'rb') as f:
+                req = urllib.request.Request(
+                    f"{base}/face/import?replace={'true' if args.replace else 'false'}",
+                    data=f, method='POST', headers={'Content-Type': MIME_TYPE}
+                )
+                req.add_header('Content-Length', str(f.seek(0, 2)))
+                f.seek(0)
+                with urllib.request.urlopen(req) as response:
+                    print(response.read().decode('utf-8'))
+        return
+
+    from models.encoding_store import EncodingStore
+    from models.encoding_transfer import iter_export, iter_import
+
+    store = EncodingStore(root=args.store, reload_interval=0)
+    if args.command == 'export':
+        ids, matrix, labels, info = store.export_snapshot()
+        with open(args.file, 'wb') as f:
+            for chunk in iter_export(ids, matrix, labels, info, dim=store.dim, chunk_size=args.chunk):
+                f.write(chunk)
+        print(f"✅ Exported {len(ids)} students to {args.file}")
+    else:
+        with open(args.file, 'rb') as f:
+            created, updated, removed = store.import_chunks(iter_import(f, store.dim), args.replace)
+        print(f"✅ Imported {args.file}: {created} new, {updated} updated, {removed} removed, "
+              f"{store.gallery.num_students} students in store")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
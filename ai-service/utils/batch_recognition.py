@@ -0,0 +1,156 @@
+import time
+import struct
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from config import Config
+
+# Body nhị phân nhiều ảnh: lặp lại [độ dài uint32 big-endian][bytes ảnh nén]
+PACKED_MIME_TYPE = 'application/x-image-batch'
+_LENGTH = struct.Struct('>I')
+
+# FaceDetector riêng của mỗi process worker (tạo lần đầu dùng)
+_worker_detector = None
+
+
+def unpack_images(data):
+    """
+    Tách body PACKED_MIME_TYPE thành list memoryview (không copy bytes ảnh)
+    Raises: ValueError nếu body bị cắt cụt
+    """
+    view = memoryview(data)
+    images = []
+    offset = 0
+    while offset < len(view):
+        if offset + _LENGTH.size > len(view):
+            raise ValueError("Truncated image batch")
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        if offset + length > len(view):
+            raise ValueError("Truncated image batch")
+        images.append(view[offset:offset + length])
+        offset += length
+    return images
+
+
+def pack_images(images):
+    """Ghép list bytes ảnh nén thành body PACKED_MIME_TYPE"""
+    parts = []
+    for data in images:
+        parts.append(_LENGTH.pack(len(data)))
+        parts.append(bytes(data))
+    return b''.join(parts)
+
+
+def _detect_and_encode(image):
+    """Chạy trong process worker: detect + encode ảnh đã tiền xử lý"""
+    global _worker_detector
+    if _worker_detector is None:
+        from utils.face_detector import FaceDetector
+        _worker_detector = FaceDetector()
+    start = time.perf_counter()
+    locations = _worker_detector.detect_faces(image)
+    detected = time.perf_counter()
+    encodings = _worker_detector.get_face_encodings(image, locations) if locations else []
+    return locations, encodings, (detected - start) * 1000, (time.perf_counter() - detected) * 1000
+
+
+class BatchRecognizer:
+    """
+    Chạy pipeline cho nhiều ảnh cùng lúc
+    - Thread pool: hash / cache, decode, gate, resize, enhance (OpenCV nhả GIL)
+    - Process pool: detect + encode (dlib giữ GIL); Config.BATCH_DETECT_PROCESSES = 0 thì
+      chạy luôn trong thread pool
+    - Ảnh xong được trả về theo từng đợt (micro-batch) để phía gọi match chung một lần
+    Process pool tạo ở batch đầu tiên (spawn + nạp model dlib: batch đầu chậm hơn ~1 s).
+    Spawn chạy lại script chính (vd: app.py) trong mỗi worker dưới tên __mp_main__: script chính
+    không được khởi tạo model / store / thread ở mức module (để trong hàm hoặc dưới __main__)
+    """
+
+    def __init__(self, pipeline, threads=None, processes=None):
+        self.pipeline = pipeline
+        self.num_threads = threads or Config.MAX_WORKERS
+        self.num_processes = Config.BATCH_DETECT_PROCESSES if processes is None else processes
+        self._threads = None
+        self._processes = None
+        self._lock = threading.Lock()
+
+    def _thread_pool(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(self.num_threads, thread_name_prefix='batch')
+            return self._threads
+
+    def _process_pool(self):
+        if self.num_processes <= 0:
+            return None
+        with self._lock:
+            if self._processes is None:
+                # spawn: không fork process đang có thread (hot reload, thread pool)
+                self._processes = ProcessPoolExecutor(
+                    self.num_processes, mp_context=multiprocessing.get_context('spawn')
+                )
+                print(f"✅ Batch detect pool: {self.num_processes} processes")
+            return self._processes
+
+    def _reset_process_pool(self):
+        with self._lock:
+            if self._processes is not None:
+                self._processes.shutdown(wait=False)
+                self._processes = None
+
+    @staticmethod
+    def _set_result(frame, result):
+        locations, encodings, detect_ms, encode_ms = result
+        frame.locations = locations
+        frame.encodings = encodings
+        frame.timings['detect'] = detect_ms
+        frame.timings['encode'] = encode_ms
+
+    def run(self, frames):
+        """
+        Generator: mỗi lần yield list index các frame vừa xong (đã có locations + encodings,
+        hoặc ảnh lỗi / bị cổng chất lượng loại) theo thứ tự hoàn thành
+        """
+        threads = self._thread_pool()
+        pending = {threads.submit(self.pipeline.prepare, frame): ('prepare', i) for i, frame in enumerate(frames)}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            ready = []
+            for future in done:
+                stage, i = pending.pop(future)
+                frame = frames[i]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if stage != 'detect':
+                        print(f"⚠️ Batch {stage} failed for image {i}: {e}")
+                        frame.image = None
+                        ready.append(i)
+                        continue
+                    # Process worker lỗi (vd: bị kill): làm lại pool, chạy ảnh này trong thread
+                    print(f"⚠️ Batch detect process failed, retrying in thread: {e}")
+                    self._reset_process_pool()
+                    pending[threads.submit(self.pipeline.encode, frame)] = ('encode', i)
+                    continue
+
+                if stage == 'prepare':
+                    if not result or frame.cache_entry is not None:
+                        ready.append(i)
+                        continue
+                    processes = self._process_pool()
+                    if processes is None:
+                        pending[threads.submit(self.pipeline.encode, frame)] = ('encode', i)
+                    else:
+                        pending[processes.submit(_detect_and_encode, frame.image)] = ('detect', i)
+                    continue
+
+                if stage == 'detect':
+                    self._set_result(frame, result)
+                    if frame.cache_key is not None and self.pipeline.cache is not None:
+                        frame.cache_entry = self.pipeline.cache.put(frame.cache_key, frame.locations, frame.encodings)
+                ready.append(i)
+
+            if ready:
+                yield ready
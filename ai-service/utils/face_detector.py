@@ -2,19 +2,34 @@ import face_recognition
 import cv2
 import numpy as np
 from config import Config
+from utils.image_processing import ImageProcessor
 
 class FaceDetector:
     """Phát hiện và xử lý khuôn mặt"""
     
     def __init__(self):
         self.detection_model = Config.FACE_DETECTION_MODEL
+        self.detection_scale = Config.DETECTION_SCALE
     
-    def detect_faces(self, image):
+    def detect_faces(self, image, scale=None):
         """
         Phát hiện tất cả khuôn mặt trong ảnh
-        Returns: list of face locations [(top, right, bottom, left), ...]
+        scale: < 1 thì detect trên bản thu nhỏ (nhanh hơn ~1/scale^2) rồi đổi box về tọa độ ảnh gốc,
+               encode sau đó vẫn chạy trên ảnh đầy đủ (mặc định: Config.DETECTION_SCALE)
+        Returns: list of face locations [(top, right, bottom, left), ...] theo tọa độ image
         """
+        if scale is None:
+            scale = self.detection_scale
         try:
+            if 0 < scale < 1:
+                height, width = image.shape[:2]
+                size = (max(1, int(width * scale)), max(1, int(height * scale)))
+                # Bản thu nhỏ chỉ dùng để detect: buffer của workspace, không cấp phát mỗi frame
+                small = ImageProcessor.workspace().buffer('detect_small', (size[1], size[0]) + image.shape[2:])
+                cv2.resize(image, size, dst=small, interpolation=cv2.INTER_AREA)
+                face_locations = face_recognition.face_locations(small, model=self.detection_model)
+                return self.scale_locations(face_locations, width / size[0], height / size[1], image.shape)
+            
             face_locations = face_recognition.face_locations(
                 image, 
                 model=self.detection_model
@@ -24,6 +39,17 @@ class FaceDetector:
             print(f"Error detecting faces: {e}")
             return []
     
+    @staticmethod
+    def scale_locations(face_locations, scale_x, scale_y, shape):
+        """Đổi box (top, right, bottom, left) theo tỉ lệ, cắt trong khung ảnh shape"""
+        height, width = shape[:2]
+        return [(
+            max(0, int(round(top * scale_y))),
+            min(width, int(round(right * scale_x))),
+            min(height, int(round(bottom * scale_y))),
+            max(0, int(round(left * scale_x)))
+        ) for top, right, bottom, left in face_locations]
+    
     def detect_single_face(self, image):
         """
         Phát hiện một khuôn mặt duy nhất
@@ -191,8 +217,8 @@ class FaceDetector:
         # Kiểm tra độ sáng
         brightness = np.mean(gray)
         
-        is_clear = blur_score > 100  # Ngưỡng độ mờ
-        is_bright_enough = 30 < brightness < 225  # Ngưỡng độ sáng
+        is_clear = bool(blur_score > 100)  # Ngưỡng độ mờ
+        is_bright_enough = bool(30 < brightness < 225)  # Ngưỡng độ sáng
         
         return is_clear and is_bright_enough, {
             'blur_score': float(blur_score),
@@ -3,11 +3,76 @@ import numpy as np
 from PIL import Image
 import io
 import base64
+import binascii
+import threading
 from config import Config
 
+# Cờ decode JPEG thu nhỏ của OpenCV theo hệ số (libjpeg scale khi decode)
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Số byte đầu file đủ chứa header JPEG (SOF nằm sau EXIF, tối đa ~64 KB mỗi segment)
+_HEADER_BYTES = 256 * 1024
+
+# Số ký tự base64 decode mỗi lần cho chuỗi có header data URL (bội số của 4)
+_BASE64_CHUNK = 1 << 20
+
+class ImageWorkspace(threading.local):
+    """
+    Workspace riêng của từng thread: cache đối tượng OpenCV (CLAHE, cascade - không thread-safe)
+    và buffer trung gian cho các phép chuyển màu, dùng lại giữa các frame cùng kích thước
+    """
+
+    def __init__(self):
+        self._clahe = None
+        self._face_cascade = None
+        self._buffers = {}
+
+    @property
+    def clahe(self):
+        if self._clahe is None:
+            self._clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        return self._clahe
+
+    @property
+    def face_cascade(self):
+        if self._face_cascade is None:
+            self._face_cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            )
+        return self._face_cascade
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """Buffer tên name (cấp phát lại khi đổi kích thước). Chỉ dùng cho kết quả trung gian"""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+
+_workspace = ImageWorkspace()
+
+# LUT gamma theo giá trị gamma (adaptive_enhance)
+_GAMMA_LUTS = {}
+
 class ImageProcessor:
     """Xử lý và tiền xử lý ảnh"""
     
+    # Kích thước làm việc của pipeline nhận diện (resize_image mặc định)
+    WORKING_SIZE = (800, 800)
+    
+    # Mã lý do cổng chất lượng (assess_quality) -> thông báo lỗi
+    QUALITY_MESSAGES = {
+        'too_dark': "Image too dark",
+        'overexposed': "Image overexposed",
+        'low_contrast': "Image has no contrast (camera covered or out of focus)",
+        'blurry': "Image too blurry",
+    }
+    
     @staticmethod
     def validate_image(file):
         """Kiểm tra file ảnh hợp lệ"""
@@ -33,33 +98,98 @@ class ImageProcessor:
             return None
     
     @staticmethod
-    def load_image_from_bytes(image_bytes):
-        """Đọc ảnh từ bytes"""
+    def reduced_decode_flag(image_bytes, max_width, max_height):
+        """
+        Cờ imdecode cho JPEG: decode thẳng ở 1/2, 1/4 hoặc 1/8 kích thước, chọn hệ số lớn nhất
+        mà ảnh decode vẫn >= kích thước đích (đọc kích thước từ header, không decode)
+        Returns: cv2.IMREAD_COLOR nếu không thu nhỏ được (ảnh nhỏ, không phải JPEG...)
+        """
         try:
+            # Header (kể cả EXIF) nằm ở đầu file: chỉ đưa phần đầu cho PIL
+            with Image.open(io.BytesIO(memoryview(image_bytes)[:_HEADER_BYTES])) as header:
+                if header.format != 'JPEG':
+                    return cv2.IMREAD_COLOR
+                width, height = header.size
+        except Exception:
+            return cv2.IMREAD_COLOR
+        # Ảnh có thể bị xoay theo EXIF khi decode: lấy tỷ lệ thu nhỏ ít nhất của hai chiều xoay
+        ratio = max(min(max_width / width, max_height / height),
+                    min(max_width / height, max_height / width))
+        for factor, flag in _REDUCED_DECODE_FLAGS:
+            if factor * ratio <= 1:
+                return flag
+        return cv2.IMREAD_COLOR
+    
+    @staticmethod
+    def load_image_from_bytes(image_bytes, max_width=None, max_height=None):
+        """
+        Đọc ảnh từ bytes
+        max_width, max_height: kích thước sẽ resize tới; JPEG lớn được decode thu nhỏ sẵn
+        (ảnh trả về vẫn >= kích thước này, resize_image làm nốt phần còn lại)
+        """
+        try:
+            flag = cv2.IMREAD_COLOR
+            if max_width is not None and max_height is not None:
+                flag = ImageProcessor.reduced_decode_flag(image_bytes, max_width, max_height)
             nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            image = cv2.imdecode(nparr, flag)
             return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         except Exception as e:
             print(f"Error loading image from bytes: {e}")
             return None
     
     @staticmethod
-    def load_image_from_base64(base64_string):
+    def decode_base64(data):
+        """
+        Decode base64 (str, bytes hoặc memoryview; có thể kèm header 'data:image/...;base64,')
+        - str không header: binascii đọc thẳng buffer ASCII của str (không encode sang bytes)
+        - str có header: không cắt cả chuỗi (slice là một bản sao) mà decode từng khúc
+          _BASE64_CHUNK ký tự vào một buffer cấp phát một lần; base64 có xuống dòng làm khúc
+          lệch nhóm 4 ký tự thì decode lại một lần phần sau header (có bản sao)
+        - bytes / memoryview: cắt header bằng view
+        Returns: bytes hoặc bytearray
+        """
+        if isinstance(data, str):
+            # Header data URL chỉ nằm ở đầu chuỗi (base64 không chứa dấu phẩy)
+            comma = data.find(',', 0, 128)
+            if comma < 0:
+                return binascii.a2b_base64(data)
+            start = comma + 1
+            try:
+                decoded = bytearray((len(data) - start + 3) // 4 * 3)
+                size = 0
+                for pos in range(start, len(data), _BASE64_CHUNK):
+                    chunk = binascii.a2b_base64(data[pos:pos + _BASE64_CHUNK])
+                    decoded[size:size + len(chunk)] = chunk
+                    size += len(chunk)
+                del decoded[size:]
+                return decoded
+            except binascii.Error:
+                decoded = None
+                return binascii.a2b_base64(data[start:])
+        view = memoryview(data)
+        comma = bytes(view[:128]).find(b',')
+        if comma >= 0:
+            view = view[comma + 1:]
+        return binascii.a2b_base64(view)
+    
+    @staticmethod
+    def load_image_from_base64(base64_string, max_width=None, max_height=None):
         """Đọc ảnh từ base64"""
         try:
-            # Xóa header nếu có
-            if ',' in base64_string:
-                base64_string = base64_string.split(',')[1]
-            
-            image_bytes = base64.b64decode(base64_string)
-            return ImageProcessor.load_image_from_bytes(image_bytes)
+            image_bytes = ImageProcessor.decode_base64(base64_string)
+            return ImageProcessor.load_image_from_bytes(image_bytes, max_width, max_height)
         except Exception as e:
             print(f"Error loading image from base64: {e}")
             return None
     
     @staticmethod
-    def resize_image(image, max_width=800, max_height=800):
-        """Resize ảnh giữ nguyên tỷ lệ"""
+    def resize_image(image, max_width=None, max_height=None):
+        """Resize ảnh giữ nguyên tỷ lệ (mặc định: WORKING_SIZE)"""
+        if max_width is None:
+            max_width = ImageProcessor.WORKING_SIZE[0]
+        if max_height is None:
+            max_height = ImageProcessor.WORKING_SIZE[1]
         height, width = image.shape[:2]
         
         if width <= max_width and height <= max_height:
@@ -72,21 +202,126 @@ class ImageProcessor:
         return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
     
     @staticmethod
-    def enhance_image(image):
-        """Cải thiện chất lượng ảnh"""
-        # Chuyển sang LAB color space
-        lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
+    def workspace():
+        """Workspace (CLAHE, cascade, buffer) của thread hiện tại"""
+        return _workspace
+    
+    @staticmethod
+    def enhance_image(image, dst=None):
+        """
+        Cải thiện chất lượng ảnh
+        dst: mảng kết quả có sẵn (cùng shape, uint8) để không cấp phát mới, vd: trong vòng lặp camera
+        """
+        workspace = _workspace
+        shape = image.shape
+        # Chuyển sang LAB color space (buffer dùng lại giữa các frame)
+        lab = workspace.buffer('lab', shape)
+        cv2.cvtColor(image, cv2.COLOR_RGB2LAB, dst=lab)
+        l = workspace.buffer('l', shape[:2])
+        cv2.extractChannel(lab, 0, dst=l)
+        
+        # Áp dụng CLAHE (Contrast Limited Adaptive Histogram Equalization) lên kênh L
+        l_enhanced = workspace.buffer('l_enhanced', shape[:2])
+        workspace.clahe.apply(l, dst=l_enhanced)
+        
+        # Ghi kênh L trở lại rồi chuyển về RGB
+        cv2.insertChannel(l_enhanced, lab, 0)
+        if dst is None:
+            dst = np.empty(shape, dtype=np.uint8)
+        cv2.cvtColor(lab, cv2.COLOR_LAB2RGB, dst=dst)
+        
+        return dst
+    
+    @staticmethod
+    def luminance_stats(image, bgr=False):
+        """
+        Thống kê độ sáng trên thumbnail xám (cạnh dài <= QUALITY_THUMB_SIZE px)
+        Chỉ đọc một hàng giữa mỗi khối factor hàng (~0.3 ms ở 800x600, ~0.4 ms ở 1080p)
+        bgr: frame camera / video chưa chuyển sang RGB
+        Returns: {'brightness', 'contrast', 'sharpness'}
+        """
+        height, width = image.shape[:2]
+        factor = -(-max(height, width) // Config.QUALITY_THUMB_SIZE)
+        size = (width // factor, height // factor)
+        # Lấy mẫu hàng: view cách factor hàng (không copy), chỉ đọc 1/factor dữ liệu frame
+        rows = image[factor // 2:size[1] * factor:factor, :size[0] * factor]
+        if rows.ndim == 3 and rows.shape[2] > 1:
+            gray = _workspace.buffer('quality_rows', rows.shape[:2])
+            cv2.cvtColor(rows, cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY, dst=gray)
+        else:
+            gray = np.ascontiguousarray(rows.reshape(rows.shape[:2]))
+        if factor > 1:
+            # Theo chiều ngang INTER_AREA lấy trung bình từng khối factor pixel (chống aliasing:
+            # lấy mẫu cách đều tạo cạnh giả làm ảnh mờ vẫn có phương sai Laplacian cao)
+            thumb = _workspace.buffer('quality_thumb', (size[1], size[0]))
+            cv2.resize(gray, size, dst=thumb, interpolation=cv2.INTER_AREA)
+            gray = thumb
+        
+        mean, std = cv2.meanStdDev(gray)
+        _, laplacian_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+        return {
+            'brightness': float(mean[0, 0]),
+            'contrast': float(std[0, 0]),
+            'sharpness': float(laplacian_std[0, 0] ** 2),
+        }
+    
+    @staticmethod
+    def assess_quality(image, bgr=False):
+        """
+        Kiểm tra nhanh chất lượng frame (luminance_stats) để loại frame vô vọng
+        trước khi tiền xử lý + detect + encode
+        Returns: (mã lý do trong QUALITY_MESSAGES hoặc None nếu dùng được, metrics)
+        """
+        metrics = ImageProcessor.luminance_stats(image, bgr)
         
-        # Áp dụng CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        l = clahe.apply(l)
+        if metrics['brightness'] < Config.QUALITY_MIN_BRIGHTNESS:
+            return 'too_dark', metrics
+        if metrics['brightness'] > Config.QUALITY_MAX_BRIGHTNESS:
+            return 'overexposed', metrics
+        if metrics['contrast'] < Config.QUALITY_MIN_CONTRAST:
+            return 'low_contrast', metrics
+        if metrics['sharpness'] < Config.QUALITY_MIN_SHARPNESS:
+            return 'blurry', metrics
+        return None, metrics
+    
+    @staticmethod
+    def gamma_lut(gamma):
+        """LUT 256 mức cho out = 255 * (in / 255) ^ gamma (cache theo gamma, chỉ đọc)"""
+        lut = _GAMMA_LUTS.get(gamma)
+        if lut is None:
+            lut = np.clip(255.0 * (np.arange(256) / 255.0) ** gamma + 0.5, 0, 255).astype(np.uint8)
+            lut.flags.writeable = False
+            _GAMMA_LUTS[gamma] = lut
+        return lut
+    
+    @staticmethod
+    def adaptive_enhance(image, stats=None, dst=None):
+        """
+        Enhance theo thống kê độ sáng thay vì luôn chạy CLAHE (Config.ENHANCE_MODE = 'adaptive'):
+        - 'none': đủ tương phản, độ sáng trong khoảng -> giữ nguyên ảnh
+        - 'gamma': đủ tương phản nhưng tối / sáng -> LUT gamma đưa độ sáng trung bình về ~128
+        - 'clahe': tương phản thấp -> CLAHE đầy đủ (enhance_image)
+        stats: luminance_stats đã đo (vd: từ cổng chất lượng), None thì tự đo
+        Returns: (ảnh, nhánh đã chạy)
+        """
+        mode = Config.ENHANCE_MODE
+        if mode == 'none':
+            return image, 'none'
+        if mode != 'adaptive':
+            return ImageProcessor.enhance_image(image, dst), 'clahe'
         
-        # Merge lại
-        enhanced_lab = cv2.merge([l, a, b])
-        enhanced_image = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2RGB)
+        if stats is None:
+            stats = ImageProcessor.luminance_stats(image)
+        brightness = stats['brightness']
+        if stats['contrast'] < Config.ENHANCE_MIN_CONTRAST:
+            return ImageProcessor.enhance_image(image, dst), 'clahe'
+        if Config.ENHANCE_MIN_BRIGHTNESS <= brightness <= Config.ENHANCE_MAX_BRIGHTNESS:
+            return image, 'none'
         
-        return enhanced_image
+        # gamma sao cho (brightness / 255) ^ gamma = 0.5, làm tròn 0.05 để dùng lại LUT
+        mean = min(max(brightness, 1.0), 254.0) / 255.0
+        gamma = round(min(max(np.log(0.5) / np.log(mean), 0.3), 3.0) * 20) / 20
+        return cv2.LUT(image, ImageProcessor.gamma_lut(gamma), dst=dst), 'gamma'
     
     @staticmethod
     def denoise_image(image):
@@ -96,9 +331,8 @@ class ImageProcessor:
     @staticmethod
     def detect_and_align_face(image):
         """Phát hiện và căn chỉnh khuôn mặt"""
-        face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
+        # Cascade đã parse sẵn trong workspace của thread (không đọc lại XML mỗi lần)
+        face_cascade = _workspace.face_cascade
         
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         faces = face_cascade.detectMultiScale(gray, 1.3, 5)
@@ -126,8 +360,8 @@ class ImageProcessor:
         # Resize
         processed = ImageProcessor.resize_image(image)
         
-        # Enhance
-        processed = ImageProcessor.enhance_image(processed)
+        # Enhance (bỏ qua / gamma / CLAHE tùy độ sáng)
+        processed, _ = ImageProcessor.adaptive_enhance(processed)
         
         # Denoise (tùy chọn)
         # processed = ImageProcessor.denoise_image(processed)
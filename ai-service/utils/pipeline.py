@@ -0,0 +1,250 @@
+import time
+from config import Config
+from utils.image_processing import ImageProcessor
+from utils.face_detector import FaceDetector
+
+
+class Frame:
+    """
+    Một ảnh đi qua pipeline nhận diện
+    Mỗi stage (decode -> gate -> resize -> enhance -> detect -> encode -> match) chạy tối đa một lần
+    trên frame và ghi lại thời gian chạy (ms) trong timings
+    """
+
+    def __init__(self, image=None, data=None, base64_data=None):
+        self.data = data                # bytes ảnh nén (JPEG/PNG) chưa decode
+        self.base64_data = base64_data  # chuỗi base64 chưa decode
+        self.image = image              # RGB, sau resize / enhance là ảnh đã xử lý
+        self.locations = None
+        self.encodings = None
+        self.matches = None
+        self.cache_key = None
+        self.cache_entry = None         # entry cache (locations + encodings) của ảnh, nếu có
+        self.quality = None             # metrics của cổng chất lượng
+        self.reject_reason = None       # mã lý do nếu cổng chất lượng loại frame
+        self.enhancement = None         # nhánh enhance đã chạy: 'none', 'gamma' hoặc 'clahe'
+        self.timings = {}
+
+    def done(self, stage):
+        return stage in self.timings
+
+    @property
+    def cache_hit(self):
+        """locations + encodings lấy từ cache (không detect / encode trên frame này)"""
+        return self.cache_entry is not None and not self.done('detect')
+
+    @property
+    def total_ms(self):
+        return sum(self.timings.values())
+
+
+class RecognitionPipeline:
+    """
+    Pipeline nhận diện: decode -> gate -> resize -> enhance -> detect -> encode -> match
+    - Mỗi stage gọi các stage trước nó nếu frame chưa qua, nên gọi thẳng encode()
+      hay detect() trên ảnh thô đều được và không stage nào chạy hai lần
+    - Model nhận Frame đã xử lý (hoặc ảnh thô, khi đó tự tạo Frame)
+    - Có cache (RecognitionCache): ảnh upload trùng nội dung lấy lại locations + encodings,
+      request đồng thời cùng ảnh chỉ detect + encode một lần
+    - Cổng chất lượng (gate) ngay sau decode: frame tối / cháy sáng / mờ bị loại với mã lý do
+      (frame.reject_reason), không tốn resize / enhance / detect / encode
+    """
+
+    STAGES = ('hash', 'decode', 'gate', 'resize', 'enhance', 'detect', 'encode', 'match')
+
+    def __init__(self, image_processor=None, face_detector=None, cache=None, quality_gate=None):
+        self.image_processor = image_processor or ImageProcessor()
+        self.face_detector = face_detector or FaceDetector()
+        self.cache = cache
+        self.quality_gate = Config.QUALITY_GATE_ENABLED if quality_gate is None else quality_gate
+
+    def frame(self, image=None, data=None, base64_data=None):
+        """Tạo Frame từ ảnh RGB, bytes ảnh nén hoặc chuỗi base64 (chưa chạy stage nào)"""
+        if isinstance(image, Frame):
+            return image
+        return Frame(image, data, base64_data)
+
+    def _run(self, frame, stage, fn):
+        if frame.done(stage):
+            return
+        start = time.perf_counter()
+        fn()
+        frame.timings[stage] = (time.perf_counter() - start) * 1000
+
+    # ---------- Cache theo nội dung ảnh ----------
+    def _cache_key(self, frame):
+        """Key cache của frame (chỉ ảnh upload dạng bytes / base64), None nếu không cache được"""
+        if self.cache is None or frame.image is not None:
+            return frame.cache_key
+
+        def run():
+            if frame.base64_data is not None:
+                # base64 và upload nhị phân của cùng một ảnh dùng chung key
+                try:
+                    frame.data = self.image_processor.decode_base64(frame.base64_data)
+                except Exception as e:
+                    print(f"Error loading image from base64: {e}")
+                frame.base64_data = None
+            if frame.data is not None:
+                params = (self.image_processor.WORKING_SIZE, self.face_detector.detection_model,
+                          self.face_detector.detection_scale, Config.NUM_JITTERS)
+                frame.cache_key = self.cache.key(frame.data, params)
+        self._run(frame, 'hash', run)
+        return frame.cache_key
+
+    def _use_entry(self, frame, entry):
+        frame.cache_entry = entry
+        frame.locations = list(entry['locations'])
+        frame.encodings = list(entry['encodings'])
+
+    def prepare(self, frame):
+        """
+        Kiểm tra frame dùng được: lấy từ cache nếu ảnh đã xử lý gần đây, ngược lại preprocess
+        Returns: False nếu ảnh không đọc được hoặc bị cổng chất lượng loại (frame.reject_reason)
+        """
+        key = self._cache_key(frame)
+        if key is not None and frame.cache_entry is None and frame.locations is None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self._use_entry(frame, entry)
+                return True
+        return frame.cache_entry is not None or self.preprocess(frame) is not None
+
+    def _analyze(self, frame):
+        """detect + encode qua cache (single-flight). Returns: False nếu không dùng cache được"""
+        if frame.cache_entry is not None or frame.locations is not None:
+            return frame.cache_entry is not None
+        key = self._cache_key(frame)
+        if key is None:
+            return False
+
+        def compute():
+            if self._detect(frame) is None:
+                return None
+            return frame.locations, self._encode(frame)
+
+        entry, computed = self.cache.get_or_compute(key, compute)
+        if entry is None:
+            return False
+        if computed:
+            frame.cache_entry = entry
+        else:
+            self._use_entry(frame, entry)
+        return True
+
+    # ---------- Các stage ----------
+    def decode(self, frame):
+        """Returns: ảnh RGB hoặc None nếu không decode được"""
+        # JPEG lớn được decode thẳng về gần kích thước làm việc (stage resize làm nốt)
+        max_width, max_height = self.image_processor.WORKING_SIZE
+        # Key cache tính từ bytes gốc trước khi bỏ chúng đi
+        self._cache_key(frame)
+
+        def run():
+            if frame.image is None and frame.data is not None:
+                frame.image = self.image_processor.load_image_from_bytes(frame.data, max_width, max_height)
+            elif frame.image is None and frame.base64_data is not None:
+                frame.image = self.image_processor.load_image_from_base64(frame.base64_data, max_width, max_height)
+            frame.data = frame.base64_data = None
+        self._run(frame, 'decode', run)
+        return frame.image
+
+    def gate(self, frame):
+        """
+        Cổng chất lượng trên thumbnail xám (sau decode, trước resize / enhance / detect)
+        Returns: True nếu frame dùng được; False nếu ảnh lỗi hoặc bị loại (frame.reject_reason)
+        """
+        if self.decode(frame) is None:
+            return False
+        if self.quality_gate:
+            def run():
+                frame.reject_reason, frame.quality = self.image_processor.assess_quality(frame.image)
+            self._run(frame, 'gate', run)
+        return frame.reject_reason is None
+
+    def reject_message(self, frame):
+        """Thông báo lỗi cho frame không dùng được"""
+        return self.image_processor.QUALITY_MESSAGES.get(frame.reject_reason, "Invalid image")
+
+    def preprocess(self, frame):
+        """decode -> gate -> resize -> enhance. Returns: ảnh đã xử lý hoặc None (ảnh lỗi / bị loại)"""
+        if not self.gate(frame):
+            return None
+
+        def resize():
+            frame.image = self.image_processor.resize_image(frame.image)
+
+        def enhance():
+            # Dùng lại thống kê độ sáng của cổng chất lượng (đo trước resize, không đổi đáng kể)
+            frame.image, frame.enhancement = self.image_processor.adaptive_enhance(frame.image, frame.quality)
+
+        self._run(frame, 'resize', resize)
+        self._run(frame, 'enhance', enhance)
+        return frame.image
+
+    def _detect(self, frame):
+        if self.preprocess(frame) is None:
+            return None
+
+        def run():
+            frame.locations = self.face_detector.detect_faces(frame.image)
+        self._run(frame, 'detect', run)
+        return frame.locations
+
+    def _encode(self, frame):
+        locations = self._detect(frame) or []
+
+        def run():
+            frame.encodings = self.face_detector.get_face_encodings(frame.image, locations) if locations else []
+        self._run(frame, 'encode', run)
+        return frame.encodings
+
+    def detect(self, frame):
+        """Returns: list face locations (rỗng nếu ảnh lỗi hoặc không có mặt)"""
+        if self._analyze(frame):
+            return frame.locations
+        return self._detect(frame) or []
+
+    def encode(self, frame):
+        """Returns: list encoding theo thứ tự frame.locations"""
+        if self._analyze(frame):
+            return frame.encodings
+        return self._encode(frame)
+
+    def single_encoding(self, frame):
+        """
+        Encoding của khuôn mặt duy nhất trong frame
+        Returns: (encoding hoặc None, message)
+        """
+        if not self.prepare(frame):
+            return None, self.reject_message(frame)
+        locations = self.detect(frame)
+        if len(locations) == 0:
+            return None, "No face detected"
+        if len(locations) > 1:
+            return None, "Multiple faces detected. Please ensure only one face is visible"
+        encodings = self.encode(frame)
+        if len(encodings) == 0:
+            return None, "Could not encode face"
+        return encodings[0], "Success"
+
+    def match(self, frame, match_fn, gallery=None, match_key=None):
+        """
+        Stage cuối: frame.matches = match_fn(encodings). Returns: frame.matches
+        gallery, match_key: dùng lại kết quả match trong cache khi ảnh, tham số,
+        gallery và version (kể cả roster) đều không đổi
+        """
+        encodings = self.encode(frame)
+        entry = frame.cache_entry
+        use_cache = entry is not None and gallery is not None and match_key is not None
+
+        def run():
+            if use_cache:
+                frame.matches = self.cache.get_match(entry, gallery, match_key)
+                if frame.matches is not None:
+                    return
+            frame.matches = match_fn(encodings)
+            if use_cache:
+                self.cache.put_match(entry, gallery, match_key, frame.matches)
+        self._run(frame, 'match', run)
+        return frame.matches
@@ -0,0 +1,153 @@
+import time
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from config import Config
+
+# Hash nhanh hơn cho ảnh lớn nếu có xxhash
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+
+class RecognitionCache:
+    """
+    Cache LRU + TTL kết quả detect + encode theo hash nội dung ảnh upload
+    (client retry / kiosk gửi lại cùng frame không phải detect + encode lại)
+    - Key: hash của bytes ảnh nén + tham số pipeline
+    - Single-flight: các request đồng thời cùng key chờ một lần tính duy nhất
+    - Kết quả match lưu kèm gallery (weakref) + version: chỉ dùng lại khi gallery
+      và roster chưa đổi, nên không bao giờ trả về match cũ
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = Config.RECOGNITION_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = Config.RECOGNITION_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(data, params=()):
+        """Key của ảnh: hash bytes ảnh nén + tham số ảnh hưởng kết quả (kích thước, model...)"""
+        if XXHASH_AVAILABLE:
+            digest = xxhash.xxh3_128()
+        else:
+            digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(params).encode('utf-8'))
+        digest.update(data)
+        return digest.digest()
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_locked(self, key, locations, encodings):
+        for encoding in encodings:
+            # Kết quả dùng chung giữa các request: không cho sửa tại chỗ
+            encoding.flags.writeable = False
+        entry = {
+            'locations': locations,
+            'encodings': encodings,
+            'expires': time.monotonic() + self.ttl,
+            'match': None,
+        }
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get(self, key):
+        """Entry {'locations', 'encodings'} còn hạn hoặc None"""
+        with self._lock:
+            entry = self._get_locked(key)
+            if entry is not None:
+                self.hits += 1
+            return entry
+
+    def put(self, key, locations, encodings):
+        """Lưu kết quả tính ở nơi khác (vd: process worker của batch). Returns: entry"""
+        with self._lock:
+            return self._put_locked(key, locations, encodings)
+
+    def get_or_compute(self, key, compute):
+        """
+        Lấy entry của key, nếu chưa có thì gọi compute() -> (locations, encodings) hoặc None (ảnh lỗi)
+        Request đồng thời cùng key chờ lần tính đang chạy thay vì tính lại
+        Returns: (entry hoặc None, computed)
+        """
+        with self._lock:
+            entry = self._get_locked(key)
+            if entry is not None:
+                self.hits += 1
+                return entry, False
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+                self.misses += 1
+
+        if not leader:
+            event.wait()
+            with self._lock:
+                entry = self._get_locked(key)
+                if entry is not None:
+                    self.coalesced += 1
+                    return entry, False
+            # Lần tính của request kia lỗi: tự tính (không lưu kết quả lỗi)
+            result = compute()
+            if result is None:
+                return None, True
+            with self._lock:
+                return self._put_locked(key, *result), True
+
+        try:
+            result = compute()
+            entry = None
+            if result is not None:
+                with self._lock:
+                    entry = self._put_locked(key, *result)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+        return entry, True
+
+    def get_match(self, entry, gallery, match_key):
+        """Kết quả match đã lưu nếu cùng gallery, cùng version và cùng tham số, ngược lại None"""
+        match = entry.get('match')
+        if match is None:
+            return None
+        gallery_ref, version, cached_key, result = match
+        if gallery_ref() is gallery and version == self._version(gallery) and cached_key == match_key:
+            return result
+        return None
+
+    def put_match(self, entry, gallery, match_key, result):
+        entry['match'] = (weakref.ref(gallery), self._version(gallery), match_key, result)
+
+    @staticmethod
+    def _version(gallery):
+        return gallery.version, gallery.partitions_version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'coalesced': self.coalesced}
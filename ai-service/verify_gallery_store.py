@@ -0,0 +1,67 @@
+"""
+Kiểm tra / sửa store gallery (snapshot .npy + log) sau crash
+- Kiểm tra CRC32 của từng file snapshot theo MANIFEST.json, đuôi log, file CURRENT
+  và các thư mục snapshot ghi dở (.gen-<n>.tmp)
+- --repair: cắt đuôi log hỏng, xóa thư mục tạm, tách snapshot hỏng ra (.gen-<n>.damaged)
+  và trỏ CURRENT về snapshot hợp lệ mới nhất; log của snapshot hỏng được replay lên snapshot
+  đó thành generation mới (đăng ký chỉ nằm trong log không bị mất)
+
+Nên dừng các service đang ghi trước khi chạy --repair.
+
+Chạy: python verify_gallery_store.py [--store data/encodings/gallery] [--repair]
+"""
+import os
+import sys
+import argparse
+
+from config import Config
+from models.gallery_store import GalleryStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=Config.GALLERY_SNAPSHOT_PATH, help='thư mục store')
+    parser.add_argument('--repair', action='store_true', help='sửa các lỗi tìm thấy')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.store):
+        print(f"❌ Store not found: {args.store}")
+        sys.exit(1)
+
+    store = GalleryStore(args.store)
+    current = store.current_generation()
+    generations = store.generations()
+    print(f"🔍 {args.store}: CURRENT = {current}, generations = {generations}")
+
+    healthy = True
+    for name in os.listdir(store.root):
+        if name.startswith('.gen-') and name.endswith('.tmp'):
+            print(f"⚠️ Unfinished snapshot {name}")
+            healthy = False
+    if current is not None and current not in generations:
+        print(f"❌ CURRENT points to missing generation {current}")
+        healthy = False
+    for generation in generations:
+        problems = store.verify(generation)
+        if problems:
+            print(f"❌ Generation {generation}: {'; '.join(problems)}")
+            healthy = healthy and all(p.startswith('no manifest') for p in problems)
+        else:
+            print(f"✅ Generation {generation}: OK ({store.log(generation).size()} bytes of log)")
+
+    if healthy:
+        print("✅ Store is healthy")
+        return
+    if not args.repair:
+        print("ℹ️ Run with --repair to fix")
+        sys.exit(1)
+
+    with store.locked():
+        actions = store.repair()
+    for action in actions:
+        print(f"🔧 {action}")
+    print(f"✅ Repaired, CURRENT = {store.current_generation()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -166,25 +166,26 @@ class AIService {
       let lastError;
       for (let attempt = 0; attempt <= this.maxRetries; attempt++) {
         try {
-          const formData = new FormData();
-          formData.append('image_url', uploadResult.secure_url);
-          formData.append('min_confidence', this.minConfidence);
-
+          // Send the image itself as base64 JSON; 4xx (no face, low quality, no match) is final, not retried
           const response = await axios.post(
             `${this.serviceUrl}/api/face/recognize`,
-            formData,
+            { image: imageBase64 },
             {
-              headers: formData.getHeaders(),
-              timeout: this.timeout
+              timeout: this.timeout,
+              validateStatus: status => status < 500
             }
           );
 
-          if (response.data.success && response.data.recognized) {
+          // Result is nested under data: recognized, student_id, confidence (%), margin, candidates
+          const result = response.data.data || {};
+
+          if (response.data.success && result.recognized) {
             const processingTime = Date.now() - startTime;
+            const best = (result.candidates || [])[0] || {};
 
             // Find student by code
             const student = await User.findOne({
-              studentCode: response.data.student_id,
+              studentCode: result.student_id,
               role: 'student'
             });
 
@@ -199,10 +200,11 @@ class AIService {
               success: true,
               recognized: true,
               studentId: student._id.toString(),
-              studentCode: response.data.student_id,
-              studentName: response.data.student_name || student.fullName,
-              confidence: response.data.confidence,
-              distance: response.data.distance,
+              studentCode: result.student_id,
+              studentName: student.fullName,
+              confidence: result.confidence,
+              distance: best.distance,
+              margin: result.margin,
               imageUrl: uploadResult.secure_url,
               processingTime,
               message: 'Face recognized successfully'
@@ -212,7 +214,7 @@ class AIService {
               success: false,
               recognized: false,
               message: response.data.message || 'Face not recognized',
-              confidence: response.data.confidence || 0
+              confidence: result.confidence || 0
             };
           }
 